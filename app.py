@@ -6,27 +6,140 @@
 """
 
 import os
+import csv
+import atexit
 import json
+import math
 import time
+import queue
+import random
+import select
+import socket
+import base64
+import hashlib
+import hmac
+import gzip
 import logging
+import bisect
+import threading
+import mimetypes
+import http.client
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import unquote, parse_qsl, urlsplit
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 
+import click
 import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
 from flask import (
-    Flask, render_template, request, jsonify, redirect, url_for, session, g
+    Flask, render_template, request, jsonify, redirect, url_for, session, g,
+    Response, has_app_context, has_request_context, send_from_directory
 )
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
 from flask_cors import CORS
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from apscheduler.schedulers.background import BackgroundScheduler
+from werkzeug.utils import safe_join
 
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# LOG_LEVELS и LOG_SAMPLING — пары "логгер=значение" через запятую, например
+# LOG_LEVELS="apscheduler=WARNING" LOG_SAMPLING="NFO_Liga.requests=0.05"
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # text | json
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_SAMPLING = os.environ.get('LOG_SAMPLING', '')  # доля записей ниже WARNING, которая пишется
+LOG_ASYNC = os.environ.get('LOG_ASYNC', '1') == '1'  # запись в лог из отдельного потока
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Стандартные поля LogRecord; все остальное пришло через extra= и попадает в JSON
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-запись на строку: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _LOG_RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю записей ниже WARNING; доля ищется по логгеру и его родителям"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._resolved = {}
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, parts = 1.0, name.split('.')
+            for i in range(len(parts), 0, -1):
+                if '.'.join(parts[:i]) in self.rates:
+                    rate = self.rates['.'.join(parts[:i])]
+                    break
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self._rate(record.name)
+
+class LazyQueueHandler(QueueHandler):
+    """Кладет запись в очередь как есть: сообщение форматируется в потоке
+    QueueListener, а не в потоке запроса"""
+
+    def prepare(self, record):
+        return record
+
+def _parse_log_pairs(value, convert):
+    pairs = {}
+    for item in value.split(','):
+        name, _, setting = item.strip().partition('=')
+        if name and setting:
+            pairs[name] = convert(setting.strip())
+    return pairs
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(LOG_TEXT_FORMAT))
+    
+    if LOG_ASYNC:
+        log_queue = queue.SimpleQueue()
+        front = LazyQueueHandler(log_queue)
+        listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+    else:
+        front = handler
+    
+    sampling = _parse_log_pairs(LOG_SAMPLING, float)
+    if sampling:
+        front.addFilter(SamplingFilter(sampling))
+    
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(front)
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in _parse_log_pairs(LOG_LEVELS, str.upper).items():
+        logging.getLogger(name).setLevel(level)
+
+configure_logging()
 logger = logging.getLogger('NFO_Liga')
+# Частые события обычных запросов (профиль, матчи) — их удобно сэмплировать отдельно
+request_logger = logging.getLogger('NFO_Liga.requests')
 
 app = Flask(__name__)
 CORS(app)
@@ -40,6 +153,8 @@ WEEKLY_REWARDS = [300, 200, 100]
 REFERRAL_REWARD_REFERRED = 50
 REFERRAL_REWARD_REFERRER_AFTER_STAKE = 30
 DEFAULT_MARGIN = 0.05  # 5%
+BET_SLIP_MAX_SELECTIONS = 12
+BET_SLIP_MODES = ('singles', 'accumulator')
 
 # XP системы
 XP_REGISTRATION = 50
@@ -53,31 +168,1120 @@ XP_LIKE = 2
 XP_COMMENT = 2
 XP_REFERRAL = 20
 
+# Партиционирование и архив транзакций
+TRANSACTIONS_PARTITIONS_AHEAD = int(os.environ.get('TRANSACTIONS_PARTITIONS_AHEAD', 2))  # месяцев вперёд
+TRANSACTIONS_RETENTION_MONTHS = int(os.environ.get('TRANSACTIONS_RETENTION_MONTHS', 12))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+
+# Сезоны: в горячем расписании только неархивные сезоны, завершенные
+# переносятся в season_archive командой `flask seasons archive`
+CURRENT_SEASON = os.environ.get('CURRENT_SEASON', '')  # пусто — последний сезон расписания
+SEASON_TOP_PLAYERS = int(os.environ.get('SEASON_TOP_PLAYERS', 20))
+SEASON_CACHE_TTL = int(os.environ.get('SEASON_CACHE_TTL', 3600))  # архив не меняется
+
+# Бэкенд таблицы: 'google' — Google Sheets API, 'local' — файл SQLite (sheets_local.py)
+SHEETS_BACKEND = os.environ.get('SHEETS_BACKEND', 'google')
+SHEETS_LOCAL_PATH = os.environ.get('SHEETS_LOCAL_PATH', 'data/sheets.sqlite3')
+SHEETS_LOCAL_LATENCY_MS = float(os.environ.get('SHEETS_LOCAL_LATENCY_MS', 0))
+
+# Статика: `flask assets build` кладет в STATIC_DIST_DIR копии файлов static/ с хэшем
+# содержимого в имени (и сжатые .gz/.br рядом) — они отдаются с бессрочным кэшем
+STATIC_DIST_DIR = os.environ.get('STATIC_DIST_DIR') or os.path.join(app.static_folder, 'dist')
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STATIC_COMPRESS_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.html', '.txt')
+# 'local' — деградированный режим: при недоступности Google работаем с локальной копией
+SHEETS_FALLBACK = os.environ.get('SHEETS_FALLBACK', '')
+
+# Квоты Google Sheets API (запросов в минуту на проект) и повторы
+SHEETS_READ_QUOTA_PER_MIN = int(os.environ.get('SHEETS_READ_QUOTA_PER_MIN', 60))
+SHEETS_WRITE_QUOTA_PER_MIN = int(os.environ.get('SHEETS_WRITE_QUOTA_PER_MIN', 60))
+SHEETS_BURST = int(os.environ.get('SHEETS_BURST', 10))
+SHEETS_QUEUE_TIMEOUT = float(os.environ.get('SHEETS_QUEUE_TIMEOUT', 20))  # секунды
+SHEETS_MAX_RETRIES = int(os.environ.get('SHEETS_MAX_RETRIES', 5))
+SHEETS_BACKOFF_BASE = 0.5  # секунды
+SHEETS_BACKOFF_MAX = 16
+SHEETS_HTTP_TIMEOUT = float(os.environ.get('SHEETS_HTTP_TIMEOUT', 30))  # секунды
+
+# Live-обновления матчей (SSE)
+MATCHES_LIVE_REFRESH_SECONDS = int(os.environ.get('MATCHES_LIVE_REFRESH_SECONDS', 60))
+MATCHES_CACHE_TTL = int(os.environ.get('MATCHES_CACHE_TTL', 900))  # секунды без сверки с таблицей
+SCHEDULE_VERSION_KEY = os.environ.get('SCHEDULE_VERSION_KEY', 'schedule_version')  # ключ в листе «Таблица»
+SSE_HEARTBEAT_SECONDS = 15
+SSE_SUBSCRIBER_QUEUE_SIZE = 100
+PG_NOTIFY_MAX_PAYLOAD = 7900  # лимит NOTIFY — 8000 байт
+
+# Кэш профилей (в памяти процесса)
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 60))  # секунды
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 10000))
+
+# Реплика для чтения (необязательна)
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL', '')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', 10))
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 30))  # чтение с основной после записи
+READ_YOUR_WRITES_COOKIE = 'nlo_wrote_at'  # время последней записи пользователя (для всех воркеров)
+
+# Авторизация через Telegram WebApp initData
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+# Без токена сессии запросы отклоняются. AUTH_REQUIRED=0 — только для локальной
+# отладки и бенчмарков: тогда user_id берется из параметров запроса без проверки
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', '1') == '1'
+AUTH_INIT_DATA_MAX_AGE = int(os.environ.get('AUTH_INIT_DATA_MAX_AGE', 86400))  # секунды
+SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', 3600))  # секунды
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 50000))
+
+# Ограничение частоты запросов: "запросов/секунд", скользящее окно
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory | postgres
+RATE_LIMITS = {
+    'bet': {
+        'user': os.environ.get('RATE_LIMIT_BET_USER', '10/60'),
+        'global': os.environ.get('RATE_LIMIT_BET_GLOBAL', '1200/60'),
+    },
+    'daily-checkin': {
+        'user': os.environ.get('RATE_LIMIT_CHECKIN_USER', '5/60'),
+        'global': os.environ.get('RATE_LIMIT_CHECKIN_GLOBAL', '1200/60'),
+    },
+    'like': {
+        'user': os.environ.get('RATE_LIMIT_LIKE_USER', '30/60'),
+        'global': os.environ.get('RATE_LIMIT_LIKE_GLOBAL', '6000/60'),
+    },
+    'comment': {
+        'user': os.environ.get('RATE_LIMIT_COMMENT_USER', '5/60'),
+        'global': os.environ.get('RATE_LIMIT_COMMENT_GLOBAL', '600/60'),
+    },
+}
+RATE_LIMIT_MAX_KEYS = 100000  # ключей в памяти до очистки устаревших
+
+# Баны: активные хранятся в памяти, изменения приходят через NOTIFY user_bans
+BAN_RELOAD_SECONDS = int(os.environ.get('BAN_RELOAD_SECONDS', 300))  # страховочная полная перезагрузка
+PERMANENT_BAN_UNTIL = '9999-12-31'
+
+# Ключи идемпотентности (заголовок Idempotency-Key)
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 86400))  # секунды
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 50000))
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # секунды; незавершенный запрос старше считается брошенным
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+# Риск по исходам матчей: поправка коэффициентов на возможную выплату
+LIABILITY_SHADING = float(os.environ.get('LIABILITY_SHADING', 0))  # 0 — без поправки
+LIABILITY_MAX_SHADE = float(os.environ.get('LIABILITY_MAX_SHADE', 0.2))  # не больше 20% от коэффициента
+LIABILITY_MIN_POOL = float(os.environ.get('LIABILITY_MIN_POOL', 1000))  # кредитов; сглаживает малые пулы
+EXPOSURE_RELOAD_SECONDS = 60
+
+# Уведомления в Telegram: outbox в БД и отправка задачей планировщика
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+NOTIFY_RATE_PER_SECOND = float(os.environ.get('NOTIFY_RATE_PER_SECOND', 25))  # на процесс; лимит Telegram ~30/с
+NOTIFY_BURST = int(os.environ.get('NOTIFY_BURST', 30))
+NOTIFY_BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', 50))
+NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 4))  # соединений с Bot API
+NOTIFY_DISPATCH_SECONDS = int(os.environ.get('NOTIFY_DISPATCH_SECONDS', 5))
+NOTIFY_MAX_ATTEMPTS = 5
+NOTIFY_RETRY_MAX_SECONDS = 3600
+NOTIFY_HTTP_TIMEOUT = float(os.environ.get('NOTIFY_HTTP_TIMEOUT', 10))  # секунды
+NOTIFY_RETENTION_DAYS = int(os.environ.get('NOTIFY_RETENTION_DAYS', 7))
+NOTIFY_LEASE_SECONDS = int(os.environ.get('NOTIFY_LEASE_SECONDS', 300))  # после истечения пакет забирается снова
+CHECKIN_REMINDER_HOUR = int(os.environ.get('CHECKIN_REMINDER_HOUR', 19))  # Europe/Zagreb
+
+# Лайки и комментарии к матчам: счетчики и XP копятся в памяти и пишутся пакетами
+SOCIAL_FLUSH_SECONDS = int(os.environ.get('SOCIAL_FLUSH_SECONDS', 5))
+SOCIAL_RECONCILE_SECONDS = int(os.environ.get('SOCIAL_RECONCILE_SECONDS', 600))  # сверка счетчиков с COUNT(*)
+SOCIAL_XP_LIMIT = os.environ.get('SOCIAL_XP_LIMIT', '10/86400')  # действий с XP на пользователя
+COMMENT_MAX_LENGTH = 500
+COMMENTS_PAGE_SIZE = 20
+COMMENTS_MAX_PAGE_SIZE = 100
+
+# Задачи по расписанию выполняет отдельный процесс `flask jobs run`;
+# RUN_SCHEDULER=1 запускает их и в этом процессе (один сервер без воркеров).
+# Планировщик один на базу: второй процесс не получит advisory-блокировку
+RUN_SCHEDULER = os.environ.get('RUN_SCHEDULER', '0') == '1'
+
+# Метрики (формат Prometheus, в памяти процесса)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+class Counter:
+    """Счетчик с метками"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(l, '')) for l in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться"""
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(l, '')) for l in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # метки -> [счетчики корзин..., +Inf, сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(l, '')) for l in self.labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[idx] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + (str(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{n}="' + v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for n, v in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+METRICS = []
+
+def register_metric(metric):
+    METRICS.append(metric)
+    return metric
+
+REQUEST_DURATION = register_metric(Histogram(
+    'nlo_request_duration_seconds', 'Время обработки HTTP-запроса', ('route', 'method', 'status')))
+REQUEST_DB_STATEMENTS = register_metric(Histogram(
+    'nlo_request_db_statements', 'SQL-запросов на один HTTP-запрос', ('route',), COUNT_BUCKETS))
+REQUEST_DB_COMMITS = register_metric(Histogram(
+    'nlo_request_db_commits', 'COMMIT на один HTTP-запрос', ('route',), COUNT_BUCKETS))
+REQUEST_SHEETS_CALLS = register_metric(Histogram(
+    'nlo_request_sheets_calls', 'Вызовов Google Sheets на один HTTP-запрос', ('route',), COUNT_BUCKETS))
+DB_STATEMENTS = register_metric(Counter(
+    'nlo_db_statements_total', 'Всего выполненных SQL-запросов'))
+DB_COMMITS = register_metric(Counter(
+    'nlo_db_commits_total', 'Всего COMMIT'))
+SHEETS_REQUESTS = register_metric(Counter(
+    'nlo_sheets_requests_total', 'Вызовы Google Sheets API', ('op', 'sheet', 'status')))
+SHEETS_DURATION = register_metric(Histogram(
+    'nlo_sheets_request_duration_seconds', 'Время вызова Google Sheets API', ('op', 'sheet')))
+CACHE_REQUESTS = register_metric(Counter(
+    'nlo_cache_requests_total', 'Обращения к кэшам', ('cache', 'result')))
+SHEETS_QUEUE_DEPTH = register_metric(Gauge(
+    'nlo_sheets_queue_depth', 'Запросы к Sheets, ожидающие квоту', ('kind',)))
+SHEETS_RETRIES = register_metric(Counter(
+    'nlo_sheets_retries_total', 'Повторы запросов к Sheets', ('op', 'reason')))
+SHEETS_COALESCED = register_metric(Counter(
+    'nlo_sheets_coalesced_total', 'Чтения Sheets, объединенные с уже выполняющимся', ('op',)))
+SHEETS_THROTTLED = register_metric(Counter(
+    'nlo_sheets_throttled_total', 'Запросы к Sheets, не дождавшиеся квоты', ('kind',)))
+SSE_SUBSCRIBERS = register_metric(Gauge(
+    'nlo_sse_subscribers', 'Открытые SSE-подписки на матчи'))
+JOB_DURATION = register_metric(Histogram(
+    'nlo_job_duration_seconds', 'Длительность задач планировщика', ('job', 'status')))
+DB_READS = register_metric(Counter(
+    'nlo_db_reads_total', 'Маршрутизация чтений: реплика или основная база', ('target', 'reason')))
+RATE_LIMITED = register_metric(Counter(
+    'nlo_rate_limited_total', 'Запросы, отклоненные ограничителем частоты', ('endpoint', 'scope')))
+SCHEDULE_REFRESHES = register_metric(Counter(
+    'nlo_schedule_refreshes_total', 'Сверки расписания с таблицей по результату', ('result',)))
+NOTIFICATIONS = register_metric(Counter(
+    'nlo_notifications_total', 'Уведомления Telegram по результату отправки', ('kind', 'result')))
+SOCIAL_FLUSHES = register_metric(Counter(
+    'nlo_social_flush_rows_total', 'Строки, записанные пакетным сбросом лайков/комментариев', ('table',)))
+
+def _count_request_stat(name):
+    """Увеличивает счетчик текущего HTTP-запроса (g.<name>), если он есть"""
+    if has_app_context():
+        setattr(g, name, g.get(name, 0) + 1)
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Курсор, считающий выполненные SQL-запросы"""
+
+    def execute(self, query, vars=None):
+        DB_STATEMENTS.inc()
+        _count_request_stat('db_statements')
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        DB_STATEMENTS.inc()
+        _count_request_stat('db_statements')
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        DB_STATEMENTS.inc()
+        _count_request_stat('db_statements')
+        return super().copy_expert(sql, file, size)
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Соединение, считающее COMMIT и выдающее InstrumentedCursor"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+
+    def commit(self):
+        DB_COMMITS.inc()
+        _count_request_stat('db_commits')
+        return super().commit()
+
 # Подключение к БД
 def get_db():
     if 'db' not in g:
-        g.db = psycopg2.connect(os.environ['DATABASE_URL'])
+        g.db = psycopg2.connect(
+            os.environ['DATABASE_URL'],
+            connection_factory=InstrumentedConnection
+        )
     return g.db
 
 @app.teardown_appcontext
 def close_db(e=None):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    for name in ('db', 'read_db'):
+        db = g.pop(name, None)
+        if db is not None:
+            db.close()
+
+# LRU-кэш с TTL
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# Кэш ответов /api/profile (ключ — user_id строкой).
+# Каждый воркер держит свой кэш, поэтому TTL ограничивает устаревание
+# данных, изменённых в других процессах.
+_profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+def invalidate_profile(user_id):
+    """Сбрасывает кэшированный профиль пользователя после изменения его данных"""
+    _profile_cache.pop(str(user_id))
+    replica_router.note_write(user_id)
+
+# Чтение с реплики
+class ReplicaRouter:
+    """Решает, можно ли читать с реплики.
+
+    Лаг реплики проверяется не чаще раза в REPLICA_LAG_CHECK_SECONDS (одним
+    потоком, остальные используют прошлый результат). Пользователь, данные
+    которого менялись за последние READ_YOUR_WRITES_SECONDS, читает с основной
+    базы, чтобы сразу видеть свои изменения. Время записи известно процессу,
+    который ее сделал, а остальным воркерам приходит в подписанной cookie
+    READ_YOUR_WRITES_COOKIE вместе со следующим запросом пользователя.
+    """
+
+    def __init__(self):
+        self._healthy = True
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._recent_writers = TTLCache(PROFILE_CACHE_SIZE, READ_YOUR_WRITES_SECONDS)
+
+    def note_write(self, user_id):
+        if DATABASE_REPLICA_URL:
+            self._recent_writers.set(str(user_id), True)
+            # Запись самого пользователя запроса: время уйдет ему в cookie
+            if has_request_context() and str(user_id) == g.get('auth_user_id'):
+                g.wrote_at = int(time.time())
+
+    @staticmethod
+    def write_cookie(user_id, wrote_at):
+        payload = f"{user_id}.{wrote_at}"
+        return f"{wrote_at}.{_sign_session('wrote.' + payload)}"
+
+    def _cookie_wrote_recently(self, user_id):
+        """Была ли запись по подписанной cookie (сделанная, возможно, другим воркером)"""
+        if not has_request_context():
+            return False
+        wrote_at, _, signature = request.cookies.get(READ_YOUR_WRITES_COOKIE, '').partition('.')
+        if SESSION_SECRET is None or not wrote_at.isdigit() \
+                or time.time() - int(wrote_at) > READ_YOUR_WRITES_SECONDS:
+            return False
+        return hmac.compare_digest(self.write_cookie(user_id, wrote_at), f"{wrote_at}.{signature}")
+
+    def mark_down(self):
+        self._healthy = False
+        self._checked_at = time.time()
+
+    def _check_lag(self):
+        cursor = _get_replica_db().cursor()
+        # На простаивающей основной базе replay_timestamp отстает и без лага,
+        # поэтому сначала сравниваем позиции WAL
+        cursor.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery()
+                  OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+            END
+        """)
+        lag = float(cursor.fetchone()[0])
+        healthy = lag <= REPLICA_MAX_LAG_SECONDS
+        if healthy != self._healthy:
+            if healthy:
+                logger.info(f"✅ Реплика догнала основную базу (лаг {lag:.1f} с)")
+            else:
+                logger.warning(f"⚠️ Лаг реплики {lag:.1f} с, чтение переключено на основную базу")
+        self._healthy = healthy
+
+    def route(self, user_id=None):
+        """(читать_с_реплики, причина)"""
+        if not DATABASE_REPLICA_URL:
+            return False, 'disabled'
+        if user_id is not None and (
+            self._recent_writers.get(str(user_id)) or self._cookie_wrote_recently(user_id)
+        ):
+            return False, 'read_your_writes'
+        if time.time() - self._checked_at > REPLICA_LAG_CHECK_SECONDS and self._lock.acquire(blocking=False):
+            try:
+                self._check_lag()
+            except psycopg2.Error as e:
+                logger.warning(f"⚠️ Реплика недоступна: {str(e)}")
+                self._healthy = False
+            finally:
+                self._checked_at = time.time()
+                self._lock.release()
+        return (True, 'replica') if self._healthy else (False, 'lag')
+
+replica_router = ReplicaRouter()
+
+def _get_replica_db():
+    if 'read_db' not in g:
+        db = psycopg2.connect(DATABASE_REPLICA_URL, connection_factory=InstrumentedConnection)
+        # Только чтение и без открытых транзакций, чтобы не мешать применению WAL
+        db.set_session(readonly=True, autocommit=True)
+        g.read_db = db
+    return g.read_db
+
+def get_read_db(user_id=None):
+    """Соединение для запросов только на чтение: реплика, если она настроена,
+    не отстает и пользователь недавно ничего не менял; иначе основная база"""
+    use_replica, reason = replica_router.route(user_id)
+    if use_replica:
+        try:
+            db = _get_replica_db()
+            DB_READS.inc(target='replica', reason=reason)
+            return db
+        except psycopg2.Error as e:
+            logger.warning(f"⚠️ Реплика недоступна: {str(e)}")
+            replica_router.mark_down()
+            reason = 'error'
+    DB_READS.inc(target='primary', reason=reason)
+    return get_db()
+
+# LISTEN/NOTIFY: события из БД для всех воркеров
+class PgListener:
+    """Фоновый поток с отдельным соединением, слушающий каналы NOTIFY.
+    
+    Поток запускается при первой подписке; после разрыва соединения
+    переподключается и вызывает on_reconnect-обработчики (уведомления,
+    пришедшие во время разрыва, потеряны).
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._reconnect_handlers = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, channel, handler, on_reconnect=None):
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(handler)
+            if on_reconnect:
+                self._reconnect_handlers.append(on_reconnect)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pg-listener', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        first = True
+        while True:
+            try:
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                listening = set()
+                if not first:
+                    for handler in list(self._reconnect_handlers):
+                        handler()
+                first = False
+                while True:
+                    with self._lock:
+                        channels = set(self._handlers) - listening
+                    for channel in channels:
+                        cursor.execute(f"LISTEN {channel}")
+                        listening.add(channel)
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        with self._lock:
+                            handlers = list(self._handlers.get(notify.channel, []))
+                        for handler in handlers:
+                            try:
+                                handler(notify.payload)
+                            except Exception as e:
+                                logger.error(f"❌ Ошибка обработчика NOTIFY {notify.channel}: {str(e)}")
+            except Exception as e:
+                logger.error(f"❌ Соединение LISTEN потеряно: {str(e)}")
+                time.sleep(5)
+
+pg_listener = PgListener()
+
+# Авторизация
+class AuthError(Exception):
+    """Неверные initData или токен сессии"""
+
+def _session_secret():
+    """Общий для всех воркеров ключ подписи токенов или None. Случайный ключ
+    процесса не годится: токен одного воркера не прошел бы проверку в другом"""
+    secret = os.environ.get('SESSION_SECRET')
+    if secret:
+        return secret.encode()
+    if TELEGRAM_BOT_TOKEN:
+        return hmac.new(b'NLOSession', TELEGRAM_BOT_TOKEN.encode(), hashlib.sha256).digest()
+    logger.warning("⚠️ Не заданы SESSION_SECRET и TELEGRAM_BOT_TOKEN: токены сессий не выдаются")
+    return None
+
+SESSION_SECRET = _session_secret()
+# Токены, уже прошедшие проверку подписи: token -> (user_id, expires)
+_session_cache = TTLCache(SESSION_CACHE_SIZE, min(SESSION_TOKEN_TTL, 300))
+
+def validate_init_data(init_data):
+    """Проверяет подпись Telegram WebApp initData, возвращает данные пользователя"""
+    if not TELEGRAM_BOT_TOKEN:
+        raise AuthError("TELEGRAM_BOT_TOKEN не задан")
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        raise AuthError("initData не разобраны")
+    received_hash = fields.pop('hash', '')
+    check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b'WebAppData', TELEGRAM_BOT_TOKEN.encode(), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        raise AuthError("Неверная подпись initData")
+    try:
+        auth_date = int(fields.get('auth_date', 0))
+        user = json.loads(fields['user'])
+        user['id'] = int(user['id'])
+    except (KeyError, TypeError, ValueError):
+        raise AuthError("В initData нет пользователя")
+    if time.time() - auth_date > AUTH_INIT_DATA_MAX_AGE:
+        raise AuthError("initData устарели")
+    return user
+
+def _sign_session(payload):
+    digest = hmac.new(SESSION_SECRET, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+def issue_session_token(user_id):
+    """Токен вида user_id.expires.подпись"""
+    expires = int(time.time()) + SESSION_TOKEN_TTL
+    payload = f"{user_id}.{expires}"
+    return f"{payload}.{_sign_session(payload)}", expires
+
+def verify_session_token(token):
+    """Возвращает user_id из токена; подпись проверяется один раз, дальше — по кэшу"""
+    if SESSION_SECRET is None:
+        raise AuthError("Токены сессий не настроены")
+    cached = _session_cache.get(token)
+    if cached is None:
+        payload, _, signature = token.rpartition('.')
+        if not payload or not hmac.compare_digest(_sign_session(payload), signature):
+            raise AuthError("Неверный токен сессии")
+        user_id, _, expires = payload.partition('.')
+        if not user_id.isdigit() or not expires.isdigit():
+            raise AuthError("Неверный токен сессии")
+        cached = (user_id, int(expires))
+        _session_cache.set(token, cached)
+    user_id, expires = cached
+    if expires < time.time():
+        raise AuthError("Токен сессии истек")
+    return user_id
+
+def session_user_id():
+    """id пользователя из токена сессии (Authorization: Bearer) или None"""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return verify_session_token(header[len('Bearer '):].strip())
+    return None
+
+def current_user_id():
+    """id пользователя запроса из токена сессии; с AUTH_REQUIRED=0 (отладка) —
+    из user_id в параметрах или JSON"""
+    if 'auth_user_id' not in g:
+        user_id = session_user_id()
+        if user_id is not None:
+            g.auth_user_id = user_id
+        elif AUTH_REQUIRED:
+            raise AuthError("Требуется авторизация")
+        else:
+            user_id = request.args.get('user_id') or (request.get_json(silent=True) or {}).get('user_id')
+            g.auth_user_id = str(user_id) if user_id else None
+    return g.auth_user_id
+
+# Ограничение частоты запросов
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Превышен лимит запросов, повтор через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+def _parse_rate(value):
+    limit, _, window = value.partition('/')
+    return int(limit), int(window or 60)
+
+class MemoryRateStore:
+    """Счетчики окон в памяти процесса: ключ -> (номер окна, текущее, предыдущее, окно)"""
+
+    def __init__(self):
+        self._windows = {}
+        self._prune_at = RATE_LIMIT_MAX_KEYS
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _shift(entry, index):
+        stored_index, current, previous, _ = entry
+        if stored_index == index - 1:
+            return 0, current
+        if stored_index != index:
+            return 0, 0
+        return current, previous
+
+    def peek(self, key, window, now):
+        entry = self._windows.get(key)
+        return self._shift(entry, int(now // window)) if entry else (0, 0)
+
+    def hit(self, key, window, now):
+        index = int(now // window)
+        with self._lock:
+            entry = self._windows.get(key)
+            current, previous = self._shift(entry, index) if entry else (0, 0)
+            self._windows[key] = (index, current + 1, previous, window)
+            if len(self._windows) > self._prune_at:
+                self._prune(now)
+
+    def _prune(self, now):
+        # Ключ устарел, когда и его текущее окно стало "предыдущим" и закончилось.
+        # Следующая очистка — когда словарь снова вырастет вдвое: в среднем O(1) на запрос
+        self._windows = {
+            k: v for k, v in self._windows.items() if now < (v[0] + 2) * v[3]
+        }
+        self._prune_at = max(RATE_LIMIT_MAX_KEYS, 2 * len(self._windows))
+
+class PostgresRateStore:
+    """Общие для всех воркеров счетчики в таблице rate_limit_counters"""
+
+    def peek(self, key, window, now):
+        index = int(now // window)
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT COALESCE(SUM(hits) FILTER (WHERE window_index = %s), 0),
+                   COALESCE(SUM(hits) FILTER (WHERE window_index = %s), 0)
+            FROM rate_limit_counters
+            WHERE key = %s AND window_index IN (%s, %s)
+        """, (index, index - 1, key, index, index - 1))
+        current, previous = cursor.fetchone()
+        db.commit()
+        return int(current), int(previous)
+
+    def hit(self, key, window, now):
+        index = int(now // window)
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            INSERT INTO rate_limit_counters (key, window_index, hits, expires_at)
+            VALUES (%s, %s, 1, %s)
+            ON CONFLICT (key, window_index) DO UPDATE
+            SET hits = rate_limit_counters.hits + 1
+        """, (key, index, (index + 2) * window))
+        db.commit()
+
+class SlidingWindowLimiter:
+    """Скользящее окно по двум соседним фиксированным окнам: предыдущее
+    учитывается пропорционально непрошедшей доле текущего окна"""
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def _retry_after(current, previous, limit, window, now):
+        """0, если запрос номер current в окне укладывается в лимит, иначе сколько ждать"""
+        elapsed = now % window
+        if previous * (1 - elapsed / window) + current <= limit:
+            return 0
+        accepted = current - 1
+        if accepted >= limit:
+            # Текущее окно исчерпано: ждем следующего и спада его вклада
+            return window - elapsed + window * (1 - (limit - 1) / accepted)
+        # Ждем, пока вклад предыдущего окна не опустится до оставшегося лимита
+        return max(window * (1 - (limit - current) / previous) - elapsed, 1)
+
+    def check_many(self, checks):
+        """checks — [(scope, key, limit, window)]. Сначала проверяются все окна,
+        и только если запрос проходит везде, он учитывается во всех: отклоненные
+        запросы не расходуют лимит. Возвращает (None, 0) или (scope, секунд ждать)"""
+        now = time.time()
+        for scope, key, limit, window in checks:
+            current, previous = self.store.peek(key, window, now)
+            retry_after = self._retry_after(current + 1, previous, limit, window, now)
+            if retry_after:
+                return scope, retry_after
+        for _, key, _, window in checks:
+            self.store.hit(key, window, now)
+        return None, 0
+
+    def check(self, key, limit, window):
+        """Учитывает запрос; возвращает 0 или сколько секунд ждать"""
+        return self.check_many([(None, key, limit, window)])[1]
+
+rate_limiter = SlidingWindowLimiter(
+    PostgresRateStore() if RATE_LIMIT_BACKEND == 'postgres' else MemoryRateStore()
+)
+
+def rate_limited(endpoint):
+    """Проверяет лимиты RATE_LIMITS[endpoint] до обращения к БД и Sheets"""
+    limits = {scope: _parse_rate(value) for scope, value in RATE_LIMITS[endpoint].items()}
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            user_id = current_user_id()
+            checks = [('global', f"{endpoint}:*", *limits['global'])]
+            if user_id:
+                checks.insert(0, ('user', f"{endpoint}:{user_id}", *limits['user']))
+            scope, retry_after = rate_limiter.check_many(checks)
+            if retry_after:
+                RATE_LIMITED.inc(endpoint=endpoint, scope=scope)
+                raise RateLimited(retry_after)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# Идемпотентность POST-запросов
+# (user_id, endpoint, key) -> (хэш тела запроса, статус, JSON ответа)
+_idempotency_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+def _replay_response(status_code, body):
+    response = jsonify(body)
+    response.status_code = status_code
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+class IdempotencyConflict(Exception):
+    """Ключ перехватил повтор запроса, пока этот запрос еще выполнялся"""
+
+def _claim_idempotency_key(user_id, endpoint, key, request_hash):
+    """Резервирует ключ; возвращает (created_at захвата, None) или (None, сохраненный
+    (хэш, статус, ответ))"""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        INSERT INTO idempotency_keys (user_id, endpoint, key, request_hash)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id, endpoint, key) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash, created_at = NOW()
+        WHERE idempotency_keys.status_code IS NULL
+          AND idempotency_keys.created_at < NOW() - %s * INTERVAL '1 second'
+        RETURNING created_at
+    """, (user_id, endpoint, key, request_hash, IDEMPOTENCY_LOCK_TIMEOUT))
+    claimed = cursor.fetchone()
+    stored = None
+    if not claimed:
+        cursor.execute("""
+            SELECT request_hash, status_code, response
+            FROM idempotency_keys
+            WHERE user_id = %s AND endpoint = %s AND key = %s
+        """, (user_id, endpoint, key))
+        stored = cursor.fetchone()
+    db.commit()
+    return (claimed[0] if claimed else None), stored
+
+def store_idempotent_response(cursor, body, status_code=200):
+    """Записывает ответ под Idempotency-Key запроса в транзакции обработчика,
+    перед ее COMMIT: ответ и сама работа фиксируются вместе. Если ключ перехватил
+    повтор (запрос шел дольше IDEMPOTENCY_LOCK_TIMEOUT), бросает IdempotencyConflict —
+    работу нужно откатить"""
+    claim = g.get('idempotency_claim')
+    if claim is None:
+        return
+    user_id, endpoint, key, claimed_at = claim
+    cursor.execute("""
+        UPDATE idempotency_keys SET status_code = %s, response = %s
+        WHERE user_id = %s AND endpoint = %s AND key = %s
+          AND created_at = %s AND status_code IS NULL
+    """, (status_code, json.dumps(body), user_id, endpoint, key, claimed_at))
+    if cursor.rowcount != 1:
+        raise IdempotencyConflict()
+    g.idempotent_response = (status_code, body)
+
+def idempotent(endpoint):
+    """Повтор запроса с тем же Idempotency-Key возвращает сохраненный ответ,
+    не повторяя работу в БД и Sheets.
+
+    Обработчик, который что-то фиксирует в БД, записывает ответ через
+    store_idempotent_response в той же транзакции. Ключ освобождается только
+    если работа не была зафиксирована. Ставится под rate_limited: лимит
+    проверяется до обращения к БД"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key', '').strip()
+            user_id = current_user_id() if key else None
+            if not key or not user_id:
+                return f(*args, **kwargs)
+            if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return jsonify({"error": "Idempotency-Key too long"}), 400
+            
+            cache_key = f"{user_id}:{endpoint}:{key}"
+            request_hash = hashlib.sha256(request.get_data()).hexdigest()
+            claimed_at, stored = None, _idempotency_cache.get(cache_key)
+            if stored is None:
+                claimed_at, stored = _claim_idempotency_key(user_id, endpoint, key, request_hash)
+                if stored is not None and stored[1] is not None:
+                    _idempotency_cache.set(cache_key, stored)
+            if stored is not None:
+                stored_hash, status_code, body = stored
+                if stored_hash != request_hash:
+                    return jsonify({"error": "Idempotency-Key уже использован с другим запросом"}), 422
+                if status_code is None:
+                    return jsonify({"error": "Запрос с этим Idempotency-Key еще выполняется"}), 409
+                return _replay_response(status_code, body)
+            
+            # Ключ наш: условие created_at = claimed_at не дает тронуть ключ,
+            # перехваченный повтором после IDEMPOTENCY_LOCK_TIMEOUT
+            g.idempotency_claim = (user_id, endpoint, key, claimed_at)
+            key_filter = "user_id = %s AND endpoint = %s AND key = %s AND created_at = %s AND status_code IS NULL"
+            key_params = (user_id, endpoint, key, claimed_at)
+            db = get_db()
+            try:
+                response = app.make_response(f(*args, **kwargs))
+            except IdempotencyConflict:
+                db.rollback()
+                return jsonify({"error": "Запрос с этим Idempotency-Key еще выполняется"}), 409
+            except Exception:
+                db.rollback()
+                committed = g.get('idempotent_response')
+                if committed is not None:
+                    # Работа уже зафиксирована вместе с ответом: ключ не освобождаем,
+                    # иначе повтор выполнил бы ее второй раз
+                    logger.exception(f"❌ Ошибка после фиксации запроса {endpoint} (Idempotency-Key {key})")
+                    _idempotency_cache.set(cache_key, (request_hash, *committed))
+                    response = jsonify(committed[1])
+                    response.status_code = committed[0]
+                    return response
+                db.cursor().execute(f"DELETE FROM idempotency_keys WHERE {key_filter}", key_params)
+                db.commit()
+                raise
+            
+            committed = g.get('idempotent_response')
+            if committed is not None:
+                _idempotency_cache.set(cache_key, (request_hash, *committed))
+                return response
+            
+            # Обработчик не записал ответ сам — значит, ничего не зафиксировал
+            # (отказ или ошибка проверки): ответ сохраняется отдельно
+            db.rollback()
+            cursor = db.cursor()
+            body = response.get_json(silent=True)
+            if response.status_code >= 500 or body is None:
+                cursor.execute(f"DELETE FROM idempotency_keys WHERE {key_filter}", key_params)
+            else:
+                cursor.execute(f"""
+                    UPDATE idempotency_keys SET status_code = %s, response = %s
+                    WHERE {key_filter}
+                """, (response.status_code, json.dumps(body), *key_params))
+                _idempotency_cache.set(cache_key, (request_hash, response.status_code, body))
+            db.commit()
+            return response
+        return decorated_function
+    return decorator
 
 # Проверка владельца
 def owner_required(f):
+    """Только владелец с проверенным токеном сессии: user_id из параметров
+    (отладочный режим AUTH_REQUIRED=0) для админских действий не принимается"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user_id = request.args.get('user_id') or request.json.get('user_id')
+        user_id = session_user_id()
+        if user_id is None:
+            raise AuthError("Требуется авторизация")
         if not user_id or str(user_id) != os.environ['OWNER_TELEGRAM_ID']:
             return jsonify({"error": "Доступ запрещен"}), 403
         return f(*args, **kwargs)
     return decorated_function
 
 # Google Sheets API
-def get_sheets_service():
+def _sheets_labels(sheets_request):
+    """Метки метрик для запроса к Sheets: операция и имя листа (без диапазона ячеек)"""
+    op = getattr(sheets_request, 'methodId', '').replace('sheets.spreadsheets.', '') or 'unknown'
+    sheet = '-'
+    uri = getattr(sheets_request, 'uri', '') or ''
+    if '/values/' in uri:
+        range_name = unquote(uri.split('/values/', 1)[1].split('?', 1)[0].split(':', 1)[0])
+        sheet = range_name.split('!', 1)[0]
+    return op, sheet
+
+class SheetsUnavailable(Exception):
+    """Google Sheets не ответил в пределах квоты и повторов"""
+
+    def __init__(self, message, retry_after=SHEETS_QUEUE_TIMEOUT):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Берет маркер; возвращает 0 при успехе или сколько секунд ждать следующего"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+class _InflightRead:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+SHEETS_READ_OPS = ('get', 'values.get', 'values.batchGet')
+SHEETS_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Записи, которые можно безопасно повторить после таймаута или 5xx. Остальные
+# (append, update, batchUpdate) повторяются только после 429: запрос мог уже
+# примениться, и повтор добавил бы, например, вторую строку в «Ставки»
+SHEETS_IDEMPOTENT_WRITE_OPS = ('values.clear',)
+
+class SheetsGovernor:
+    """Единая точка для всех вызовов Sheets API.
+    
+    - одинаковые параллельные чтения объединяются в один запрос;
+    - чтения и записи проходят через маркерные корзины по квоте проекта;
+    - 429/5xx и сетевые ошибки повторяются с экспоненциальной задержкой и jitter;
+      неидемпотентные записи — только после 429 (квота: запрос не выполнялся).
+    """
+
+    def __init__(self, read_per_min, write_per_min, burst, queue_timeout, max_retries):
+        self.buckets = {
+            'read': TokenBucket(read_per_min / 60.0, min(burst, read_per_min)),
+            'write': TokenBucket(write_per_min / 60.0, min(burst, write_per_min))
+        }
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self._waiting = {'read': 0, 'write': 0}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def queue_depth(self):
+        with self._lock:
+            return dict(self._waiting)
+
+    def execute(self, sheets_request):
+        op, sheet = _sheets_labels(sheets_request)
+        if op not in SHEETS_READ_OPS:
+            return self._execute_with_retries(sheets_request, op, sheet, 'write')
+        
+        key = (op, getattr(sheets_request, 'uri', None))
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InflightRead()
+        
+        if not leader:
+            SHEETS_COALESCED.inc(op=op)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = self._execute_with_retries(sheets_request, op, sheet, 'read')
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def _acquire(self, kind):
+        bucket = self.buckets[kind]
+        deadline = time.monotonic() + self.queue_timeout
+        wait = bucket.try_acquire()
+        if not wait:
+            return
+        with self._lock:
+            self._waiting[kind] += 1
+            SHEETS_QUEUE_DEPTH.set(self._waiting[kind], kind=kind)
+        try:
+            while wait:
+                if time.monotonic() + wait > deadline:
+                    SHEETS_THROTTLED.inc(kind=kind)
+                    raise SheetsUnavailable("Превышена квота Google Sheets API", retry_after=wait)
+                time.sleep(wait)
+                wait = bucket.try_acquire()
+        finally:
+            with self._lock:
+                self._waiting[kind] -= 1
+                SHEETS_QUEUE_DEPTH.set(self._waiting[kind], kind=kind)
+
+    def _execute_with_retries(self, sheets_request, op, sheet, kind):
+        # Локальная копия таблицы (sheets_local) квотами не ограничена
+        is_local = (getattr(sheets_request, 'uri', '') or '').startswith('local://')
+        attempt = 0
+        while True:
+            if not is_local:
+                self._acquire(kind)
+            try:
+                return _timed_sheets_call(sheets_request, op, sheet)
+            except Exception as e:
+                reason = _sheets_retry_reason(e)
+                if reason is None or is_local:
+                    raise
+                if kind == 'write' and reason != '429' and op not in SHEETS_IDEMPOTENT_WRITE_OPS:
+                    logger.warning(f"⚠️ Sheets {op} {sheet}: {reason}, запись не повторяется")
+                    raise SheetsUnavailable(
+                        f"Google Sheets API: запись {op} не подтверждена ({reason}), не повторяем"
+                    ) from e
+                if attempt >= self.max_retries:
+                    raise SheetsUnavailable(f"Google Sheets API недоступен ({reason}): {str(e)}") from e
+                SHEETS_RETRIES.inc(op=op, reason=reason)
+                delay = random.uniform(0, min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt))
+                logger.warning(f"⚠️ Sheets {op} {sheet}: {reason}, повтор через {delay:.1f} с")
+                time.sleep(delay)
+                attempt += 1
+
+def _sheets_retry_reason(error):
+    """Причина для повтора запроса к Sheets или None, если ошибка не временная"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is not None:
+        return str(status) if int(status) in SHEETS_RETRY_STATUSES else None
+    if isinstance(error, (socket.timeout, TimeoutError, ConnectionError)):
+        return 'network'
+    return None
+
+def _timed_sheets_call(sheets_request, op, sheet):
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        return _execute_sheets_request(sheets_request)
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        SHEETS_REQUESTS.inc(op=op, sheet=sheet, status=status)
+        SHEETS_DURATION.observe(time.perf_counter() - started, op=op, sheet=sheet)
+
+sheets_governor = SheetsGovernor(
+    SHEETS_READ_QUOTA_PER_MIN, SHEETS_WRITE_QUOTA_PER_MIN, SHEETS_BURST,
+    SHEETS_QUEUE_TIMEOUT, SHEETS_MAX_RETRIES
+)
+
+def sheets_execute(sheets_request):
+    """Выполняет запрос к Sheets API через общий регулятор квот"""
+    _count_request_stat('sheets_calls')
+    return sheets_governor.execute(sheets_request)
+
+def _execute_sheets_request(sheets_request):
+    # Сервис Google один на процесс, а HTTP-клиент берется из пула на время вызова:
+    # httplib2.Http нельзя делить между потоками (и гринлетами в режиме gevent)
+    if sheets_request.uri.startswith('local://') or _google_credentials is None:
+        return sheets_request.execute()
+    http = _borrow_google_http()
+    try:
+        return sheets_request.execute(http=http)
+    finally:
+        _google_http_pool.put(http)
+
+def _borrow_google_http():
+    try:
+        return _google_http_pool.get_nowait()
+    except queue.Empty:
+        import httplib2
+        import google_auth_httplib2
+        return google_auth_httplib2.AuthorizedHttp(
+            _google_credentials, http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT)
+        )
+
+def get_google_sheets_service():
     """Создает и проверяет соединение с Google Sheets API"""
+    global _google_credentials
     try:
         logger.info("🔍 Инициализация Google Sheets API...")
         
@@ -90,6 +1294,10 @@ def get_sheets_service():
             logger.error("❌ Переменная окружения GS_SHEET_ID не установлена")
             return None
         
+        # Клиент Google импортируется при первом обращении к Sheets, а не при старте воркера
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
+        
         # Парсим JSON-ключи
         try:
             creds_info = json.loads(os.environ['GS_CREDS_JSON'])
@@ -108,6 +1316,7 @@ def get_sheets_service():
                 scopes=['https://www.googleapis.com/auth/spreadsheets']
             )
             logger.info("✅ Учетные данные для Google API успешно созданы")
+            _google_credentials = creds
         except Exception as e:
             logger.error(f"❌ Ошибка создания учетных данных: {str(e)}")
             return None
@@ -118,11 +1327,11 @@ def get_sheets_service():
             logger.info("✅ Сервис Google Sheets API успешно создан")
             
             # Проверяем доступ к таблице
-            spreadsheet_id = os.environ['GS_SHEET_ID']
+            spreadsheet_id = get_spreadsheet_id()
             try:
-                sheet_metadata = service.spreadsheets().get(
+                sheet_metadata = sheets_execute(service.spreadsheets().get(
                     spreadsheetId=spreadsheet_id
-                ).execute()
+                ))
                 
                 logger.info(f"✅ Доступ к Google Таблице подтвержден (ID: {spreadsheet_id})")
                 logger.info(f"   Название таблицы: {sheet_metadata.get('properties', {}).get('title', 'Неизвестно')}")
@@ -147,6 +1356,51 @@ def get_sheets_service():
         logger.error(f"❌ Критическая ошибка при инициализации Google Sheets API: {str(e)}")
         return None
 
+_local_sheets_service = None
+_local_sheets_lock = threading.Lock()
+# Сервис googleapiclient (discovery-документ) общий на процесс, а соединения —
+# в пуле _google_http_pool, см. _execute_sheets_request
+_google_sheets_service = None
+_google_sheets_lock = threading.Lock()
+_google_credentials = None
+_google_http_pool = queue.LifoQueue()
+
+def get_spreadsheet_id():
+    return os.environ.get('GS_SHEET_ID', 'local')
+
+def get_local_sheets_service():
+    """Локальная копия таблицы (SQLite), одна на процесс"""
+    global _local_sheets_service
+    with _local_sheets_lock:
+        if _local_sheets_service is None:
+            from sheets_local import LocalSheetsService
+            if SHEETS_LOCAL_PATH != ':memory:' and os.path.dirname(SHEETS_LOCAL_PATH):
+                os.makedirs(os.path.dirname(SHEETS_LOCAL_PATH), exist_ok=True)
+            _local_sheets_service = LocalSheetsService(
+                SHEETS_LOCAL_PATH,
+                spreadsheet_id=get_spreadsheet_id(),
+                latency_ms=SHEETS_LOCAL_LATENCY_MS
+            )
+            logger.info(f"✅ Локальная таблица открыта: {SHEETS_LOCAL_PATH}")
+        return _local_sheets_service
+
+def get_sheets_service():
+    """Возвращает клиент таблицы для бэкенда SHEETS_BACKEND"""
+    if SHEETS_BACKEND == 'local':
+        return get_local_sheets_service()
+    
+    global _google_sheets_service
+    service = _google_sheets_service
+    if service is None:
+        with _google_sheets_lock:
+            if _google_sheets_service is None:
+                _google_sheets_service = get_google_sheets_service()
+            service = _google_sheets_service
+    if service is None and SHEETS_FALLBACK == 'local':
+        logger.warning("⚠️ Google Sheets недоступен, используем локальную копию таблицы")
+        return get_local_sheets_service()
+    return service
+
 def ensure_sheets_structure():
     """Создает листы в Google Sheets, если их нет"""
     logger.info("🔍 Проверка структуры Google Sheets...")
@@ -156,7 +1410,7 @@ def ensure_sheets_structure():
         logger.error("❌ Не удалось подключиться к Google Sheets API")
         return False
     
-    spreadsheet_id = os.environ['GS_SHEET_ID']
+    spreadsheet_id = get_spreadsheet_id()
     
     # Список необходимых листов
     required_sheets = [
@@ -167,9 +1421,9 @@ def ensure_sheets_structure():
     
     try:
         # Получаем текущие листы
-        sheet_metadata = service.spreadsheets().get(
+        sheet_metadata = sheets_execute(service.spreadsheets().get(
             spreadsheetId=spreadsheet_id
-        ).execute()
+        ))
         existing_sheets = [sheet['properties']['title'] for sheet in sheet_metadata.get('sheets', [])]
         
         logger.info(f"   Найдено существующих листов: {len(existing_sheets)}")
@@ -186,10 +1440,10 @@ def ensure_sheets_structure():
                         }
                     }]
                 }
-                service.spreadsheets().batchUpdate(
+                sheets_execute(service.spreadsheets().batchUpdate(
                     spreadsheetId=spreadsheet_id,
                     body=body
-                ).execute()
+                ))
                 created_sheets.append(sheet_name)
                 
                 # Добавляем заголовки
@@ -216,12 +1470,12 @@ def ensure_sheets_structure():
                     headers = [["referrer_id", "referred_id", "timestamp", "reward_granted"]]
                     
                 if headers:
-                    service.spreadsheets().values().update(
+                    sheets_execute(service.spreadsheets().values().update(
                         spreadsheetId=spreadsheet_id,
                         range=f"{sheet_name}!A1",
                         valueInputOption="RAW",
                         body={'values': headers}
-                    ).execute()
+                    ))
         
         if created_sheets:
             logger.info(f"✅ Успешно создано {len(created_sheets)} новых листов: {', '.join(created_sheets)}")
@@ -240,7 +1494,7 @@ def ensure_sheets_structure():
 def ensure_sheets_structure():
     """Создает листы в Google Sheets, если их нет"""
     service = get_sheets_service()
-    spreadsheet_id = os.environ['GS_SHEET_ID']
+    spreadsheet_id = get_spreadsheet_id()
     
     # Список необходимых листов
     required_sheets = [
@@ -250,9 +1504,9 @@ def ensure_sheets_structure():
     ]
     
     # Получаем текущие листы
-    sheet_metadata = service.spreadsheets().get(
+    sheet_metadata = sheets_execute(service.spreadsheets().get(
         spreadsheetId=spreadsheet_id
-    ).execute()
+    ))
     existing_sheets = [sheet['properties']['title'] for sheet in sheet_metadata.get('sheets', [])]
     
     # Создаем отсутствующие листы
@@ -266,10 +1520,10 @@ def ensure_sheets_structure():
                     }
                 }]
             }
-            service.spreadsheets().batchUpdate(
+            sheets_execute(service.spreadsheets().batchUpdate(
                 spreadsheetId=spreadsheet_id,
                 body=body
-            ).execute()
+            ))
             
             # Добавляем заголовки
             headers = []
@@ -295,12 +1549,12 @@ def ensure_sheets_structure():
                 headers = [["referrer_id", "referred_id", "timestamp", "reward_granted"]]
                 
             if headers:
-                service.spreadsheets().values().update(
+                sheets_execute(service.spreadsheets().values().update(
                     spreadsheetId=spreadsheet_id,
                     range=f"{sheet_name}!A1",
                     valueInputOption="RAW",
                     body={'values': headers}
-                ).execute()
+                ))
 
 # Флаг для отслеживания состояния инициализации
 _initialized = False
@@ -615,48 +1869,357 @@ def check_matches_cache_table(cursor, db):
             db.commit()
             logger.info(f"✅ Добавлена колонка {col_name} в таблицу matches_cache")
 
-@app.before_request
-def check_initialization():
-    """Проверяет и запускает инициализацию при первом запросе"""
-    global _initialized
-    if not _initialized:
-        logger.info("🚀 Запуск инициализации приложения...")
-        try:
-            init_database()  # Сначала инициализируем базу данных
-            initialize()     # Затем инициализируем Google Sheets
-            _initialized = True
-            logger.info("✅ Инициализация приложения завершена успешно")
-        except Exception as e:
-            logger.error(f"❌ Критическая ошибка при инициализации: {str(e)}")
-            # Важно: не устанавливаем _initialized = True при ошибке,
-            # чтобы попытаться инициализироваться при следующем запросе
 
-def initialize():
-    """Функция инициализации структуры Google Sheets"""
-    logger.info("🚀 Начало инициализации Google Sheets...")
+# Миграции схемы
+def _month_start(d, offset=0):
+    """Первое число месяца, сдвинутого на offset месяцев от даты d"""
+    month_index = d.year * 12 + (d.month - 1) + offset
+    return d.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+def _transactions_partition_name(month):
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+def ensure_transaction_partitions(cursor, months_ahead=None, since=None, until=None):
+    """Создает месячные партиции transactions.
     
-    # Проверяем доступ к Google Sheets API
-    service = get_sheets_service()
-    if not service:
-        logger.error("❌ Критическая ошибка: не удалось подключиться к Google Sheets API")
-        logger.warning("   Приложение будет работать без интеграции с Google Sheets")
-        return False
+    Диапазон: от месяца since (по умолчанию текущего) до более позднего из
+    until и текущего месяца + months_ahead.
+    """
+    if months_ahead is None:
+        months_ahead = TRANSACTIONS_PARTITIONS_AHEAD
+    current = _month_start(datetime.now(timezone.utc).date())
+    month = min(_month_start(since), current) if since else current
+    last = _month_start(current, months_ahead)
+    if until and _month_start(until) > last:
+        last = _month_start(until)
     
-    # Проверяем структуру
-    try:
-        logger.info("🔍 Проверка структуры Google Sheets...")
-        if ensure_sheets_structure():
-            logger.info("✅ Структура Google Sheets проверена и инициализирована")
-            return True
-        else:
-            logger.warning("⚠️ Не удалось полностью инициализировать структуру Google Sheets")
-            return False
-    except Exception as e:
-        logger.error(f"❌ Критическая ошибка при инициализации Google Sheets: {str(e)}")
+    created = []
+    while month <= last:
+        name = _transactions_partition_name(month)
+        cursor.execute("SELECT to_regclass(%s)", (name,))
+        if not cursor.fetchone()[0]:
+            bounds = f"FROM ('{month.isoformat()}') TO ('{_month_start(month, 1).isoformat()}')"
+            # Строки этого месяца могли уже попасть в transactions_default (обслуживание
+            # не запускалось, импорт вне диапазона) — тогда CREATE ... PARTITION OF
+            # не пройдет. Переносим их в новую таблицу и присоединяем ее партицией
+            cursor.execute("LOCK TABLE transactions_default IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM transactions_default WHERE created_at >= %s AND created_at < %s)",
+                (month, _month_start(month, 1))
+            )
+            if cursor.fetchone()[0]:
+                cursor.execute(f"""
+                    CREATE TABLE {name} (LIKE transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+                    WITH moved AS (
+                        DELETE FROM transactions_default
+                        WHERE created_at >= %s AND created_at < %s
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved;
+                    ALTER TABLE transactions ATTACH PARTITION {name} FOR VALUES {bounds};
+                """, (month, _month_start(month, 1)))
+                logger.info(f"📦 Строки за {month:%Y-%m} перенесены из transactions_default в {name}")
+            else:
+                cursor.execute(f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES {bounds}")
+            created.append(name)
+        month = _month_start(month, 1)
+    if created:
+        logger.info(f"✅ Созданы партиции transactions: {', '.join(created)}")
+    return created
+
+def _migration_partition_transactions(cursor):
+    """Переводит transactions на помесячное партиционирование по created_at"""
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = 'transactions'
+        )
+    """)
+    if cursor.fetchone()[0]:
+        return  # Уже партиционирована (свежая установка из schema.sql)
+    
+    cursor.execute("""
+        ALTER TABLE transactions RENAME TO transactions_legacy;
+        ALTER TABLE transactions_legacy RENAME CONSTRAINT transactions_pkey TO transactions_legacy_pkey;
+        DROP INDEX IF EXISTS idx_transactions_user;
+        DROP INDEX IF EXISTS idx_transactions_time;
+        ALTER SEQUENCE transactions_id_seq AS BIGINT;
         
-        # Показываем более подробную информацию об ошибке
-        logger.error("   Детали ошибки:")
-        logger.error(f"   - Тип ошибки: {type(e).__name__}")
+        CREATE TABLE transactions (
+            id BIGINT NOT NULL DEFAULT nextval('transactions_id_seq'),
+            user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            amount INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK (type IN ('credit', 'xp', 'bet', 'reward')),
+            reason TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id;
+        CREATE TABLE transactions_default PARTITION OF transactions DEFAULT;
+        CREATE INDEX idx_transactions_user ON transactions(user_id);
+        CREATE INDEX idx_transactions_time ON transactions(created_at);
+    """)
+    
+    # Партиции под все месяцы, в которых есть исторические данные
+    cursor.execute("SELECT MIN(created_at), MAX(created_at) FROM transactions_legacy")
+    oldest, newest = cursor.fetchone()
+    ensure_transaction_partitions(
+        cursor,
+        since=oldest.date() if oldest else None,
+        until=newest.date() if newest else None
+    )
+    
+    cursor.execute("""
+        INSERT INTO transactions (id, user_id, amount, type, reason, created_at)
+        SELECT id, user_id, amount, type, reason, created_at FROM transactions_legacy
+    """)
+    cursor.execute("DROP TABLE transactions_legacy")
+
+def _migration_transactions_history_index(cursor):
+    """Составной индекс под keyset-пагинацию истории транзакций"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_time
+            ON transactions(user_id, created_at DESC, id DESC);
+        DROP INDEX IF EXISTS idx_transactions_user;
+    """)
+
+def _migration_rate_limit_counters(cursor):
+    """Счетчики ограничителя частоты для RATE_LIMIT_BACKEND=postgres"""
+    cursor.execute("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+            key TEXT NOT NULL,
+            window_index BIGINT NOT NULL,
+            hits INTEGER NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (key, window_index)
+        )
+    """)
+
+def _migration_users_banned_index(cursor):
+    """Частичный индекс для загрузки активных банов"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_banned
+            ON users(banned_until) WHERE banned_until IS NOT NULL
+    """)
+
+def _migration_idempotency_keys(cursor):
+    """Сохраненные ответы для повторов POST с Idempotency-Key"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id BIGINT NOT NULL,
+            endpoint TEXT NOT NULL,
+            key TEXT NOT NULL,
+            request_hash TEXT NOT NULL,
+            status_code SMALLINT,
+            response JSONB,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (user_id, endpoint, key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at);
+    """)
+
+def _migration_match_exposure(cursor):
+    """Суммы ставок по исходам матчей, обновляются в транзакции ставки"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS match_exposure (
+            match_id TEXT NOT NULL,
+            market TEXT NOT NULL,
+            selection TEXT NOT NULL,
+            stake_total BIGINT NOT NULL DEFAULT 0,
+            bets_count INTEGER NOT NULL DEFAULT 0,
+            potential_payout NUMERIC(14, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (match_id, market, selection)
+        )
+    """)
+
+def _migration_notification_outbox(cursor):
+    """Outbox уведомлений Telegram с одним ожидающим уведомлением на ключ"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            kind TEXT NOT NULL,
+            dedupe_key TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            send_after TIMESTAMP NOT NULL DEFAULT NOW(),
+            sent_at TIMESTAMP
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_notification_outbox_dedupe
+            ON notification_outbox(user_id, dedupe_key) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+            ON notification_outbox(send_after, id) WHERE status = 'pending';
+    """)
+
+def _migration_match_social(cursor):
+    """Лайки, комментарии и агрегированные счетчики матчей"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS match_likes (
+            match_id TEXT NOT NULL,
+            user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (match_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS match_comments (
+            id BIGSERIAL PRIMARY KEY,
+            match_id TEXT NOT NULL,
+            user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            text TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS match_social_counters (
+            match_id TEXT PRIMARY KEY,
+            likes INTEGER NOT NULL DEFAULT 0,
+            comments INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_match_likes_user ON match_likes(user_id);
+        CREATE INDEX IF NOT EXISTS idx_match_comments_match_time
+            ON match_comments(match_id, created_at DESC, id DESC);
+    """)
+
+def _migration_season_archive(cursor):
+    """Архив завершенных сезонов и сезон в истории лидерборда"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS season_archive (
+            season TEXT PRIMARY KEY,
+            archived_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            summary JSONB NOT NULL,
+            standings JSONB NOT NULL,
+            top_scorers JSONB NOT NULL,
+            top_assists JSONB NOT NULL,
+            bettors JSONB NOT NULL,
+            matches JSONB NOT NULL
+        );
+        ALTER TABLE leaderboard_history ADD COLUMN IF NOT EXISTS season TEXT;
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_history_season ON leaderboard_history(season);
+    """)
+
+def _migration_notification_outbox_lease(cursor):
+    """Аренда пакета уведомлений на время отправки (status = 'sending')"""
+    cursor.execute("""
+        ALTER TABLE notification_outbox ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP;
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_lease
+            ON notification_outbox(lease_until) WHERE status = 'sending';
+    """)
+
+# Версионированные миграции: (версия, название, функция(cursor)).
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'partition_transactions', _migration_partition_transactions),
+    (2, 'transactions_history_index', _migration_transactions_history_index),
+    (3, 'rate_limit_counters', _migration_rate_limit_counters),
+    (4, 'users_banned_index', _migration_users_banned_index),
+    (5, 'idempotency_keys', _migration_idempotency_keys),
+    (6, 'match_exposure', _migration_match_exposure),
+    (7, 'notification_outbox', _migration_notification_outbox),
+    (8, 'match_social', _migration_match_social),
+    (9, 'season_archive', _migration_season_archive),
+    (10, 'notification_outbox_lease', _migration_notification_outbox_lease),
+]
+
+def apply_migrations(db):
+    """Применяет непримененные миграции из MIGRATIONS, каждую в своей транзакции"""
+    cursor = db.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    db.commit()
+    
+    for version, name, migrate in MIGRATIONS:
+        # Advisory-lock не дает двум воркерам применять миграцию одновременно
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+        cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+        if cursor.fetchone():
+            db.commit()
+            continue
+        
+        logger.info(f"🔧 Применяем миграцию {version}: {name}")
+        try:
+            migrate(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name)
+            )
+            db.commit()
+            logger.info(f"✅ Миграция {version} применена")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"❌ Ошибка миграции {version} ({name}): {str(e)}")
+            raise
+
+@app.before_request
+def check_initialization():
+    """Проверяет и запускает инициализацию при первом запросе"""
+    global _initialized
+    if not _initialized:
+        logger.info("🚀 Запуск инициализации приложения...")
+        try:
+            init_database()  # Сначала инициализируем базу данных
+            try:
+                # Структура users проверяется один раз при старте, а не на каждый запрос профиля
+                db = get_db()
+                check_users_table_structure(db.cursor(), db)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при проверке структуры таблицы users: {str(e)}")
+            try:
+                # Как и users, проверяется один раз при старте, а не в каждом /api/matches
+                db = get_db()
+                check_matches_cache_table(db.cursor(), db)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при проверке структуры таблицы matches_cache: {str(e)}")
+            apply_migrations(get_db())
+            try:
+                # Партиции наперед создает и задача обслуживания: ошибка здесь
+                # не должна останавливать инициализацию каждого воркера
+                ensure_transaction_partitions(get_db().cursor())
+                get_db().commit()
+            except Exception as e:
+                get_db().rollback()
+                logger.error(f"❌ Ошибка при создании партиций transactions: {str(e)}")
+            initialize()     # Затем инициализируем Google Sheets
+            _initialized = True
+            logger.info("✅ Инициализация приложения завершена успешно")
+        except Exception as e:
+            logger.error(f"❌ Критическая ошибка при инициализации: {str(e)}")
+            # Важно: не устанавливаем _initialized = True при ошибке,
+            # чтобы попытаться инициализироваться при следующем запросе
+
+def initialize():
+    """Функция инициализации структуры Google Sheets"""
+    logger.info("🚀 Начало инициализации Google Sheets...")
+    
+    # Проверяем доступ к Google Sheets API
+    service = get_sheets_service()
+    if not service:
+        logger.error("❌ Критическая ошибка: не удалось подключиться к Google Sheets API")
+        logger.warning("   Приложение будет работать без интеграции с Google Sheets")
+        return False
+    
+    # Проверяем структуру
+    try:
+        logger.info("🔍 Проверка структуры Google Sheets...")
+        if ensure_sheets_structure():
+            logger.info("✅ Структура Google Sheets проверена и инициализирована")
+            return True
+        else:
+            logger.warning("⚠️ Не удалось полностью инициализировать структуру Google Sheets")
+            return False
+    except Exception as e:
+        logger.error(f"❌ Критическая ошибка при инициализации Google Sheets: {str(e)}")
+        
+        # Показываем более подробную информацию об ошибке
+        logger.error("   Детали ошибки:")
+        logger.error(f"   - Тип ошибки: {type(e).__name__}")
         logger.error(f"   - Сообщение: {str(e)}")
         
         # Проверяем, есть ли у сервисного аккаунта доступ
@@ -670,132 +2233,452 @@ def initialize():
         
         return False
 
+# Метрики HTTP-запросов
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def set_read_your_writes_cookie(response):
+    """Время записи пользователя — в cookie, чтобы другие воркеры тоже читали с основной базы"""
+    wrote_at = g.get('wrote_at')
+    if wrote_at is not None and SESSION_SECRET is not None:
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE,
+            ReplicaRouter.write_cookie(g.auth_user_id, wrote_at),
+            max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax', secure=request.is_secure
+        )
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            route=route, method=request.method, status=response.status_code
+        )
+        REQUEST_DB_STATEMENTS.observe(g.get('db_statements', 0), route=route)
+        REQUEST_DB_COMMITS.observe(g.get('db_commits', 0), route=route)
+        REQUEST_SHEETS_CALLS.observe(g.get('sheets_calls', 0), route=route)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики процесса в текстовом формате Prometheus"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"error": "Доступ запрещен"}), 403
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# Риск по исходам матчей
+class ExposureBook:
+    """Суммы ставок и возможных выплат по исходам в памяти процесса:
+    (match_id, рынок) -> {исход: (сумма ставок, возможная выплата)}.
+
+    Рынок читается из match_exposure по первичному ключу при первом обращении
+    (и раз в EXPOSURE_RELOAD_SECONDS), дальше обновляется по NOTIFY
+    match_exposure — расчет коэффициента не делает агрегирующих запросов.
+    """
+
+    def __init__(self):
+        self._markets = {}
+        self._listening = False
+        self._lock = threading.Lock()
+
+    def _market(self, match_id, market):
+        key = (match_id, market)
+        entry = self._markets.get(key)
+        if entry is not None and time.time() - entry[0] < EXPOSURE_RELOAD_SECONDS:
+            return entry[1]
+        with self._lock:
+            if not self._listening:
+                pg_listener.subscribe('match_exposure', self.apply_payload, on_reconnect=self.clear)
+                self._listening = True
+        cursor = get_db().cursor()
+        cursor.execute("""
+            SELECT selection, stake_total, potential_payout
+            FROM match_exposure
+            WHERE match_id = %s AND market = %s
+        """, (match_id, market))
+        book = {row[0]: (int(row[1]), float(row[2])) for row in cursor.fetchall()}
+        self._markets[key] = (time.time(), book)
+        return book
+
+    def apply(self, update):
+        entry = self._markets.get((update['match_id'], update['market']))
+        if entry is not None:
+            entry[1][update['selection']] = (update['stake_total'], update['potential_payout'])
+
+    def apply_payload(self, payload):
+        self.apply(json.loads(payload))
+
+    def clear(self):
+        self._markets = {}
+
+    def shade(self, match_id, market, selection, odds):
+        """Снижает коэффициент исхода, выплата по которому превышает весь пул рынка"""
+        if LIABILITY_SHADING <= 0:
+            return odds
+        book = self._market(match_id, market)
+        pool = sum(stake for stake, _ in book.values())
+        liability = book.get(selection, (0, 0.0))[1] - pool
+        if liability <= 0:
+            return odds
+        shade = min(LIABILITY_MAX_SHADE, LIABILITY_SHADING * liability / max(pool, LIABILITY_MIN_POOL))
+        return round(max(1.01, odds * (1 - shade)), 2)
+
+exposure_book = ExposureBook()
+
+def record_exposure(cursor, legs):
+    """Добавляет ставки в match_exposure в текущей транзакции.
+
+    legs — {(match_id, market, selection): [сумма ставок, число ставок,
+    возможная выплата]}. Один upsert на все исходы в порядке ключа:
+    параллельные купоны блокируют общие строки в одном порядке и не
+    взаимоблокируются. Возвращает новые суммы для exposure_book.apply
+    после COMMIT; остальные воркеры получат их по NOTIFY"""
+    rows = execute_values(cursor, """
+        INSERT INTO match_exposure (match_id, market, selection, stake_total, bets_count, potential_payout)
+        VALUES %s
+        ON CONFLICT (match_id, market, selection) DO UPDATE
+        SET stake_total = match_exposure.stake_total + EXCLUDED.stake_total,
+            bets_count = match_exposure.bets_count + EXCLUDED.bets_count,
+            potential_payout = match_exposure.potential_payout + EXCLUDED.potential_payout,
+            updated_at = NOW()
+        RETURNING match_id, market, selection, stake_total, potential_payout
+    """, [(*key, stake, count, round(payout, 2)) for key, (stake, count, payout) in sorted(legs.items())],
+        page_size=len(legs), fetch=True)
+    updates = [
+        {
+            'match_id': match_id, 'market': market, 'selection': selection,
+            'stake_total': int(stake_total), 'potential_payout': float(potential_payout)
+        }
+        for match_id, market, selection, stake_total, potential_payout in rows
+    ]
+    cursor.execute(
+        "SELECT pg_notify('match_exposure', payload) FROM unnest(%s::text[]) AS payload",
+        ([json.dumps(update) for update in updates],)
+    )
+    return updates
+
+# Баны пользователей
+class BanRegistry:
+    """Активные баны процесса: user_id -> момент окончания (time.time()).
+
+    Загружается одним запросом по частичному индексу idx_users_banned,
+    дальше обновляется точечно по NOTIFY user_bans; после разрыва LISTEN
+    и раз в BAN_RELOAD_SECONDS перечитывается целиком.
+    """
+
+    def __init__(self):
+        self._bans = {}
+        self._loaded_at = None
+        self._listening = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.time() - loaded_at < BAN_RELOAD_SECONDS:
+            return
+        with self._lock:
+            if self._loaded_at is not loaded_at:
+                return
+            if not self._listening:
+                pg_listener.subscribe('user_bans', self.apply_payload, on_reconnect=self.invalidate)
+                self._listening = True
+            cursor = get_db().cursor()
+            cursor.execute("""
+                SELECT id, EXTRACT(EPOCH FROM banned_until - NOW())
+                FROM users
+                WHERE banned_until > NOW()
+            """)
+            now = time.time()
+            self._bans = {str(user_id): now + float(left) for user_id, left in cursor.fetchall()}
+            self._loaded_at = now
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def apply(self, user_id, seconds_left):
+        if seconds_left is None or seconds_left <= 0:
+            self._bans.pop(str(user_id), None)
+        else:
+            self._bans[str(user_id)] = time.time() + seconds_left
+
+    def apply_payload(self, payload):
+        data = json.loads(payload)
+        self.apply(data['user_id'], data.get('seconds_left'))
+
+    def banned_until(self, user_id):
+        """Момент окончания бана или None; без обращения к БД после загрузки"""
+        self._ensure_loaded()
+        expires = self._bans.get(str(user_id))
+        if expires is None:
+            return None
+        if expires <= time.time():
+            self._bans.pop(str(user_id), None)
+            return None
+        return expires
+
+ban_registry = BanRegistry()
+
+@app.before_request
+def enforce_bans():
+    """Отклоняет запросы заблокированных пользователей до обработчиков"""
+    if not request.path.startswith('/api/'):
+        return None
+    try:
+        user_id = current_user_id()
+    except AuthError:
+        return None  # Ошибку авторизации вернет сам обработчик
+    if not user_id or user_id == os.environ.get('OWNER_TELEGRAM_ID'):
+        return None
+    expires = ban_registry.banned_until(user_id)
+    if expires is None:
+        return None
+    return jsonify({
+        "error": "Аккаунт заблокирован",
+        "banned_until": datetime.fromtimestamp(expires, timezone.utc).isoformat()
+    }), 403
+
+def set_user_ban(admin_id, target_user_id, hours, reason):
+    """Ставит (hours=None — бессрочно) или снимает (hours=0) бан,
+    пишет admin_actions_log и рассылает NOTIFY; None — пользователя нет"""
+    db = get_db()
+    cursor = db.cursor()
+    action = 'unban' if hours == 0 else 'ban'
+    cursor.execute("""
+        WITH changed AS (
+            UPDATE users
+            SET banned_until = CASE
+                WHEN %(action)s = 'unban' THEN NULL
+                ELSE COALESCE(NOW() + %(hours)s * INTERVAL '1 hour', %(permanent)s::timestamp)
+            END
+            WHERE id = %(target)s
+            RETURNING id, banned_until
+        ), logged AS (
+            INSERT INTO admin_actions_log (admin_id, action, details)
+            SELECT %(admin)s, %(action)s, jsonb_build_object(
+                'target_user_id', id, 'banned_until', banned_until, 'reason', %(reason)s
+            )
+            FROM changed
+        )
+        SELECT id, EXTRACT(EPOCH FROM banned_until - NOW()), banned_until FROM changed
+    """, {
+        'action': action, 'hours': hours, 'permanent': PERMANENT_BAN_UNTIL,
+        'target': target_user_id, 'admin': admin_id, 'reason': reason
+    })
+    row = cursor.fetchone()
+    if not row:
+        db.rollback()
+        return None
+    seconds_left = float(row[1]) if row[1] is not None else None
+    cursor.execute("SELECT pg_notify('user_bans', %s)", (
+        json.dumps({'user_id': str(row[0]), 'seconds_left': seconds_left}),
+    ))
+    db.commit()
+    ban_registry.apply(row[0], seconds_left)
+    invalidate_profile(row[0])
+    logger.info(f"🚫 {action} пользователя {row[0]} (админ {admin_id})")
+    return {'user_id': row[0], 'banned_until': row[2]}
+
+# Статика и страница Web App
+_asset_manifest = None
+
+def load_asset_manifest():
+    """Манифест сборки {путь в static/: путь с хэшем} (один раз на процесс; без сборки — пустой)"""
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(os.path.join(STATIC_DIST_DIR, 'manifest.json'), 'r', encoding='utf-8') as f:
+                _asset_manifest = json.load(f)
+        except FileNotFoundError:
+            _asset_manifest = {}
+    return _asset_manifest
+
+@app.template_global()
+def asset_url(path):
+    """URL файла из static/: собранная копия с хэшем, если она есть"""
+    hashed = load_asset_manifest().get(path)
+    if hashed:
+        return url_for('dist_asset', filename=hashed)
+    return url_for('static', filename=path)
+
+@app.route('/assets/<path:filename>')
+def dist_asset(filename):
+    """Собранная статика: имя меняется вместе с содержимым, поэтому кэш — навсегда.
+    Сжатая копия выбирается по Accept-Encoding."""
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        path = safe_join(STATIC_DIST_DIR, filename + suffix)
+        if request.accept_encodings[encoding] and path and os.path.isfile(path):
+            response = send_from_directory(STATIC_DIST_DIR, filename + suffix, mimetype=mimetype,
+                                           max_age=STATIC_IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(STATIC_DIST_DIR, filename, max_age=STATIC_IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Отрисованная index.html по значению OWNER_TELEGRAM_ID: (ETag, тело, тело в gzip).
+# Манифест и каталог ачивок читаются один раз, так что после `flask assets build`
+# воркеры нужно перезапустить
+_index_pages = {}
+
+def render_index_page(owner_telegram_id):
+    # Каталог ачивок и адреса картинок встраиваются в страницу — без отдельных запросов
+    boot = {
+        'achievements': load_achievements(),
+        'assets': {path: asset_url(path) for path in load_asset_manifest() if path.startswith('img/')}
+    }
+    body = render_template('index.html', owner_telegram_id=owner_telegram_id, boot=boot).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:20]
+    return etag, body, gzip.compress(body, 9, mtime=0)
+
 # API для фронтенда
 @app.route('/')
 def index():
     owner_telegram_id = os.environ.get('OWNER_TELEGRAM_ID', '')
-    return render_template('index.html', owner_telegram_id=owner_telegram_id)
+    page = _index_pages.get(owner_telegram_id)
+    if page is None or app.debug:
+        page = _index_pages[owner_telegram_id] = render_index_page(owner_telegram_id)
+    etag, body, compressed = page
+    
+    # У сжатого и несжатого тела разные байты — и свой сильный ETag у каждого
+    if request.accept_encodings['gzip']:
+        response = Response(compressed, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+        etag += '-gz'
+    else:
+        response = Response(body, mimetype='text/html')
+    # Страница ссылается на файлы текущей сборки — браузер перепроверяет ее по ETag
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+PROFILE_COLUMNS = """
+    u.id, u.username, u.display_name, u.credits, u.xp, u.level,
+    u.daily_checkin_streak,
+    COALESCE((
+        SELECT json_agg(json_build_object(
+                   'key', a.achievement_key,
+                   'tier', a.tier,
+                   'unlocked_at', a.unlocked_at
+               ) ORDER BY a.unlocked_at)
+        FROM achievements_unlocked a
+        WHERE a.user_id = u.id
+    ), '[]'::json)
+"""
+
+def build_profile(row):
+    """Формирует ответ /api/profile из строки PROFILE_COLUMNS"""
+    user_id, username, display_name, credits, xp, level, streak, achievements = row
+    level = level if level is not None else 1
+    return {
+        'id': user_id,
+        'username': username or f"user_{user_id}",
+        'display_name': display_name or f"Игрок {user_id}",
+        'credits': credits if credits is not None else FIRST_LOGIN_CREDITS,
+        'xp': xp if xp is not None else XP_REGISTRATION,
+        'level': level,
+        'daily_streak': streak if streak is not None else 0,
+        'next_level_xp': calculate_xp_for_level(level + 1),
+        'achievements': achievements or []
+    }
+
+@app.route('/api/auth/telegram', methods=['POST'])
+def auth_telegram():
+    """Вход по initData Telegram WebApp: выдает короткоживущий токен сессии"""
+    if not TELEGRAM_BOT_TOKEN or SESSION_SECRET is None:
+        return jsonify({"error": "Авторизация не настроена"}), 503
+    init_data = (request.get_json(silent=True) or {}).get('init_data')
+    if not init_data:
+        return jsonify({"error": "init_data required"}), 400
+    
+    user = validate_init_data(init_data)
+    token, expires = issue_session_token(user['id'])
+    return jsonify({
+        "token": token,
+        "expires_at": expires,
+        "user_id": str(user['id'])
+    })
 
 @app.route('/api/profile', methods=['GET'])
 def get_profile():
-    user_id = request.args.get('user_id')
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "user_id required"}), 400
     
-    logger.info(f"🔍 Запрос профиля для пользователя {user_id}")
+    cached = _profile_cache.get(str(user_id))
+    if cached is not None:
+        CACHE_REQUESTS.inc(cache='profile', result='hit')
+        return jsonify(cached)
+    CACHE_REQUESTS.inc(cache='profile', result='miss')
     
-    db = get_db()
-    cursor = db.cursor()
+    request_logger.info("🔍 Запрос профиля для пользователя %s", user_id, extra={'user_id': user_id})
     
-    try:
-        # Принудительно проверяем структуру таблицы users
-        check_users_table_structure(cursor, db)
-    except Exception as e:
-        logger.error(f"❌ Ошибка при проверке структуры таблицы users: {str(e)}")
+    read_db = get_read_db(user_id)
     
-    # Получаем профиль пользователя
+    # Профиль и ачивки одним запросом
     try:
-        cursor.execute("""
-            SELECT id, username, display_name, credits, xp, level, 
-                   daily_checkin_streak, last_checkin_date, created_at, updated_at
-            FROM users 
-            WHERE id = %s
+        read_cursor = read_db.cursor()
+        read_cursor.execute(f"""
+            SELECT {PROFILE_COLUMNS}
+            FROM users u
+            WHERE u.id = %s
         """, (user_id,))
-        user = cursor.fetchone()
+        user = read_cursor.fetchone()
     except Exception as e:
-        logger.error(f"❌ Ошибка при запросе к таблице users: {str(e)}")
-        # Пытаемся восстановить таблицу
-        try:
-            create_minimal_tables(cursor, db)
-            user = None
-        except Exception as e2:
-            logger.error(f"❌ Не удалось восстановить таблицу users: {str(e2)}")
-            return jsonify({"error": "Database error"}), 500
+        logger.error("❌ Ошибка при запросе профиля: %s", e, extra={'user_id': user_id})
+        read_db.rollback()
+        return jsonify({"error": "Database error"}), 500
     
     if not user:
-        logger.info(f"🆕 Регистрация нового пользователя {user_id}")
-        # Регистрация нового пользователя
+        db = get_db()
+        cursor = db.cursor()
+        logger.info("🆕 Регистрация нового пользователя %s", user_id, extra={'user_id': user_id})
+        # Регистрация нового пользователя; ON CONFLICT защищает от
+        # параллельной регистрации при одновременном открытии Web App
         try:
-            # Убедимся, что все колонки существуют
-            cursor.execute("""
-                INSERT INTO users (id, credits, xp, level, 
-                                  daily_checkin_streak, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-                RETURNING id, username, display_name, credits, xp, level, 
-                          daily_checkin_streak, last_checkin_date, created_at, updated_at
+            cursor.execute(f"""
+                WITH u AS (
+                    INSERT INTO users (id, credits, xp, level,
+                                       daily_checkin_streak, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
+                    ON CONFLICT (id) DO UPDATE SET id = EXCLUDED.id
+                    RETURNING *
+                )
+                SELECT {PROFILE_COLUMNS}
+                FROM u
             """, (user_id, FIRST_LOGIN_CREDITS, XP_REGISTRATION, 1, 0))
             user = cursor.fetchone()
             db.commit()
         except Exception as e:
-            logger.error(f"❌ Ошибка при создании пользователя: {str(e)}")
-            
-            # Попробуем упрощенный запрос без некоторых колонок
-            try:
-                cursor.execute("""
-                    INSERT INTO users (id, credits, xp, level, daily_checkin_streak)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id, username, display_name, credits, xp, level, 
-                              daily_checkin_streak, last_checkin_date, created_at, updated_at
-                """, (user_id, FIRST_LOGIN_CREDITS, XP_REGISTRATION, 1, 0))
-                user = cursor.fetchone()
-                db.commit()
-            except Exception as e2:
-                logger.error(f"❌ Критическая ошибка при создании пользователя: {str(e2)}")
-                return jsonify({"error": "Database error"}), 500
+            logger.error("❌ Критическая ошибка при создании пользователя: %s", e, extra={'user_id': user_id})
+            db.rollback()
+            return jsonify({"error": "Database error"}), 500
     
-    # Получаем открытые ачивки
-    achievements = []
-    try:
-        # Проверяем существование таблицы achievements_unlocked
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' AND table_name = 'achievements_unlocked'
-            )
-        """)
-        if cursor.fetchone()[0]:
-            cursor.execute("""
-                SELECT achievement_key, tier, unlocked_at 
-                FROM achievements_unlocked 
-                WHERE user_id = %s
-            """, (user_id,))
-            achievements = cursor.fetchall()
-    except Exception as e:
-        logger.error(f"❌ Ошибка при запросе ачивок: {str(e)}")
-    
-    # Формируем ответ
-    profile = {
-        'id': user[0],
-        'username': user[1] or f"user_{user[0]}",
-        'display_name': user[2] or f"Игрок {user[0]}",
-        'credits': user[3] if user[3] is not None else FIRST_LOGIN_CREDITS,
-        'xp': user[4] if user[4] is not None else XP_REGISTRATION,
-        'level': user[5] if user[5] is not None else 1,
-        'daily_streak': user[6] if user[6] is not None else 0,
-        'next_level_xp': calculate_xp_for_level(user[5] + 1) if user[5] is not None else calculate_xp_for_level(2),
-        'achievements': [{
-            'key': a[0],
-            'tier': a[1],
-            'unlocked_at': a[2].isoformat() if a[2] else None
-        } for a in achievements]
-    }
+    profile = build_profile(user)
+    _profile_cache.set(str(user_id), profile)
     
-    logger.info(f"✅ Профиль пользователя {user_id} успешно загружен")
+    request_logger.info("✅ Профиль пользователя %s успешно загружен", user_id, extra={'user_id': user_id})
     return jsonify(profile)
 
 @app.route('/api/matches', methods=['GET'])
 def get_matches():
     """Возвращает матчи из кеша или обновляет из Google Sheets"""
-    logger.info("🔍 Запрос матчей")
-    
-    db = get_db()
-    cursor = db.cursor()
+    request_logger.info("🔍 Запрос матчей")
     
-    try:
-        # Принудительно проверяем структуру таблицы matches_cache
-        check_matches_cache_table(cursor, db)
-    except Exception as e:
-        logger.error(f"❌ Ошибка при проверке структуры таблицы matches_cache: {str(e)}")
+    cursor = get_read_db().cursor()
     
     # Проверяем актуальность кеша
     try:
@@ -806,17 +2689,21 @@ def get_matches():
         """)
         cache = cursor.fetchone()
     except Exception as e:
-        logger.error(f"❌ Ошибка при запросе кеша матчей: {str(e)}")
+        logger.error("❌ Ошибка при запросе кеша матчей: %s", e)
         cache = None
     
     # ИСПРАВЛЕНИЕ: Работаем с timezone-aware датами
     now = datetime.now(timezone.utc)
     
-    # Если кеш старый или отсутствует - обновляем
-    if not cache or (now - cache[1].replace(tzinfo=timezone.utc)).total_seconds() > 900:  # 15 минут
+    # Если кеш старый или отсутствует - обновляем. Сверка без изменений
+    # не трогает updated_at, поэтому учитываем и время последней сверки
+    if not cache or (now - schedule_state.fresh_since(cache[1])).total_seconds() > MATCHES_CACHE_TTL:
+        CACHE_REQUESTS.inc(cache='matches', result='miss')
         logger.info("🔄 Кеш матчей устарел или отсутствует, обновляем...")
         update_matches_cache()
         
+        # Только что записанный кеш читаем с основной базы
+        cursor = get_db().cursor()
         try:
             cursor.execute("""
                 SELECT data_json, updated_at 
@@ -825,11 +2712,14 @@ def get_matches():
             """)
             cache = cursor.fetchone()
         except Exception as e:
-            logger.error(f"❌ Ошибка при повторном запросе кеша: {str(e)}")
+            logger.error("❌ Ошибка при повторном запросе кеша: %s", e)
             cache = None
     
+    else:
+        CACHE_REQUESTS.inc(cache='matches', result='hit')
+    
     if cache:
-        logger.info(f"✅ Кеш матчей успешно загружен (обновлено: {cache[1].isoformat()})")
+        request_logger.info("✅ Кеш матчей успешно загружен (обновлено: %s)", cache[1])
         return jsonify({
             'matches': cache[0],
             'last_updated': cache[1].isoformat()
@@ -841,16 +2731,77 @@ def get_matches():
             'last_updated': None
         })
 
-def update_matches_cache():
-    """Обновляет кеш матчей из Google Sheets"""
+def diff_matches(old_matches, new_matches):
+    """Изменения расписания: (новые/измененные матчи, id удаленных)"""
+    old_by_id = {m.get('match_id'): m for m in old_matches or []}
+    changed = [m for m in new_matches if old_by_id.get(m.get('match_id')) != m]
+    new_ids = {m.get('match_id') for m in new_matches}
+    removed = [match_id for match_id in old_by_id if match_id not in new_ids]
+    return changed, removed
+
+class ScheduleState:
+    """Что процесс знает о расписании: версия из листа «Таблица» и время
+    последней сверки с таблицей (для проверки свежести кеша без записи в БД)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.checked_at = None
+
+    def mark_checked(self, version):
+        with self._lock:
+            self.version = version
+            self.checked_at = datetime.now(timezone.utc)
+
+    def fresh_since(self, updated_at):
+        """Момент, с которого кеш считается актуальным"""
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+        checked_at = self.checked_at
+        return max(updated_at, checked_at) if checked_at else updated_at
+
+schedule_state = ScheduleState()
+
+def read_schedule_version(service, spreadsheet_id):
+    """Версия расписания из листа «Таблица» (строка key/value с ключом
+    SCHEDULE_VERSION_KEY) или None, если ее никто не ведет"""
+    try:
+        result = sheets_execute(service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range="Таблица!A2:B"
+        ))
+    except SheetsUnavailable:
+        raise
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать версию расписания: {str(e)}")
+        return None
+    for row in result.get('values', []):
+        if len(row) >= 2 and row[0] == SCHEDULE_VERSION_KEY and row[1]:
+            return row[1]
+    return None
+
+def update_matches_cache(force=False):
+    """Обновляет кеш матчей из Google Sheets.
+
+    Сначала читается версия расписания из листа «Таблица» (ее повышает
+    редактор или скрипт таблицы при каждом изменении расписания). Если
+    версия не изменилась с прошлой сверки, расписание не скачивается и БД
+    не трогается. Без версии расписание скачивается, но кеш перезаписывается
+    только при изменившемся содержимом.
+    """
     service = get_sheets_service()
-    spreadsheet_id = os.environ['GS_SHEET_ID']
+    spreadsheet_id = get_spreadsheet_id()
+    
+    version = read_schedule_version(service, spreadsheet_id)
+    if not force and version is not None and version == schedule_state.version:
+        schedule_state.mark_checked(version)
+        SCHEDULE_REFRESHES.inc(result='unchanged_version')
+        return [], []
     
     # Получаем расписание игр
-    result = service.spreadsheets().values().get(
+    result = sheets_execute(service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
         range="Расписание игр!A2:K"
-    ).execute()
+    ))
     rows = result.get('values', [])
     
     matches = []
@@ -870,67 +2821,305 @@ def update_matches_cache():
                 'notes': row[10] if len(row) > 10 else None
             })
     
-    # Сохраняем в кеш
+    # Сохраняем в кеш. FOR UPDATE сериализует параллельные обновления,
+    # чтобы дельта считалась от действительно предыдущего состояния
     db = get_db()
     cursor = db.cursor()
+    cursor.execute("SELECT data_json FROM matches_cache WHERE match_id = 'schedule' FOR UPDATE")
+    previous = cursor.fetchone()
+    # Архивные сезоны не возвращаются в горячее расписание, даже если остались в таблице
+    cursor.execute("SELECT season FROM season_archive")
+    archived = {row[0] for row in cursor.fetchall()}
+    if archived:
+        matches = [m for m in matches if m['season'] not in archived]
+    if previous and previous[0] == matches:
+        db.commit()
+        schedule_state.mark_checked(version)
+        SCHEDULE_REFRESHES.inc(result='unchanged_content')
+        return [], []
     cursor.execute("""
         INSERT INTO matches_cache (match_id, data_json, updated_at)
         VALUES ('schedule', %s, NOW())
         ON CONFLICT (match_id) 
         DO UPDATE SET data_json = EXCLUDED.data_json, updated_at = EXCLUDED.updated_at
     """, (json.dumps(matches),))
+    
+    # Дельта уходит подписчикам всех воркеров через NOTIFY после COMMIT
+    changed, removed = diff_matches(previous[0] if previous else [], matches)
+    if changed or removed:
+        payload = json.dumps({'changed': changed, 'removed': removed}, ensure_ascii=False)
+        if len(payload.encode()) > PG_NOTIFY_MAX_PAYLOAD:
+            payload = json.dumps({'refresh': True})
+        cursor.execute("SELECT pg_notify('matches_delta', %s)", (payload,))
     db.commit()
+    schedule_state.mark_checked(version)
+    SCHEDULE_REFRESHES.inc(result='updated')
+    return changed, removed
 
-@app.route('/api/bet', methods=['POST'])
-def place_bet():
-    """Размещение ставки пользователем"""
-    data = request.json
-    user_id = data.get('user_id')
-    match_id = data.get('match_id')
-    bet_type = data.get('bet_type')  # '1x2', 'total', 'exact_score'
-    selection = data.get('selection')
-    amount = data.get('amount')
+# Live-обновления матчей (Server-Sent Events)
+class MatchesHub:
+    """Раздает дельты расписания всем SSE-подписчикам процесса"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def subscribe(self):
+        with self._lock:
+            if not self._listening:
+                pg_listener.subscribe('matches_delta', self.publish_payload, on_reconnect=self.publish_refresh)
+                self._listening = True
+            subscriber = queue.Queue(maxsize=SSE_SUBSCRIBER_QUEUE_SIZE)
+            self._subscribers.add(subscriber)
+            SSE_SUBSCRIBERS.set(len(self._subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            SSE_SUBSCRIBERS.set(len(self._subscribers))
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {data}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Медленный клиент: вместо накопленных дельт пусть перечитает расписание
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait("event: refresh\ndata: {}\n\n")
+
+    def publish_payload(self, payload):
+        data = json.loads(payload)
+        if data.get('refresh'):
+            self.publish_refresh()
+        else:
+            self.publish('delta', payload)
+
+    def publish_refresh(self):
+        self.publish('refresh', '{}')
+
+matches_hub = MatchesHub()
+
+@app.route('/api/matches/stream', methods=['GET'])
+def stream_matches():
+    """SSE-поток изменений расписания: события delta ({changed, removed}) и refresh.
     
-    if not all([user_id, match_id, bet_type, selection, amount]):
-        return jsonify({"error": "Missing required parameters"}), 400
+    Каждое соединение занимает поток воркера, поэтому для тысяч подписчиков
+    нужен асинхронный воркер (gevent) или отдельный процесс под SSE.
+    """
+    subscriber = matches_hub.subscribe()
+    
+    def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            matches_hub.unsubscribe(subscriber)
     
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def valid_bet_amount(amount):
+    return isinstance(amount, int) and not isinstance(amount, bool) and amount > 0
+
+def place_bets(user_id, bets, response_body):
+    """Списывает кредиты и записывает ставки одной транзакцией.
+
+    bets — список словарей: amount, odds, reason и legs — исходы
+    (match_id, bet_type, selection); у одиночной ставки исход один.
+    response_body(баланс) строит ответ API: он записывается под
+    Idempotency-Key в той же транзакции. Статистика в Sheets и XP
+    обновляются один раз на весь список.
+    Возвращает ответ или None, если кредитов не хватает.
+    """
+    total = sum(bet['amount'] for bet in bets)
     db = get_db()
     cursor = db.cursor()
     
-    # Проверяем баланс
-    cursor.execute("SELECT credits FROM users WHERE id = %s", (user_id,))
-    user = cursor.fetchone()
-    if not user or user[0] < amount:
-        return jsonify({"error": "Insufficient credits"}), 400
+    # Баланс проверяется и списывается одним UPDATE
+    cursor.execute("""
+        UPDATE users
+        SET credits = credits - %s, updated_at = NOW()
+        WHERE id = %s AND credits >= %s
+        RETURNING credits
+    """, (total, user_id, total))
+    balance = cursor.fetchone()
+    if balance is None:
+        db.rollback()
+        return None
+    
+    execute_values(cursor, """
+        INSERT INTO transactions (user_id, amount, type, reason, created_at)
+        VALUES %s
+    """, [(user_id, -bet['amount'], 'bet', bet['reason']) for bet in bets],
+        template="(%s, %s, %s, %s, NOW())")
+    body = response_body(balance[0])
+    store_idempotent_response(cursor, body)
+    
+    # Строки match_exposure — самые горячие: upsert идет последним перед
+    # COMMIT, чтобы их блокировки держались как можно меньше.
+    # Экспресс учитывается в риске каждого исхода полной возможной выплатой,
+    # а в сумме ставок рынка — нет, чтобы не раздувать пул
+    legs = {}
+    for bet in bets:
+        single = len(bet['legs']) == 1
+        payout = round(bet['amount'] * bet['odds'], 2)
+        for leg in bet['legs']:
+            totals = legs.setdefault(tuple(leg), [0, 0, 0.0])
+            totals[0] += bet['amount'] if single else 0
+            totals[1] += 1
+            totals[2] += payout
+    exposure = record_exposure(cursor, legs)
+    db.commit()
+    invalidate_profile(user_id)
+    for update in exposure:
+        exposure_book.apply(update)
+    
+    # Статистика в Google Sheets — после COMMIT, без открытой транзакции.
+    # Ставка уже принята, поэтому сбой Sheets не превращает ответ в ошибку
+    try:
+        update_betting_stats(user_id, total, len(bets))
+    except Exception as e:
+        logger.warning(f"⚠️ Статистика ставок пользователя {user_id} не обновлена в Sheets: {str(e)}")
+    
+    # Начисляем XP за ставки
+    add_xp(user_id, XP_CORRECT_PREDICTION * len(bets),
+           "Ставка размещена" if len(bets) == 1 else f"Ставки размещены ({len(bets)})")
+    return body
+
+@app.route('/api/bet', methods=['POST'])
+@rate_limited('bet')
+@idempotent('bet')
+def place_bet():
+    """Размещение ставки пользователем"""
+    data = request.json
+    user_id = current_user_id()
+    match_id = data.get('match_id')
+    bet_type = data.get('bet_type')  # '1x2', 'total', 'exact_score'
+    selection = data.get('selection')
+    amount = data.get('amount')
+    
+    if not all([user_id, match_id, bet_type, selection, amount]):
+        return jsonify({"error": "Missing required parameters"}), 400
+    if not valid_bet_amount(amount):
+        return jsonify({"error": "Invalid amount"}), 400
     
     # Получаем коэффициенты
     odds = calculate_odds(match_id, bet_type, selection)
     if not odds:
         return jsonify({"error": "Invalid bet selection"}), 400
     
-    # Сохраняем ставку (в реальном приложении здесь была бы логика сохранения ставки)
-    # В данном примере мы просто имитируем успешную ставку
-    cursor.execute("""
-        INSERT INTO transactions (user_id, amount, type, reason, created_at)
-        VALUES (%s, %s, 'bet', %s, NOW())
-    """, (user_id, -amount, f"Ставка на матч {match_id}"))
+    body = place_bets(user_id, [{
+        'legs': [(match_id, bet_type, selection)],
+        'odds': odds,
+        'amount': amount,
+        'reason': f"Ставка на матч {match_id}"
+    }], lambda balance: {
+        "success": True,
+        "odds": odds,
+        "amount": amount,
+        "potential_winnings": round(amount * odds, 2)
+    })
+    if body is None:
+        return jsonify({"error": "Insufficient credits"}), 400
+    return jsonify(body)
+
+@app.route('/api/bet-slip', methods=['POST'])
+@rate_limited('bet')
+@idempotent('bet-slip')
+def place_bet_slip():
+    """Купон из нескольких исходов: одиночные ставки или экспресс одной транзакцией"""
+    data = request.get_json(silent=True) or {}
+    user_id = current_user_id()
+    mode = data.get('mode', 'singles')
+    selections = data.get('selections')
     
-    # Обновляем статистику ставок в Google Sheets
-    update_betting_stats(user_id, amount)
+    if not user_id or not isinstance(selections, list) or not selections:
+        return jsonify({"error": "Missing required parameters"}), 400
+    if mode not in BET_SLIP_MODES:
+        return jsonify({"error": f"mode must be one of: {', '.join(BET_SLIP_MODES)}"}), 400
+    if len(selections) > BET_SLIP_MAX_SELECTIONS:
+        return jsonify({"error": f"No more than {BET_SLIP_MAX_SELECTIONS} selections"}), 400
     
-    db.commit()
+    # Все исходы проверяются и оцениваются за один проход, до обращения к БД
+    legs = []
+    for index, item in enumerate(selections):
+        leg = (item.get('match_id'), item.get('bet_type'), item.get('selection')) if isinstance(item, dict) else ()
+        if len(leg) != 3 or not all(leg):
+            return jsonify({"error": "Missing required parameters", "index": index}), 400
+        odds = calculate_odds(*leg)
+        if not odds:
+            return jsonify({"error": "Invalid bet selection", "index": index}), 400
+        legs.append((leg, odds, item.get('amount')))
     
-    # Начисляем XP за ставку
-    add_xp(user_id, XP_CORRECT_PREDICTION, "Ставка размещена")
+    if mode == 'singles':
+        for index, (_, _, amount) in enumerate(legs):
+            if not valid_bet_amount(amount):
+                return jsonify({"error": "Invalid amount", "index": index}), 400
+        bets = [
+            {'legs': [leg], 'odds': odds, 'amount': amount, 'reason': f"Ставка на матч {leg[0]}"}
+            for leg, odds, amount in legs
+        ]
+    else:
+        stake = data.get('stake')
+        match_ids = [leg[0] for leg, _, _ in legs]
+        if len(legs) < 2:
+            return jsonify({"error": "Accumulator needs at least 2 selections"}), 400
+        if len(set(match_ids)) != len(match_ids):
+            return jsonify({"error": "Accumulator selections must be on different matches"}), 400
+        if not valid_bet_amount(stake):
+            return jsonify({"error": "Invalid amount"}), 400
+        total_odds = 1.0
+        for _, odds, _ in legs:
+            total_odds *= odds
+        bets = [{
+            'legs': [leg for leg, _, _ in legs],
+            'odds': round(total_odds, 2),
+            'amount': stake,
+            'reason': f"Экспресс: {', '.join(match_ids)}"
+        }]
     
-    return jsonify({
+    body = place_bets(user_id, bets, lambda balance: {
         "success": True,
-        "odds": odds,
-        "amount": amount,
-        "potential_winnings": round(amount * odds, 2)
+        "mode": mode,
+        "bets": [
+            {
+                "selections": [
+                    {"match_id": leg[0], "bet_type": leg[1], "selection": leg[2]}
+                    for leg in bet['legs']
+                ],
+                "odds": bet['odds'],
+                "amount": bet['amount'],
+                "potential_winnings": round(bet['amount'] * bet['odds'], 2)
+            }
+            for bet in bets
+        ],
+        "total_amount": sum(bet['amount'] for bet in bets),
+        "credits": balance
     })
+    if body is None:
+        return jsonify({"error": "Insufficient credits"}), 400
+    return jsonify(body)
 
 def calculate_odds(match_id, bet_type, selection):
+    """Коэффициент с маржой и поправкой на риск по исходу (LIABILITY_SHADING)"""
+    odds = base_odds(match_id, bet_type, selection)
+    if odds is None:
+        return None
+    return exposure_book.shade(match_id, bet_type, selection, odds)
+
+def base_odds(match_id, bet_type, selection):
     """Рассчитывает динамические коэффициенты с учетом маржи"""
     # В реальном приложении здесь был бы запрос к Google Sheets для получения вероятностей
     # Для примера используем базовые значения
@@ -968,55 +3157,307 @@ def calculate_odds(match_id, bet_type, selection):
     
     return None
 
-def update_betting_stats(user_id, amount):
-    """Обновляет статистику ставок в Google Sheets"""
+def update_betting_stats(user_id, amount, bets=1):
+    """Обновляет статистику ставок в Google Sheets (bets — число новых ставок)"""
     service = get_sheets_service()
-    spreadsheet_id = os.environ['GS_SHEET_ID']
+    spreadsheet_id = get_spreadsheet_id()
     
     # Проверяем, есть ли пользователь в статистике
-    result = service.spreadsheets().values().get(
+    result = sheets_execute(service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
         range="Ставки!A2:A"
-    ).execute()
+    ))
     user_ids = [row[0] for row in result.get('values', []) if row]
     
     if str(user_id) in user_ids:
         # Обновляем существующую запись
         idx = user_ids.index(str(user_id)) + 2  # +2 because A2 is first row
         # Получаем текущие значения
-        result = service.spreadsheets().values().get(
+        result = sheets_execute(service.spreadsheets().values().get(
             spreadsheetId=spreadsheet_id,
             range=f"Ставки!B{idx}:E{idx}"
-        ).execute()
+        ))
         values = result.get('values', [])
         
         if values:
-            total_bets = int(values[0][0]) + 1 if len(values[0]) > 0 else 1
+            total_bets = int(values[0][0]) + bets if len(values[0]) > 0 else bets
             wins = int(values[0][1]) if len(values[0]) > 1 else 0
             losses = int(values[0][2]) if len(values[0]) > 2 else 0
             win_percent = round(wins / total_bets * 100, 2) if total_bets > 0 else 0
             
             # Обновляем данные
-            service.spreadsheets().values().update(
+            sheets_execute(service.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id,
                 range=f"Ставки!B{idx}:E{idx}",
                 valueInputOption="RAW",
                 body={'values': [[total_bets, wins, losses, win_percent]]}
-            ).execute()
+            ))
     else:
         # Создаем новую запись
-        service.spreadsheets().values().append(
+        sheets_execute(service.spreadsheets().values().append(
             spreadsheetId=spreadsheet_id,
             range="Ставки!A1",
             valueInputOption="RAW",
-            body={'values': [[user_id, 1, 0, 0, 0]]}
-        ).execute()
+            body={'values': [[user_id, bets, 0, 0, 0]]}
+        ))
+
+# Уведомления в Telegram (outbox)
+class TelegramError(Exception):
+    """Bot API ответил ошибкой (ok: false)"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class BotApiClient:
+    """Вызовы Bot API через одно keep-alive соединение на пакет отправок"""
+
+    def __init__(self, base_url=None, token=None, timeout=None):
+        parsed = urlsplit(base_url or TELEGRAM_API_BASE)
+        self._connection_class = (
+            http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        )
+        self._host = parsed.netloc
+        self._prefix = f"{parsed.path.rstrip('/')}/bot{token or TELEGRAM_BOT_TOKEN}/"
+        self._timeout = timeout or NOTIFY_HTTP_TIMEOUT
+        self._connection = None
+
+    def call(self, method, params):
+        body = json.dumps(params, ensure_ascii=False).encode()
+        reused = self._connection is not None
+        try:
+            response, data = self._post(method, body)
+        except (http.client.HTTPException, OSError):
+            self.close()
+            if not reused:
+                raise
+            # Сервер мог закрыть простаивавшее соединение — одна попытка на новом
+            response, data = self._post(method, body)
+        result = json.loads(data)
+        if not result.get('ok'):
+            parameters = result.get('parameters') or {}
+            raise TelegramError(
+                result.get('description', f"HTTP {response.status}"),
+                status=response.status, retry_after=parameters.get('retry_after')
+            )
+        return result.get('result')
+
+    def _post(self, method, body):
+        if self._connection is None:
+            self._connection = self._connection_class(self._host, timeout=self._timeout)
+        self._connection.request('POST', self._prefix + method, body, {'Content-Type': 'application/json'})
+        response = self._connection.getresponse()
+        return response, response.read()
+
+    def send_message(self, chat_id, text):
+        return self.call('sendMessage', {'chat_id': chat_id, 'text': text})
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def enqueue_notification(cursor, user_id, kind, text, dedupe_key=None):
+    """Кладет уведомление в outbox в текущей транзакции события.
+
+    Пока уведомление с тем же dedupe_key ждет отправки, новое заменяет его
+    текст: пользователь получает одно сообщение с последним состоянием
+    (например, только итоговый уровень после нескольких повышений).
+    """
+    if not TELEGRAM_BOT_TOKEN:
+        return
+    cursor.execute("""
+        INSERT INTO notification_outbox (user_id, kind, dedupe_key, payload)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id, dedupe_key) WHERE status = 'pending'
+        DO UPDATE SET payload = EXCLUDED.payload, kind = EXCLUDED.kind
+    """, (user_id, kind, dedupe_key or kind, json.dumps({'text': text}, ensure_ascii=False)))
+
+class NotificationDispatcher:
+    """Отправляет уведомления из outbox пакетами.
+
+    Пакет арендуется коротким UPDATE (status = 'sending', lease_until) с
+    FOR UPDATE SKIP LOCKED, поэтому воркеры не отправляют одно уведомление
+    дважды, а блокировки строк не держатся во время HTTP-запросов; пакет
+    процесса, упавшего посреди отправки, забирается снова после истечения
+    аренды. Рассылается NOTIFY_CONCURRENCY
+    потоками, у каждого свое keep-alive соединение с Bot API. Темп задает
+    маркерная корзина (NOTIFY_RATE_PER_SECOND на процесс). 429 от Telegram
+    откладывает остаток пакета на retry_after, сетевые и 5xx ошибки
+    повторяются с экспоненциальной задержкой, 400/403 (бот заблокирован
+    пользователем) — окончательный отказ.
+    """
+
+    def __init__(self, rate, burst, concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self._pool = None
+        self._local = threading.local()
+        self._throttled_until = 0.0
+        self._lock = threading.Lock()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = BotApiClient()
+        return client
+
+    def _throttle_left(self):
+        return max(0.0, self._throttled_until - time.monotonic())
+
+    def _send(self, row):
+        """Отправляет одно уведомление; возвращает (id, kind, результат, ошибка)"""
+        notification_id, user_id, kind, payload = row
+        wait = self.bucket.try_acquire()
+        while wait and not self._throttle_left():
+            time.sleep(wait)
+            wait = self.bucket.try_acquire()
+        if self._throttle_left():
+            return notification_id, kind, 'deferred', None
+        
+        client = self._client()
+        try:
+            client.send_message(user_id, payload['text'])
+            return notification_id, kind, 'sent', None
+        except TelegramError as e:
+            if e.status == 429:
+                self._throttled_until = time.monotonic() + (e.retry_after or 1)
+                return notification_id, kind, 'deferred', None
+            if e.status in (400, 403):
+                return notification_id, kind, 'failed', str(e)
+            return notification_id, kind, 'retry', str(e)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            client.close()
+            return notification_id, kind, 'retry', str(e)
+
+    def dispatch_batch(self, limit=NOTIFY_BATCH_SIZE):
+        """Отправляет один пакет; возвращает число забранных уведомлений"""
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            UPDATE notification_outbox
+            SET status = 'sending', lease_until = NOW() + %s * INTERVAL '1 second'
+            WHERE id IN (
+                SELECT id FROM notification_outbox
+                WHERE (status = 'pending' AND send_after <= NOW())
+                   OR (status = 'sending' AND lease_until < NOW())
+                ORDER BY send_after, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, user_id, kind, payload, lease_until
+        """, (NOTIFY_LEASE_SECONDS, limit))
+        claimed = cursor.fetchall()
+        db.commit()
+        if not claimed:
+            return 0
+        
+        # Отправка — вне транзакции: enqueue_notification не ждет этот пакет
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='notify')
+        outcomes = {'sent': [], 'failed': [], 'retry': [], 'deferred': []}
+        rows = [row[:4] for row in claimed]
+        for notification_id, kind, result, error in self._pool.map(self._send, rows):
+            outcomes[result].append((notification_id, error))
+            NOTIFICATIONS.inc(kind=kind, result=result)
+        self._record_outcomes(outcomes, claimed[0][4])
+        return len(claimed)
+    
+    def _record_outcomes(self, outcomes, lease_until):
+        """Записывает результаты пакета. Условие lease_until не дает тронуть
+        строки, которые после истечения аренды забрал другой воркер"""
+        db = get_db()
+        cursor = db.cursor()
+        if outcomes['sent']:
+            cursor.execute("""
+                UPDATE notification_outbox
+                SET status = 'sent', sent_at = NOW(), attempts = attempts + 1, lease_until = NULL
+                WHERE id = ANY(%s) AND status = 'sending' AND lease_until = %s
+            """, ([notification_id for notification_id, _ in outcomes['sent']], lease_until))
+        if outcomes['failed']:
+            execute_values(cursor, """
+                UPDATE notification_outbox o
+                SET status = 'failed', attempts = o.attempts + 1, last_error = f.error, lease_until = NULL
+                FROM (VALUES %s) AS f (id, error, lease_until)
+                WHERE o.id = f.id AND o.status = 'sending' AND o.lease_until = f.lease_until
+            """, [(*outcome, lease_until) for outcome in outcomes['failed']])
+        db.commit()
+        if not outcomes['retry'] and not outcomes['deferred']:
+            return
+        
+        # Возврат в очередь. Пока пакет отправлялся, под тем же dedupe_key
+        # могло появиться новое ожидающее уведомление с более свежим текстом:
+        # тогда старое помечается 'superseded', а не возвращается в 'pending'
+        requeue_status = """
+            CASE WHEN EXISTS (
+                SELECT 1 FROM notification_outbox p
+                WHERE p.user_id = o.user_id AND p.dedupe_key = o.dedupe_key AND p.status = 'pending'
+            ) THEN 'superseded' ELSE 'pending' END
+        """
+        try:
+            if outcomes['retry']:
+                execute_values(cursor, f"""
+                    UPDATE notification_outbox o
+                    SET attempts = o.attempts + 1,
+                        last_error = f.error,
+                        lease_until = NULL,
+                        status = CASE WHEN o.attempts + 1 >= {NOTIFY_MAX_ATTEMPTS} THEN 'failed'
+                                      ELSE {requeue_status} END,
+                        send_after = NOW() + LEAST(POWER(2, o.attempts + 1), {NOTIFY_RETRY_MAX_SECONDS}) * INTERVAL '1 second'
+                    FROM (VALUES %s) AS f (id, error, lease_until)
+                    WHERE o.id = f.id AND o.status = 'sending' AND o.lease_until = f.lease_until
+                """, [(*outcome, lease_until) for outcome in outcomes['retry']])
+            if outcomes['deferred']:
+                cursor.execute(f"""
+                    UPDATE notification_outbox o
+                    SET status = {requeue_status},
+                        lease_until = NULL,
+                        send_after = NOW() + %s * INTERVAL '1 second'
+                    WHERE o.id = ANY(%s) AND o.status = 'sending' AND o.lease_until = %s
+                """, (max(1, math.ceil(self._throttle_left())),
+                      [notification_id for notification_id, _ in outcomes['deferred']], lease_until))
+            db.commit()
+        except psycopg2.IntegrityError as e:
+            # Новое уведомление с тем же ключом вставлено параллельно:
+            # строки остаются 'sending' и вернутся в работу после истечения аренды
+            db.rollback()
+            logger.warning(f"⚠️ Уведомления не возвращены в очередь: {str(e)}")
+
+    def dispatch(self, limit=NOTIFY_BATCH_SIZE):
+        """Отправляет пакеты, пока в outbox есть готовые уведомления"""
+        if not TELEGRAM_BOT_TOKEN or not self._lock.acquire(blocking=False):
+            return 0
+        total = 0
+        try:
+            while not self._throttle_left():
+                count = self.dispatch_batch(limit)
+                total += count
+                if count < limit:
+                    break
+            return total
+        finally:
+            self._lock.release()
+
+notification_dispatcher = NotificationDispatcher(NOTIFY_RATE_PER_SECOND, NOTIFY_BURST, NOTIFY_CONCURRENCY)
 
 def calculate_xp_for_level(level):
     """Рассчитывает XP, необходимое для перехода на следующий уровень"""
     # Формула: XP_needed(level) = 100 + floor(1.15^(level-1) * 50)
     return int(100 + (1.15 ** (level - 1)) * 50)
 
+def apply_level_ups(xp, level):
+    """Переводит накопленный XP в уровни: возвращает (остаток XP, новый уровень)"""
+    next_level_xp = calculate_xp_for_level(level + 1)
+    while xp >= next_level_xp:
+        level += 1
+        xp -= next_level_xp
+        next_level_xp = calculate_xp_for_level(level + 1)
+    return xp, level
+
+def level_up_text(level):
+    return f"🎉 Новый уровень: {level}!"
+
 def add_xp(user_id, xp_amount, reason):
     """Начисляет XP пользователю и проверяет переход на новый уровень"""
     db = get_db()
@@ -1035,16 +3476,9 @@ def add_xp(user_id, xp_amount, reason):
     
     current_xp = user[0]
     current_level = user[1]
-    new_xp = current_xp + xp_amount
     
     # Проверяем переход на новый уровень
-    next_level_xp = calculate_xp_for_level(current_level + 1)
-    new_level = current_level
-    
-    while new_xp >= next_level_xp:
-        new_level += 1
-        new_xp -= next_level_xp
-        next_level_xp = calculate_xp_for_level(new_level + 1)
+    new_xp, new_level = apply_level_ups(current_xp + xp_amount, current_level)
     
     # Обновляем данные
     cursor.execute("""
@@ -1059,7 +3493,11 @@ def add_xp(user_id, xp_amount, reason):
         VALUES (%s, %s, 'xp', %s, NOW())
     """, (user_id, xp_amount, reason))
     
+    if new_level > current_level:
+        enqueue_notification(cursor, user_id, 'level_up', level_up_text(new_level))
+    
     db.commit()
+    invalidate_profile(user_id)
     
     # Проверяем ачивки
     if new_level > current_level:
@@ -1067,11 +3505,23 @@ def add_xp(user_id, xp_amount, reason):
     
     return new_level > current_level  # True, если уровень повышен
 
+_achievements_catalog = None
+
+def load_achievements():
+    """Загружает каталог ачивок из achievements.json (один раз на процесс)"""
+    global _achievements_catalog
+    if _achievements_catalog is None:
+        with open('achievements.json', 'r', encoding='utf-8') as f:
+            # Файл начинается со строки-комментария "// achievements.json"
+            text = ''.join(line for line in f if not line.lstrip().startswith('//'))
+        _achievements_catalog = json.loads(text)
+    return _achievements_catalog
+
+ACHIEVEMENT_TIER_NAMES = {1: 'бронза', 2: 'серебро', 3: 'золото'}
+
 def check_achievement(user_id, achievement_key, value=None):
     """Проверяет выполнение условий для ачивки"""
-    # Загружаем данные об ачивках из файла
-    with open('achievements.json', 'r', encoding='utf-8') as f:
-        achievements = json.load(f)
+    achievements = load_achievements()
     
     if achievement_key not in achievements:
         return
@@ -1112,6 +3562,11 @@ def check_achievement(user_id, achievement_key, value=None):
             ON CONFLICT (user_id, achievement_key) 
             DO UPDATE SET tier = EXCLUDED.tier, unlocked_at = EXCLUDED.unlocked_at
         """, (user_id, achievement_key, new_tier))
+        enqueue_notification(
+            cursor, user_id, 'achievement',
+            f"🏆 Ачивка «{achievement['title']}»: {ACHIEVEMENT_TIER_NAMES[new_tier]}",
+            dedupe_key=f"achievement:{achievement_key}"
+        )
         
         # Начисляем XP в зависимости от уровня ачивки
         xp_reward = 0
@@ -1126,6 +3581,7 @@ def check_achievement(user_id, achievement_key, value=None):
             add_xp(user_id, xp_reward, f"Ачивка: {achievement['title']}")
         
         db.commit()
+        invalidate_profile(user_id)
         
         # Проверяем общее количество ачивок для ачивки "Коллекционер"
         if achievement_key != 'achievement_collector':
@@ -1137,74 +3593,630 @@ def check_achievement(user_id, achievement_key, value=None):
             total_achievements = cursor.fetchone()[0]
             check_achievement(user_id, 'achievement_collector', total_achievements)
 
+# Чек-ин одним условным UPDATE: параллельные запросы сериализуются на
+# блокировке строки, и второй не проходит условие по last_checkin_date.
+DAILY_CHECKIN_SQL = """
+    WITH upd AS (
+        UPDATE users
+        SET daily_checkin_streak = CASE
+                WHEN last_checkin_date = %(today)s::date - 1 THEN daily_checkin_streak + 1
+                ELSE 1
+            END,
+            credits = credits + %(credits)s + CASE
+                WHEN (CASE
+                        WHEN last_checkin_date = %(today)s::date - 1 THEN daily_checkin_streak + 1
+                        ELSE 1
+                      END) = %(bonus_streak)s THEN %(bonus)s
+                ELSE 0
+            END,
+            xp = xp + %(xp)s,
+            last_checkin_date = %(today)s,
+            updated_at = NOW()
+        WHERE id = %(user_id)s
+          AND last_checkin_date IS DISTINCT FROM %(today)s
+        RETURNING id, daily_checkin_streak, xp, level
+    ), tx AS (
+        INSERT INTO transactions (user_id, amount, type, reason, created_at)
+        SELECT id, %(xp)s, 'xp', %(reason)s, NOW() FROM upd
+    )
+    SELECT daily_checkin_streak, xp, level FROM upd
+"""
+
+DAILY_STREAK_BONUS_DAY = 7
+
 @app.route('/api/daily-checkin', methods=['POST'])
+@rate_limited('daily-checkin')
+@idempotent('daily-checkin')
 def daily_checkin():
     """Ежедневный чек-ин пользователя"""
-    user_id = request.json.get('user_id')
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "user_id required"}), 400
     
     db = get_db()
     cursor = db.cursor()
     
-    # Получаем данные пользователя
-    cursor.execute("""
-        SELECT daily_checkin_streak, last_checkin_date 
-        FROM users 
-        WHERE id = %s
-    """, (user_id,))
-    user = cursor.fetchone()
-    
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-    
-    current_streak, last_checkin = user
-    
-    # Проверяем, прошел ли день с последнего чек-ина
     today = datetime.now(timezone.utc).date()
-    if last_checkin and last_checkin >= today:
+    cursor.execute(DAILY_CHECKIN_SQL, {
+        'user_id': user_id,
+        'today': today,
+        'credits': DAILY_CHECKIN_CREDITS,
+        'bonus': DAILY_STREAK_BONUS,
+        'bonus_streak': DAILY_STREAK_BONUS_DAY,
+        'xp': XP_DAILY_CHECKIN,
+        'reason': "Ежедневный чек-ин"
+    })
+    row = cursor.fetchone()
+    
+    if not row:
+        db.rollback()
+        # Медленный путь только для отказа: различаем 404 и повторный чек-ин
+        cursor.execute("SELECT 1 FROM users WHERE id = %s", (user_id,))
+        if not cursor.fetchone():
+            return jsonify({"error": "User not found"}), 404
         return jsonify({"error": "Already checked in today"}), 400
     
-    # Обновляем стрик
-    new_streak = 1
-    if last_checkin and (today - last_checkin).days == 1:
-        new_streak = current_streak + 1
+    new_streak, xp, level = row
+    
+    # Переход на новый уровень (редкий случай) — в той же транзакции,
+    # относительным UPDATE, чтобы не затереть параллельные начисления
+    new_xp, new_level = apply_level_ups(xp, level)
+    if new_level > level:
+        cursor.execute("""
+            UPDATE users
+            SET xp = xp - %s, level = level + %s
+            WHERE id = %s
+        """, (xp - new_xp, new_level - level, user_id))
+        enqueue_notification(cursor, user_id, 'level_up', level_up_text(new_level))
     
-    # Начисляем кредиты
     credits_reward = DAILY_CHECKIN_CREDITS
-    if new_streak == 7:
+    if new_streak == DAILY_STREAK_BONUS_DAY:
         credits_reward += DAILY_STREAK_BONUS
+    body = {
+        "success": True,
+        "streak": new_streak,
+        "credits_reward": credits_reward,
+        "xp_reward": XP_DAILY_CHECKIN
+    }
+    store_idempotent_response(cursor, body)
+    db.commit()
+    invalidate_profile(user_id)
+    
+    if new_level > level:
+        check_achievement(user_id, 'level_up', new_level)
+    
+    # Ниже бронзового порога ачивка недостижима — лишний запрос не нужен.
+    # Выше порога уровень сверяется с сохраненным: разблокировка, не
+    # записанная в день совпадения с порогом (или после смены порогов), не теряется
+    streak_achievement = load_achievements().get('daily_streaks')
+    if streak_achievement and new_streak >= streak_achievement['bronze_threshold']:
+        check_achievement(user_id, 'daily_streaks', new_streak)
+    
+    return jsonify(body)
+
+# Лайки и комментарии к матчам
+class SocialBuffer:
+    """Изменения счетчиков матчей и XP за активность, еще не записанные в БД.
+
+    Лайк популярного матча не обновляет горячую строку match_social_counters
+    сразу: приращения складываются в памяти и сбрасываются одной
+    транзакцией раз в SOCIAL_FLUSH_SECONDS (flush_social_buffer).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # match_id -> [лайки, комментарии]
+        self._xp = {}  # user_id -> XP
+        self._flusher = None
+
+    def _start_flusher(self):
+        # Буфер у каждого воркера свой, поэтому сбрасывает его поток процесса,
+        # а не планировщик (тот работает только в процессе задач)
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='social-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(SOCIAL_FLUSH_SECONDS)
+            try:
+                scheduled_social_flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка сброса счетчиков лайков и комментариев: {str(e)}")
+
+    def add_counts(self, match_id, likes=0, comments=0):
+        with self._lock:
+            self._start_flusher()
+            counts = self._counters.setdefault(match_id, [0, 0])
+            counts[0] += likes
+            counts[1] += comments
+
+    def add_xp(self, user_id, xp):
+        with self._lock:
+            self._start_flusher()
+            self._xp[user_id] = self._xp.get(user_id, 0) + xp
+
+    def pending_counts(self, match_ids=None):
+        """Несброшенные приращения: match_id -> (лайки, комментарии)"""
+        with self._lock:
+            return {
+                match_id: tuple(counts) for match_id, counts in self._counters.items()
+                if match_ids is None or match_id in match_ids
+            }
+
+    def drain(self):
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            xp, self._xp = self._xp, {}
+        return counters, xp
+
+    def restore(self, counters, xp):
+        """Возвращает несохраненные изменения после неудачного сброса"""
+        for match_id, (likes, comments) in counters.items():
+            self.add_counts(match_id, likes, comments)
+        for user_id, amount in xp.items():
+            self.add_xp(user_id, amount)
+
+social_buffer = SocialBuffer()
+
+def grant_social_xp(user_id, xp):
+    """XP за лайк или комментарий: не больше SOCIAL_XP_LIMIT действий, начисляется при сбросе"""
+    limit, window = _parse_rate(SOCIAL_XP_LIMIT)
+    if rate_limiter.check(f"social-xp:{user_id}", limit, window) == 0:
+        social_buffer.add_xp(int(user_id), xp)
+
+def grant_xp_bulk(cursor, grants, reason):
+    """Начисляет XP многим пользователям в текущей транзакции.
+
+    Один UPDATE ... FROM (VALUES ...) и один INSERT в transactions на
+    весь пакет; переход на новый уровень (редкий) — относительным UPDATE,
+    как в чек-ине. Возвращает [(user_id, новый уровень)] для повышенных.
+    """
+    rows = execute_values(cursor, """
+        UPDATE users u
+        SET xp = u.xp + g.xp, updated_at = NOW()
+        FROM (VALUES %s) AS g (id, xp)
+        WHERE u.id = g.id
+        RETURNING u.id, u.xp, u.level
+    """, sorted(grants.items()), fetch=True)
+    if not rows:
+        return []
+    execute_values(cursor, """
+        INSERT INTO transactions (user_id, amount, type, reason, created_at)
+        VALUES %s
+    """, [(user_id, grants[user_id], 'xp', reason) for user_id, _, _ in rows],
+        template="(%s, %s, %s, %s, NOW())")
+    
+    level_ups = []
+    for user_id, xp, level in rows:
+        new_xp, new_level = apply_level_ups(xp, level)
+        if new_level > level:
+            cursor.execute("""
+                UPDATE users
+                SET xp = xp - %s, level = level + %s
+                WHERE id = %s
+            """, (xp - new_xp, new_level - level, user_id))
+            enqueue_notification(cursor, user_id, 'level_up', level_up_text(new_level))
+            level_ups.append((user_id, new_level))
+    return level_ups
+
+def flush_social_buffer():
+    """Пишет накопленные счетчики и XP одной транзакцией; возвращает (матчей, пользователей)"""
+    counters, xp = social_buffer.drain()
+    if not counters and not xp:
+        return 0, 0
+    
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        # Строки блокируются в одном порядке во всех воркерах — без взаимных блокировок
+        if counters:
+            execute_values(cursor, """
+                INSERT INTO match_social_counters AS c (match_id, likes, comments, updated_at)
+                VALUES %s
+                ON CONFLICT (match_id) DO UPDATE
+                SET likes = c.likes + EXCLUDED.likes,
+                    comments = c.comments + EXCLUDED.comments,
+                    updated_at = EXCLUDED.updated_at
+            """, [(match_id, likes, comments) for match_id, (likes, comments) in sorted(counters.items())],
+                template="(%s, %s, %s, NOW())")
+        level_ups = grant_xp_bulk(cursor, xp, "Лайки и комментарии") if xp else []
+        db.commit()
+    except Exception:
+        db.rollback()
+        social_buffer.restore(counters, xp)
+        raise
     
-    # Обновляем пользователя
+    SOCIAL_FLUSHES.inc(len(counters), table='match_social_counters')
+    SOCIAL_FLUSHES.inc(len(xp), table='users')
+    for user_id in xp:
+        invalidate_profile(user_id)
+    for user_id, new_level in level_ups:
+        check_achievement(user_id, 'level_up', new_level)
+    return len(counters), len(xp)
+
+def reconcile_social_counters():
+    """Пересчитывает match_social_counters по match_likes и match_comments;
+    возвращает число исправленных матчей.
+
+    Приращения SocialBuffer живут в памяти воркера и пропадают, если его
+    убили без atexit (SIGKILL, OOM). Сверяются только матчи без активности
+    дольше 10 интервалов сброса: у них не может быть несброшенных приращений,
+    кроме редкого снятого лайка — такое расхождение исправит следующая сверка.
+    """
+    db = get_db()
+    cursor = db.cursor()
     cursor.execute("""
-        UPDATE users 
-        SET daily_checkin_streak = %s, 
-            last_checkin_date = %s,
-            credits = credits + %s,
-            updated_at = NOW()
-        WHERE id = %s
-    """, (new_streak, today, credits_reward, user_id))
+        WITH actual AS (
+            SELECT match_id, SUM(likes)::int AS likes, SUM(comments)::int AS comments
+            FROM (
+                SELECT match_id, COUNT(*) AS likes, 0 AS comments FROM match_likes GROUP BY match_id
+                UNION ALL
+                SELECT match_id, 0, COUNT(*) FROM match_comments GROUP BY match_id
+            ) counts
+            GROUP BY match_id
+        ), drift AS (
+            SELECT COALESCE(a.match_id, c.match_id) AS match_id,
+                   COALESCE(a.likes, 0) AS likes, COALESCE(a.comments, 0) AS comments
+            FROM actual a
+            FULL JOIN match_social_counters c ON c.match_id = a.match_id
+            WHERE (c.likes, c.comments) IS DISTINCT FROM (COALESCE(a.likes, 0), COALESCE(a.comments, 0))
+              AND (c.updated_at IS NULL OR c.updated_at < NOW() - %(quiet)s * INTERVAL '1 second')
+        )
+        INSERT INTO match_social_counters AS c (match_id, likes, comments, updated_at)
+        SELECT match_id, likes, comments, NOW()
+        FROM drift d
+        WHERE NOT EXISTS (
+                SELECT 1 FROM match_likes l
+                WHERE l.match_id = d.match_id AND l.created_at > NOW() - %(quiet)s * INTERVAL '1 second'
+            )
+          AND NOT EXISTS (
+                SELECT 1 FROM match_comments m
+                WHERE m.match_id = d.match_id AND m.created_at > NOW() - %(quiet)s * INTERVAL '1 second'
+            )
+        ORDER BY match_id
+        ON CONFLICT (match_id) DO UPDATE
+        SET likes = EXCLUDED.likes,
+            comments = EXCLUDED.comments,
+            updated_at = EXCLUDED.updated_at
+    """, {'quiet': 10 * SOCIAL_FLUSH_SECONDS})
+    fixed = cursor.rowcount
+    db.commit()
+    return fixed
+
+def _flush_social_at_exit():
+    try:
+        with app.app_context():
+            flush_social_buffer()
+    except Exception as e:
+        logger.error(f"❌ Не удалось сохранить счетчики лайков и комментариев: {str(e)}")
+
+atexit.register(_flush_social_at_exit)
+
+def match_exists(match_id):
+    cursor = get_read_db().cursor()
+    cursor.execute("""
+        SELECT data_json @> jsonb_build_array(jsonb_build_object('match_id', %s::text))
+        FROM matches_cache
+        WHERE match_id = 'schedule'
+    """, (match_id,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+def match_social_counts(match_ids=None):
+    """Счетчики лайков и комментариев: записанные в БД плюс еще не сброшенные этим процессом"""
+    cursor = get_read_db().cursor()
+    cursor.execute("""
+        SELECT match_id, likes, comments
+        FROM match_social_counters
+        WHERE %(ids)s::text[] IS NULL OR match_id = ANY(%(ids)s::text[])
+    """, {'ids': match_ids})
+    counts = {row[0]: {'likes': row[1], 'comments': row[2]} for row in cursor.fetchall()}
+    for match_id, (likes, comments) in social_buffer.pending_counts(match_ids).items():
+        entry = counts.setdefault(match_id, {'likes': 0, 'comments': 0})
+        entry['likes'] += likes
+        entry['comments'] += comments
+    return counts
+
+def fetch_comments_page(match_id, cursor_value=None, limit=COMMENTS_PAGE_SIZE):
+    """Страница комментариев матча, от новых к старым (keyset по idx_match_comments_match_time)"""
+    conditions = ["c.match_id = %s"]
+    params = [match_id]
+    if cursor_value:
+        last_created_at, last_id = decode_history_cursor(cursor_value)
+        conditions.append("(c.created_at, c.id) < (%s, %s)")
+        params.extend([last_created_at, last_id])
+    params.append(limit + 1)
+    
+    cursor = get_read_db().cursor()
+    cursor.execute(f"""
+        SELECT c.id, c.user_id, COALESCE(u.display_name, u.username), c.text, c.created_at
+        FROM match_comments c
+        LEFT JOIN users u ON u.id = c.user_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT %s
+    """, params)
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1][4], rows[-1][0])
+    
+    return {
+        'items': [comment_json(*row) for row in rows],
+        'next_cursor': next_cursor
+    }
+
+def comment_json(comment_id, user_id, name, text, created_at):
+    return {
+        'id': comment_id,
+        'user_id': str(user_id),
+        'name': name or f"user_{user_id}",
+        'text': text,
+        'created_at': created_at.isoformat()
+    }
+
+@app.route('/api/matches/social', methods=['GET'])
+def get_matches_social():
+    """Счетчики лайков и комментариев всех матчей и матчи, которые лайкнул пользователь"""
+    user_id = current_user_id()
+    liked = []
+    if user_id:
+        cursor = get_read_db(user_id).cursor()
+        cursor.execute("SELECT match_id FROM match_likes WHERE user_id = %s", (user_id,))
+        liked = [row[0] for row in cursor.fetchall()]
+    return jsonify({'counters': match_social_counts(), 'liked': liked})
+
+@app.route('/api/matches/<match_id>/like', methods=['POST', 'DELETE'])
+@rate_limited('like')
+def like_match(match_id):
+    """Лайк матча (POST) или его отмена (DELETE); повторный лайк ничего не меняет"""
+    user_id = current_user_id()
+    if not user_id:
+        return jsonify({"error": "user_id required"}), 400
+    
+    db = get_db()
+    cursor = db.cursor()
+    if request.method == 'POST':
+        if not match_exists(match_id):
+            return jsonify({"error": "Match not found"}), 404
+        cursor.execute("""
+            INSERT INTO match_likes (match_id, user_id)
+            VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING 1
+        """, (match_id, user_id))
+    else:
+        cursor.execute("""
+            DELETE FROM match_likes
+            WHERE match_id = %s AND user_id = %s
+            RETURNING 1
+        """, (match_id, user_id))
+    changed = cursor.fetchone() is not None
+    db.commit()
+    
+    liked = request.method == 'POST'
+    if changed:
+        social_buffer.add_counts(match_id, likes=1 if liked else -1)
+        if liked:
+            grant_social_xp(user_id, XP_LIKE)
     
-    # Начисляем XP
-    add_xp(user_id, XP_DAILY_CHECKIN, "Ежедневный чек-ин")
+    counts = match_social_counts([match_id]).get(match_id, {'likes': 0, 'comments': 0})
+    return jsonify({"success": True, "liked": liked, "likes": counts['likes']})
+
+@app.route('/api/matches/<match_id>/comments', methods=['GET'])
+def get_match_comments(match_id):
+    """Комментарии к матчу с keyset-пагинацией (?cursor=&limit=)"""
+    try:
+        limit = int(request.args.get('limit', COMMENTS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    limit = max(1, min(limit, COMMENTS_MAX_PAGE_SIZE))
     
-    # Проверяем ачивку для чек-инов
-    check_achievement(user_id, 'daily_streaks', new_streak)
+    try:
+        page = fetch_comments_page(match_id, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify(page)
+
+@app.route('/api/matches/<match_id>/comments', methods=['POST'])
+@rate_limited('comment')
+@idempotent('comment')
+def add_match_comment(match_id):
+    """Новый комментарий к матчу"""
+    data = request.get_json(silent=True) or {}
+    user_id = current_user_id()
+    text = data.get('text')
+    if not user_id:
+        return jsonify({"error": "user_id required"}), 400
+    if not isinstance(text, str) or not text.strip():
+        return jsonify({"error": "text required"}), 400
+    text = text.strip()
+    if len(text) > COMMENT_MAX_LENGTH:
+        return jsonify({"error": f"text must be at most {COMMENT_MAX_LENGTH} characters"}), 400
+    if not match_exists(match_id):
+        return jsonify({"error": "Match not found"}), 404
     
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        WITH c AS (
+            INSERT INTO match_comments (match_id, user_id, text)
+            VALUES (%s, %s, %s)
+            RETURNING id, user_id, text, created_at
+        )
+        SELECT c.id, c.user_id, COALESCE(u.display_name, u.username), c.text, c.created_at
+        FROM c
+        LEFT JOIN users u ON u.id = c.user_id
+    """, (match_id, user_id, text))
+    body = {"success": True, "comment": comment_json(*cursor.fetchone())}
+    store_idempotent_response(cursor, body)
     db.commit()
     
-    return jsonify({
-        "success": True,
-        "streak": new_streak,
-        "credits_reward": credits_reward,
-        "xp_reward": XP_DAILY_CHECKIN
-    })
+    social_buffer.add_counts(match_id, comments=1)
+    grant_social_xp(user_id, XP_COMMENT)
+    return jsonify(body)
+
+# История транзакций (keyset-пагинация)
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+TRANSACTION_TYPES = ('credit', 'xp', 'bet', 'reward')
+
+def encode_history_cursor(created_at, tx_id):
+    """Кодирует позицию последней записи страницы в непрозрачный курсор"""
+    raw = f"{created_at.isoformat()}|{tx_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_history_cursor(cursor_value):
+    """Возвращает (created_at, id) из курсора или бросает ValueError"""
+    padded = cursor_value + '=' * (-len(cursor_value) % 4)
+    created_at, tx_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(tx_id)
+
+def fetch_history_page(user_id, tx_type=None, cursor_value=None, limit=HISTORY_PAGE_SIZE):
+    """Страница истории транзакций пользователя, от новых к старым.
+    
+    Использует idx_transactions_user_time: стоимость запроса не зависит от
+    глубины страницы. Явная граница created_at позволяет отсечь партиции.
+    """
+    conditions = ["user_id = %s"]
+    params = [user_id]
+    if tx_type:
+        conditions.append("type = %s")
+        params.append(tx_type)
+    if cursor_value:
+        last_created_at, last_id = decode_history_cursor(cursor_value)
+        conditions.append("created_at <= %s AND (created_at, id) < (%s, %s)")
+        params.extend([last_created_at, last_created_at, last_id])
+    params.append(limit + 1)
+    
+    cursor = get_read_db(user_id).cursor()
+    cursor.execute(f"""
+        SELECT id, amount, type, reason, created_at
+        FROM transactions
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, params)
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1][4], rows[-1][0])
+    
+    return {
+        'items': [{
+            'id': r[0],
+            'amount': r[1],
+            'type': r[2],
+            'reason': r[3],
+            'created_at': r[4].isoformat()
+        } for r in rows],
+        'next_cursor': next_cursor
+    }
+
+def history_response(user_id):
+    """Разбирает параметры запроса истории и возвращает JSON-ответ"""
+    tx_type = request.args.get('type')
+    if tx_type and tx_type not in TRANSACTION_TYPES:
+        return jsonify({"error": f"type must be one of: {', '.join(TRANSACTION_TYPES)}"}), 400
+    
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    
+    try:
+        page = fetch_history_page(user_id, tx_type, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify(page)
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """История транзакций пользователя"""
+    user_id = current_user_id()
+    if not user_id:
+        return jsonify({"error": "user_id required"}), 400
+    return history_response(user_id)
+
+@app.route('/api/admin/history', methods=['GET'])
+@owner_required
+def admin_get_history():
+    """История транзакций любого пользователя (админ-действие)"""
+    target_user_id = request.args.get('target_user_id')
+    if not target_user_id:
+        return jsonify({"error": "target_user_id required"}), 400
+    return history_response(target_user_id)
+
+@app.route('/api/admin/exposure', methods=['GET'])
+@owner_required
+def admin_exposure():
+    """Суммы ставок и риск по исходам матчей (админ-действие)"""
+    match_id = request.args.get('match_id')
+    cursor = get_read_db().cursor()
+    cursor.execute("""
+        SELECT match_id, market, selection, stake_total, bets_count, potential_payout,
+               potential_payout - SUM(stake_total) OVER (PARTITION BY match_id, market) AS liability,
+               updated_at
+        FROM match_exposure
+        WHERE %(match_id)s::text IS NULL OR match_id = %(match_id)s
+        ORDER BY liability DESC
+        LIMIT 500
+    """, {'match_id': match_id})
+    return jsonify({'exposure': [
+        {
+            'match_id': row[0],
+            'market': row[1],
+            'selection': row[2],
+            'stake_total': row[3],
+            'bets_count': row[4],
+            'potential_payout': float(row[5]),
+            'liability': float(row[6]),
+            'updated_at': row[7].isoformat()
+        }
+        for row in cursor.fetchall()
+    ]})
+
+@app.route('/api/admin/ban', methods=['POST'])
+@owner_required
+def admin_ban_user():
+    """Блокирует пользователя на hours часов или бессрочно (админ-действие)"""
+    data = request.get_json(silent=True) or {}
+    target_user_id = data.get('target_user_id')
+    hours = data.get('hours')
+    if not target_user_id:
+        return jsonify({"error": "target_user_id required"}), 400
+    if hours is not None and (not isinstance(hours, (int, float)) or hours <= 0):
+        return jsonify({"error": "hours must be a positive number"}), 400
+    
+    ban = set_user_ban(current_user_id(), target_user_id, hours, data.get('reason'))
+    if ban is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify({"success": True, "banned_until": ban['banned_until'].isoformat()})
+
+@app.route('/api/admin/unban', methods=['POST'])
+@owner_required
+def admin_unban_user():
+    """Снимает бан с пользователя (админ-действие)"""
+    data = request.get_json(silent=True) or {}
+    target_user_id = data.get('target_user_id')
+    if not target_user_id:
+        return jsonify({"error": "target_user_id required"}), 400
+    
+    if set_user_ban(current_user_id(), target_user_id, 0, data.get('reason')) is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify({"success": True})
 
 @app.route('/api/admin/update-sheets', methods=['POST'])
 @owner_required
 def admin_update_sheets():
     """Обновляет кеш из Google Sheets (админ-действие)"""
-    update_matches_cache()
+    update_matches_cache(force=True)
     return jsonify({"success": True, "message": "Данные обновлены из Google Sheets"})
 
 @app.route('/api/admin/pay-rewards', methods=['POST'])
@@ -1217,15 +4229,15 @@ def admin_pay_rewards():
 def pay_weekly_rewards():
     """Выплачивает награды за лидерборд и сохраняет историю"""
     service = get_sheets_service()
-    spreadsheet_id = os.environ['GS_SHEET_ID']
+    spreadsheet_id = get_spreadsheet_id()
     db = get_db()
     cursor = db.cursor()
     
     # Получаем топ-10 из Google Sheets
-    result = service.spreadsheets().values().get(
+    result = sheets_execute(service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
         range="Ставки!A2:E"
-    ).execute()
+    ))
     
     rows = result.get('values', [])
     leaderboard = []
@@ -1253,6 +4265,7 @@ def pay_weekly_rewards():
     
     # Берем топ-3
     top_users = leaderboard[:3]
+    season = current_season(cursor)
     
     # Выплачиваем награды
     for i, user in enumerate(top_users):
@@ -1268,8 +4281,8 @@ def pay_weekly_rewards():
         # Логируем в историю
         cursor.execute("""
             INSERT INTO leaderboard_history 
-            (week_start_iso, user_id, username, wins, total_bets, win_percent, rank, reward_given)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            (week_start_iso, user_id, username, wins, total_bets, win_percent, rank, reward_given, season)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (
             datetime.now(timezone.utc).strftime("%Y-%m-%d"),
             user['user_id'],
@@ -1278,38 +4291,779 @@ def pay_weekly_rewards():
             user['total_bets'],
             user['win_percent'],
             i + 1,
-            True
+            True,
+            season
         ))
+        enqueue_notification(
+            cursor, user['user_id'], 'weekly_reward',
+            f"🥇 {i + 1}-е место в лидерборде недели: +{reward} кредитов"
+        )
         
         # Начисляем XP
         add_xp(user['user_id'], 50, f"Лидерборд недели: место {i+1}")
     
     db.commit()
+    for user in top_users:
+        invalidate_profile(user['user_id'])
     
     # Сбрасываем статистику ставок в Google Sheets
-    service.spreadsheets().values().clear(
+    sheets_execute(service.spreadsheets().values().clear(
         spreadsheetId=spreadsheet_id,
         range="Ставки!B2:E"
-    ).execute()
+    ))
+
+# Сезоны и архив завершенных сезонов
+def current_season(cursor):
+    """Текущий сезон: CURRENT_SEASON или последний сезон горячего расписания"""
+    if CURRENT_SEASON:
+        return CURRENT_SEASON
+    cursor.execute("""
+        SELECT MAX(m->>'season')
+        FROM matches_cache, jsonb_array_elements(data_json) m
+        WHERE match_id = 'schedule'
+    """)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def season_standings(matches):
+    """Итоговая таблица по завершенным матчам: 3 очка за победу, 1 за ничью"""
+    table = {}
+    for match in matches:
+        if match.get('status') != 'done':
+            continue
+        try:
+            home_goals, away_goals = int(match['score_home']), int(match['score_away'])
+        except (TypeError, ValueError):
+            continue
+        for team, scored, conceded in (
+            (match['home_team'], home_goals, away_goals),
+            (match['away_team'], away_goals, home_goals)
+        ):
+            row = table.setdefault(team, {
+                'team': team, 'played': 0, 'won': 0, 'drawn': 0, 'lost': 0,
+                'goals_for': 0, 'goals_against': 0, 'points': 0
+            })
+            row['played'] += 1
+            row['goals_for'] += scored
+            row['goals_against'] += conceded
+            if scored > conceded:
+                row['won'] += 1
+                row['points'] += 3
+            elif scored == conceded:
+                row['drawn'] += 1
+                row['points'] += 1
+            else:
+                row['lost'] += 1
+    
+    standings = sorted(table.values(), key=lambda r: (
+        -r['points'], r['goals_against'] - r['goals_for'], -r['goals_for'], r['team']
+    ))
+    for position, row in enumerate(standings, 1):
+        row['position'] = position
+    return standings
+
+def season_top_players(service, spreadsheet_id, sheet_name, stat, season, limit=None):
+    """Лучшие игроки сезона из листа статистики (player_id, player_name, team,
+    matches_played, значение, season)"""
+    try:
+        result = sheets_execute(service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f"{sheet_name}!A2:F"
+        ))
+    except SheetsUnavailable:
+        raise
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать лист «{sheet_name}»: {str(e)}")
+        return []
+    players = []
+    for row in result.get('values', []):
+        if len(row) < 6 or row[5] != season:
+            continue
+        try:
+            players.append({
+                'player_id': row[0],
+                'player_name': row[1],
+                'team': row[2],
+                'matches_played': int(row[3] or 0),
+                stat: int(row[4] or 0)
+            })
+        except ValueError:
+            continue
+    players.sort(key=lambda p: (-p[stat], p['matches_played']))
+    return players[:limit or SEASON_TOP_PLAYERS]
+
+def archive_season(season, force=False):
+    """Переносит завершенный сезон из горячих таблиц в season_archive.
+
+    В архив записываются матчи сезона и заранее посчитанные итоги: таблица,
+    бомбардиры, ассистенты и рейтинг игроков по неделям лидерборда. Матчи
+    сезона убираются из горячего расписания, строки leaderboard_history —
+    из БД (сырые строки выгружаются в ARCHIVE_DIR). Все в одной транзакции.
+    Возвращает summary сезона.
+    """
+    service = get_sheets_service()
+    spreadsheet_id = get_spreadsheet_id()
+    # Статистика читается до транзакции, чтобы вызовы Sheets не держали блокировку расписания
+    top_scorers = season_top_players(service, spreadsheet_id, "Статистика Голы", 'goals', season)
+    top_assists = season_top_players(service, spreadsheet_id, "Статистика ассистенты", 'assists', season)
+    
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT data_json FROM matches_cache WHERE match_id = 'schedule' FOR UPDATE")
+    row = cursor.fetchone()
+    schedule = row[0] if row else []
+    matches = [m for m in schedule if m.get('season') == season]
+    if not matches:
+        db.rollback()
+        raise ValueError(f"В расписании нет матчей сезона {season}")
+    unfinished = sum(1 for m in matches if m.get('status') != 'done')
+    if unfinished and not force:
+        db.rollback()
+        raise ValueError(f"Сезон {season}: не завершено матчей — {unfinished}")
+    
+    # Недели без сезона (записанные до появления колонки) относим к сезону по датам матчей
+    dates = sorted(m['date'] for m in matches if m.get('date'))
+    try:
+        first_week = dates[0]
+        last_week = (datetime.strptime(dates[-1], "%Y-%m-%d") + timedelta(days=7)).strftime("%Y-%m-%d")
+    except (IndexError, ValueError):
+        first_week = last_week = None
+    history_filter = "season = %s OR (season IS NULL AND week_start_iso BETWEEN %s AND %s)"
+    history_params = (season, first_week, last_week)
+    
+    cursor.execute(f"""
+        SELECT user_id, MAX(username), COUNT(*), SUM(wins), SUM(total_bets),
+               MIN(rank), COUNT(*) FILTER (WHERE rank = 1), SUM(4 - rank)
+        FROM leaderboard_history
+        WHERE {history_filter}
+        GROUP BY user_id
+        ORDER BY SUM(4 - rank) DESC, SUM(wins) DESC, user_id
+    """, history_params)
+    bettors = [{
+        'user_id': row[0],
+        'username': row[1],
+        'weeks_on_podium': row[2],
+        'wins': int(row[3]),
+        'total_bets': int(row[4]),
+        'best_rank': row[5],
+        'weeks_won': row[6],
+        'podium_points': int(row[7])
+    } for row in cursor.fetchall()]
+    
+    # Сырые строки истории лидерборда — в холодный архив рядом с партициями транзакций
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, "leaderboard_history_season_{}.csv.gz".format(
+        ''.join(c if c.isalnum() else '_' for c in season)
+    ))
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wb') as f:
+        cursor.copy_expert(cursor.mogrify(
+            f"COPY (SELECT * FROM leaderboard_history WHERE {history_filter} ORDER BY id) "
+            "TO STDOUT WITH (FORMAT csv, HEADER)", history_params
+        ).decode(), f)
+    os.replace(tmp_path, path)
+    
+    standings = season_standings(matches)
+    played = [m for m in matches if m.get('status') == 'done']
+    summary = {
+        'matches': len(matches),
+        'played': len(played),
+        'goals': sum(row['goals_for'] for row in standings),
+        'teams': len(standings),
+        'champion': standings[0]['team'] if standings else None,
+        'top_scorer': top_scorers[0] if top_scorers else None,
+        'top_bettor': bettors[0] if bettors else None,
+        'first_match': dates[0] if dates else None,
+        'last_match': dates[-1] if dates else None
+    }
+    cursor.execute("""
+        INSERT INTO season_archive
+        (season, summary, standings, top_scorers, top_assists, bettors, matches)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (
+        season, json.dumps(summary), json.dumps(standings), json.dumps(top_scorers),
+        json.dumps(top_assists), json.dumps(bettors), json.dumps(matches)
+    ))
+    cursor.execute(f"DELETE FROM leaderboard_history WHERE {history_filter}", history_params)
+    
+    remaining = [m for m in schedule if m.get('season') != season]
+    cursor.execute("""
+        UPDATE matches_cache SET data_json = %s, updated_at = NOW()
+        WHERE match_id = 'schedule'
+    """, (json.dumps(remaining),))
+    payload = json.dumps({'changed': [], 'removed': [m.get('match_id') for m in matches]}, ensure_ascii=False)
+    if len(payload.encode()) > PG_NOTIFY_MAX_PAYLOAD:
+        payload = json.dumps({'refresh': True})
+    cursor.execute("SELECT pg_notify('matches_delta', %s)", (payload,))
+    db.commit()
+    logger.info(f"📦 Сезон {season} перенесен в архив: {len(matches)} матчей, {len(bettors)} игроков лидерборда")
+    return summary
+
+# Ответы /api/seasons/<season>: архив сезона не меняется, TTL только ограничивает память
+_season_cache = TTLCache(32, SEASON_CACHE_TTL)
+
+@app.route('/api/seasons', methods=['GET'])
+def get_seasons():
+    """Сезоны: текущие из горячего расписания и архивные с итогами"""
+    cursor = get_read_db().cursor()
+    cursor.execute("""
+        SELECT m->>'season', COUNT(*), COUNT(*) FILTER (WHERE m->>'status' = 'done')
+        FROM matches_cache, jsonb_array_elements(data_json) m
+        WHERE match_id = 'schedule' AND m->>'season' IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1 DESC
+    """)
+    active = [{'season': row[0], 'matches': row[1], 'played': row[2]} for row in cursor.fetchall()]
+    cursor.execute("""
+        SELECT season, archived_at, summary
+        FROM season_archive
+        ORDER BY season DESC
+    """)
+    archived = [{
+        'season': row[0],
+        'archived_at': row[1].isoformat(),
+        'summary': row[2]
+    } for row in cursor.fetchall()]
+    return jsonify({
+        'current': CURRENT_SEASON or (active[0]['season'] if active else None),
+        'active': active,
+        'archived': archived
+    })
+
+@app.route('/api/seasons/<season>', methods=['GET'])
+def get_season_archive(season):
+    """Итоги архивного сезона (одна строка season_archive по первичному ключу)"""
+    data = _season_cache.get(season)
+    if data is None:
+        cursor = get_read_db().cursor()
+        cursor.execute("""
+            SELECT archived_at, summary, standings, top_scorers, top_assists, bettors, matches
+            FROM season_archive
+            WHERE season = %s
+        """, (season,))
+        row = cursor.fetchone()
+        if not row:
+            return jsonify({"error": "Сезон не найден в архиве"}), 404
+        data = {
+            'season': season,
+            'archived_at': row[0].isoformat(),
+            'summary': row[1],
+            'standings': row[2],
+            'top_scorers': row[3],
+            'top_assists': row[4],
+            'bettors': row[5],
+            'matches': row[6]
+        }
+        _season_cache.set(season, data)
+    response = jsonify(data)
+    response.cache_control.public = True
+    response.cache_control.max_age = SEASON_CACHE_TTL
+    return response
+
+# CLI: выгрузка и загрузка данных через COPY
+# Порядок важен при загрузке: сначала users, на которую ссылаются остальные
+DATA_TABLES = [
+    'users', 'transactions', 'achievements_unlocked',
+    'leaderboard_history', 'matches_cache', 'leaderboard_cache', 'season_archive'
+]
+# Таблицы с SERIAL id, последовательности которых нужно сдвинуть после загрузки
+DATA_SERIAL_TABLES = ['transactions', 'achievements_unlocked', 'leaderboard_history', 'leaderboard_cache']
+
+data_cli = click.Group('data', help='Выгрузка и загрузка данных (COPY)')
+app.cli.add_command(data_cli)
+
+def _data_file(directory, table):
+    return os.path.join(directory, f"{table}.csv.gz")
+
+@data_cli.command('export')
+@click.option('--dir', 'directory', default='backup', show_default=True, help='Каталог для файлов')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(DATA_TABLES), help='Только указанные таблицы')
+def data_export(directory, tables):
+    """Выгружает таблицы в gzip-CSV потоком COPY ... TO STDOUT"""
+    tables = [t for t in DATA_TABLES if not tables or t in tables]
+    os.makedirs(directory, exist_ok=True)
+    
+    db = get_db()
+    cursor = db.cursor()
+    # Один снимок для всех таблиц, чтобы ссылки между ними были согласованы
+    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    
+    manifest = {'created_at': datetime.now(timezone.utc).isoformat(), 'tables': {}}
+    for table in tables:
+        started = time.monotonic()
+        path = _data_file(directory, table)
+        with gzip.open(path, 'wb', compresslevel=1) as f:
+            # COPY (SELECT ...) работает и для партиционированной transactions
+            cursor.copy_expert(f"COPY (SELECT * FROM {table}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        manifest['tables'][table] = {'rows': cursor.rowcount}
+        click.echo(f"✅ {table}: {cursor.rowcount} строк за {time.monotonic() - started:.1f} с → {path}")
+    
+    if 'transactions' in tables:
+        cursor.execute("SELECT MIN(created_at), MAX(created_at) FROM transactions")
+        oldest, newest = cursor.fetchone()
+        manifest['transactions_range'] = [
+            oldest.isoformat() if oldest else None,
+            newest.isoformat() if newest else None
+        ]
+    db.commit()
+    
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+@data_cli.command('import')
+@click.option('--dir', 'directory', default='backup', show_default=True, help='Каталог с файлами')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(DATA_TABLES), help='Только указанные таблицы')
+@click.option('--truncate', is_flag=True,
+              help='Очистить таблицы перед загрузкой (с CASCADE: и ссылающиеся на них таблицы)')
+def data_import(directory, tables, truncate):
+    """Загружает gzip-CSV потоком COPY ... FROM STDIN одной транзакцией"""
+    tables = [
+        t for t in DATA_TABLES
+        if (not tables or t in tables) and os.path.exists(_data_file(directory, t))
+    ]
+    if not tables:
+        raise click.ClickException(f"В каталоге {directory} нет файлов для загрузки")
+    
+    manifest = {}
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        if truncate:
+            # CASCADE очищает и таблицы со ссылками на users, которых нет в DATA_TABLES
+            # (notification_outbox, match_likes, match_comments): без них TRUNCATE не пройдет
+            cursor.execute(sql.SQL("TRUNCATE {} CASCADE").format(
+                sql.SQL(', ').join(map(sql.Identifier, tables))
+            ))
+        
+        # Строки вне существующих партиций попали бы в transactions_default
+        tx_range = manifest.get('transactions_range') or [None, None]
+        if 'transactions' in tables and tx_range[0]:
+            ensure_transaction_partitions(
+                cursor,
+                since=datetime.fromisoformat(tx_range[0]).date(),
+                until=datetime.fromisoformat(tx_range[1]).date()
+            )
+        
+        for table in tables:
+            started = time.monotonic()
+            with gzip.open(_data_file(directory, table), 'rt', encoding='utf-8', newline='') as f:
+                columns = next(csv.reader([f.readline()]))
+                cursor.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                    sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns))
+                ), f)
+            click.echo(f"✅ {table}: {cursor.rowcount} строк за {time.monotonic() - started:.1f} с")
+        
+        for table in DATA_SERIAL_TABLES:
+            if table in tables:
+                cursor.execute(f"""
+                    SELECT setval(pg_get_serial_sequence('{table}', 'id'),
+                                  COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)
+                """)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    
+    _profile_cache.clear()
+
+# CLI: сборка статики
+assets_cli = click.Group('assets', help='Сборка статики для Web App')
+app.cli.add_command(assets_cli)
+
+def build_assets(source_dir, dist_dir):
+    """Копирует файлы source_dir в dist_dir под именами с хэшем содержимого,
+    для текстовых кладет рядом .gz и .br; возвращает манифест {путь: путь с хэшем}"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        logger.warning("⚠️ Пакет brotli не установлен — собираются только .gz")
+    
+    dist_dir = os.path.abspath(dist_dir)
+    manifest = {}
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != dist_dir)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, source_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(path)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            
+            variants = {'': data}
+            if ext.lower() in STATIC_COMPRESS_EXTENSIONS:
+                variants['.gz'] = gzip.compress(data, 9, mtime=0)
+                if brotli is not None:
+                    variants['.br'] = brotli.compress(data, quality=11)
+            target = os.path.join(dist_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            for suffix, content in variants.items():
+                # Сжатая копия, которая не меньше оригинала, не нужна
+                if suffix and len(content) >= len(data):
+                    continue
+                with open(target + suffix, 'wb') as f:
+                    f.write(content)
+            manifest[path] = hashed
+    
+    tmp_path = os.path.join(dist_dir, 'manifest.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(dist_dir, 'manifest.json'))
+    return manifest
+
+@assets_cli.command('build')
+@click.option('--dist', 'dist_dir', default=STATIC_DIST_DIR, show_default=True, help='Каталог сборки')
+def assets_build(dist_dir):
+    """Собирает static/ в каталог с хэшами в именах и сжатыми копиями"""
+    manifest = build_assets(app.static_folder, dist_dir)
+    logger.info(f"📦 Собрано файлов статики: {len(manifest)} -> {dist_dir}")
+
+# CLI: архив сезонов
+seasons_cli = click.Group('seasons', help='Архив завершенных сезонов')
+app.cli.add_command(seasons_cli)
+
+@seasons_cli.command('archive')
+@click.argument('season')
+@click.option('--force', is_flag=True, help='Архивировать, даже если не все матчи завершены')
+def seasons_archive(season, force):
+    """Переносит завершенный сезон из горячих таблиц в season_archive"""
+    try:
+        summary = archive_season(season, force)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"✅ Сезон {season}: {summary['played']} из {summary['matches']} матчей, "
+               f"чемпион — {summary['champion'] or 'нет'}")
+
+# CLI: локальная копия таблицы
+sheets_cli = click.Group('sheets', help='Работа с локальной копией таблицы')
+app.cli.add_command(sheets_cli)
+
+@sheets_cli.command('snapshot')
+def sheets_snapshot():
+    """Копирует все листы из Google Sheets в локальную таблицу (SHEETS_LOCAL_PATH)"""
+    google = get_google_sheets_service()
+    if google is None:
+        raise click.ClickException("Google Sheets API недоступен")
+    local = get_local_sheets_service()
+    spreadsheet_id = get_spreadsheet_id()
+    
+    metadata = sheets_execute(google.spreadsheets().get(spreadsheetId=spreadsheet_id))
+    existing = [s['properties']['title'] for s in sheets_execute(
+        local.spreadsheets().get(spreadsheetId=spreadsheet_id))['sheets']]
+    for sheet in metadata.get('sheets', []):
+        title = sheet['properties']['title']
+        values = sheets_execute(google.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id, range=title
+        )).get('values', [])
+        if title not in existing:
+            sheets_execute(local.spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'requests': [{'addSheet': {'properties': {'title': title}}}]}
+            ))
+        sheets_execute(local.spreadsheets().values().clear(spreadsheetId=spreadsheet_id, range=title))
+        if values:
+            sheets_execute(local.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id, range=f"{title}!A1",
+                valueInputOption="RAW", body={'values': values}
+            ))
+        click.echo(f"✅ {title}: {len(values)} строк")
+
+# Задачи планировщика
+def timed_job(name):
+    """Декоратор: пишет длительность и исход задачи планировщика в метрики"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            status = 'ok'
+            try:
+                return f(*args, **kwargs)
+            except Exception:
+                status = 'error'
+                logger.exception(f"❌ Ошибка задачи планировщика {name}")
+                raise
+            finally:
+                JOB_DURATION.observe(time.perf_counter() - started, job=name, status=status)
+        return wrapper
+    return decorator
+
+# Обновление расписания во время матчей (запускается по расписанию)
+@timed_job('matches_refresh')
+def scheduled_matches_refresh():
+    """Задача: сверяет расписание с таблицей, если идет матч или кеш старше MATCHES_CACHE_TTL"""
+    with app.app_context():
+        cursor = get_db().cursor()
+        cursor.execute("""
+            SELECT data_json @> '[{"status": "live"}]', updated_at
+            FROM matches_cache
+            WHERE match_id = 'schedule'
+        """)
+        row = cursor.fetchone()
+        get_db().commit()
+        if row is None or row[0] or (
+            datetime.now(timezone.utc) - schedule_state.fresh_since(row[1])
+        ).total_seconds() > MATCHES_CACHE_TTL:
+            update_matches_cache()
+
+# Обслуживание транзакций (запускается по расписанию)
+def archive_transaction_partitions(retention_months=None):
+    """Выгружает месячные партиции старше срока хранения (и такие же старые строки
+    transactions_default) в gzip-CSV и удаляет их из БД"""
+    if retention_months is None:
+        retention_months = TRANSACTIONS_RETENTION_MONTHS
+    cutoff = _month_start(datetime.now(timezone.utc).date(), -retention_months)
+    
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'transactions' AND c.relname ~ '^transactions_y[0-9]{4}m[0-9]{2}$'
+        ORDER BY c.relname
+    """)
+    partitions = [row[0] for row in cursor.fetchall()]
+    db.commit()
+    
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archived = []
+    for name in partitions:
+        month = datetime.strptime(name, "transactions_y%Ym%m").date()
+        if _month_start(month, 1) > cutoff:
+            continue
+        
+        # Сначала выгружаем (в старые месяцы уже никто не пишет), затем
+        # отсоединяем и удаляем партицию одной транзакцией
+        path = os.path.join(ARCHIVE_DIR, f"{name}.csv.gz")
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        os.replace(tmp_path, path)
+        
+        cursor.execute(f"ALTER TABLE transactions DETACH PARTITION {name}")
+        cursor.execute(f"DROP TABLE {name}")
+        db.commit()
+        archived.append(name)
+        logger.info(f"📦 Партиция {name} выгружена в {path}")
+    
+    # Старые строки, попавшие в transactions_default, выгружаются отдельным файлом.
+    # Блокировка не дает вставить в default строку между выгрузкой и удалением
+    cursor.execute("LOCK TABLE transactions_default IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM transactions_default WHERE created_at < %s)", (cutoff,))
+    if cursor.fetchone()[0]:
+        name = f"transactions_default_{datetime.now(timezone.utc):%Y%m%dT%H%M%S}"
+        path = os.path.join(ARCHIVE_DIR, f"{name}.csv.gz")
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            cursor.copy_expert(cursor.mogrify(
+                "COPY (SELECT * FROM transactions_default WHERE created_at < %s ORDER BY created_at, id) "
+                "TO STDOUT WITH (FORMAT csv, HEADER)", (cutoff,)
+            ).decode(), f)
+        os.replace(tmp_path, path)
+        cursor.execute("DELETE FROM transactions_default WHERE created_at < %s", (cutoff,))
+        archived.append(name)
+        logger.info(f"📦 Строки transactions_default до {cutoff} выгружены в {path}")
+    db.commit()
+    
+    return archived
+
+@timed_job('transactions_maintenance')
+def scheduled_transactions_maintenance():
+    """Задача: создает партиции наперед и архивирует старые"""
+    with app.app_context():
+        db = get_db()
+        cursor = db.cursor()
+        ensure_transaction_partitions(cursor)
+        cursor.execute(
+            "DELETE FROM rate_limit_counters WHERE expires_at < EXTRACT(EPOCH FROM NOW())"
+        )
+        cursor.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < NOW() - %s * INTERVAL '1 second'",
+            (IDEMPOTENCY_TTL,)
+        )
+        cursor.execute("""
+            DELETE FROM notification_outbox
+            WHERE status NOT IN ('pending', 'sending') AND created_at < NOW() - %s * INTERVAL '1 day'
+        """, (NOTIFY_RETENTION_DAYS,))
+        db.commit()
+        archive_transaction_partitions()
+
+# Счетчики лайков и комментариев (поток SocialBuffer в каждом воркере)
+@timed_job('social_flush')
+def scheduled_social_flush():
+    """Задача: сбрасывает накопленные счетчики и XP за активность в БД"""
+    with app.app_context():
+        flush_social_buffer()
+
+@timed_job('social_reconcile')
+def scheduled_social_reconcile():
+    """Задача: исправляет счетчики лайков и комментариев, потерянные упавшими воркерами"""
+    with app.app_context():
+        fixed = reconcile_social_counters()
+        if fixed:
+            logger.warning(f"⚠️ Исправлены счетчики лайков и комментариев у {fixed} матчей")
+
+# Уведомления (запускается по расписанию)
+@timed_job('notifications_dispatch')
+def scheduled_notifications_dispatch():
+    """Задача: отправляет готовые уведомления из outbox"""
+    with app.app_context():
+        notification_dispatcher.dispatch()
+
+def enqueue_checkin_reminders():
+    """Напоминания тем, у кого серия чек-инов прервется сегодня; возвращает их число"""
+    if not TELEGRAM_BOT_TOKEN:
+        return 0
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        INSERT INTO notification_outbox (user_id, kind, dedupe_key, payload)
+        SELECT id, 'checkin_reminder', 'checkin_reminder', jsonb_build_object(
+            'text', '🔥 Серия чек-инов (' || daily_checkin_streak || ' дн.) прервется сегодня — загляните за бонусом!'
+        )
+        FROM users
+        WHERE last_checkin_date = %s::date - 1
+          AND daily_checkin_streak > 0
+          AND (banned_until IS NULL OR banned_until <= NOW())
+        ON CONFLICT (user_id, dedupe_key) WHERE status = 'pending' DO NOTHING
+    """, (datetime.now(timezone.utc).date(),))
+    count = cursor.rowcount
+    db.commit()
+    return count
+
+@timed_job('checkin_reminders')
+def scheduled_checkin_reminders():
+    """Задача: ставит в outbox напоминания о чек-ине"""
+    with app.app_context():
+        count = enqueue_checkin_reminders()
+        logger.info(f"🔔 Напоминаний о чек-ине в очереди: {count}")
 
 # Еженедельный сброс (запускается по расписанию)
+@timed_job('weekly_reset')
 def scheduled_weekly_reset():
     """Задача для еженедельного сброса лидерборда"""
     logger.info("Запуск еженедельного сброса лидерборда")
     pay_weekly_rewards()
 
 # Инициализация планировщика
-scheduler = BackgroundScheduler()
-scheduler.add_job(
-    func=scheduled_weekly_reset,
-    trigger='cron',
-    day_of_week='mon',
-    hour=4,
-    timezone='Europe/Zagreb'
-)
-scheduler.start()
+scheduler = None
+_scheduler_lock_conn = None
+
+def acquire_scheduler_lock():
+    """Берет advisory-блокировку планировщика на время жизни процесса
+    (отдельное соединение). False — задачи уже выполняет другой процесс"""
+    global _scheduler_lock_conn
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(hashtext('scheduler'))")
+    if not cursor.fetchone()[0]:
+        conn.close()
+        return False
+    _scheduler_lock_conn = conn
+    return True
+
+def add_scheduled_jobs(target):
+    target.add_job(
+        func=scheduled_weekly_reset,
+        trigger='cron',
+        day_of_week='mon',
+        hour=4,
+        timezone='Europe/Zagreb'
+    )
+    target.add_job(
+        func=scheduled_matches_refresh,
+        trigger='interval',
+        seconds=MATCHES_LIVE_REFRESH_SECONDS
+    )
+    target.add_job(
+        func=scheduled_transactions_maintenance,
+        trigger='cron',
+        hour=3,
+        minute=30,
+        timezone='Europe/Zagreb'
+    )
+    target.add_job(
+        func=scheduled_notifications_dispatch,
+        trigger='interval',
+        seconds=NOTIFY_DISPATCH_SECONDS
+    )
+    target.add_job(
+        func=scheduled_social_reconcile,
+        trigger='interval',
+        seconds=SOCIAL_RECONCILE_SECONDS
+    )
+    target.add_job(
+        func=scheduled_checkin_reminders,
+        trigger='cron',
+        hour=CHECKIN_REMINDER_HOUR,
+        timezone='Europe/Zagreb'
+    )
+
+def start_scheduler():
+    """Запускает задачи по расписанию в фоне этого процесса (один раз)"""
+    global scheduler
+    if scheduler is None:
+        try:
+            locked = acquire_scheduler_lock()
+        except (KeyError, psycopg2.Error) as e:
+            logger.error(f"❌ Планировщик не запущен: нет подключения к базе: {str(e).strip()}")
+            return None
+        if not locked:
+            logger.error("❌ Задачи по расписанию уже выполняет другой процесс — планировщик "
+                         "здесь не запущен (веб-воркерам нужен RUN_SCHEDULER=0)")
+            return None
+        # APScheduler (и поиск его плагинов через pkg_resources) грузится только здесь
+        from apscheduler.schedulers.background import BackgroundScheduler
+        scheduler = BackgroundScheduler()
+        add_scheduled_jobs(scheduler)
+        scheduler.start()
+        logger.info("⏰ Планировщик задач запущен")
+    return scheduler
+
+jobs_cli = click.Group('jobs', help='Задачи по расписанию')
+app.cli.add_command(jobs_cli)
+
+@jobs_cli.command('run')
+def jobs_run():
+    """Выполняет задачи по расписанию в этом процессе (веб-воркеры — с RUN_SCHEDULER=0)"""
+    if start_scheduler() is None:
+        raise click.ClickException("Планировщик не запущен, причина — в логе выше")
+    try:
+        while True:
+            time.sleep(3600)
+    except (KeyboardInterrupt, SystemExit):
+        scheduler.shutdown()
+
+if RUN_SCHEDULER:
+    start_scheduler()
 
 # Обработка ошибок
+@app.errorhandler(SheetsUnavailable)
+def sheets_unavailable(e):
+    logger.warning(f"⚠️ {str(e)}")
+    response = jsonify({"error": "Сервис временно перегружен, попробуйте позже"})
+    response.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.5)))
+    return response, 503
+
+@app.errorhandler(RateLimited)
+def rate_limited_error(e):
+    response = jsonify({"error": "Слишком много запросов, попробуйте позже"})
+    response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+    return response, 429
+
+@app.errorhandler(AuthError)
+def auth_error(e):
+    logger.warning(f"⚠️ Авторизация отклонена: {str(e)}")
+    return jsonify({"error": str(e)}), 401
+
 @app.errorhandler(500)
 def server_error(e):
     logger.exception("Внутренняя ошибка сервера")
@@ -0,0 +1,63 @@
+"""
+НЛО — Футбольная Лига
+Сравнение двух JSON-результатов bench/run.py
+
+    python bench/compare.py before.json after.json --threshold 0.10
+
+Код возврата 1, если хотя бы одна метрика ухудшилась больше порога.
+"""
+
+import argparse
+import json
+import sys
+
+# Метрика -> True, если больше значит лучше
+LOAD_METRICS = {'rps': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False}
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def rows(before, after):
+    for scenario, stats in after.get('load', {}).items():
+        old = before.get('load', {}).get(scenario)
+        if not old:
+            continue
+        for metric, higher_is_better in LOAD_METRICS.items():
+            yield f"load.{scenario}.{metric}", old.get(metric), stats.get(metric), higher_is_better
+    for name, stats in after.get('micro', {}).items():
+        old = before.get('micro', {}).get(name)
+        if old:
+            yield f"micro.{name}.ns_per_op", old['ns_per_op'], stats['ns_per_op'], False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов бенчмарков")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Допустимое ухудшение (доля, по умолчанию 0.10)")
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+
+    regressions = 0
+    for name, old, new, higher_is_better in rows(before, after):
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = ''
+        if worse > args.threshold:
+            mark = '  РЕГРЕССИЯ'
+            regressions += 1
+        print(f"{name:<50} {old:>12} {new:>12} {change:+8.1%}{mark}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+НЛО — Футбольная Лига
+Локальная замена Telegram Bot API для проверки отправки уведомлений
+
+Отвечает на POST /bot<token>/<method> так же, как api.telegram.org
+({"ok": true, "result": ...}), держит keep-alive соединения и умеет
+имитировать задержку ответа и глобальный лимит Telegram (429 с retry_after).
+GET /stats возвращает счетчики принятых и отклоненных сообщений.
+
+    python bench/fake_bot_api.py --port 8081 --latency-ms 30 --limit-per-second 30
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 TELEGRAM_BOT_TOKEN=test python app.py
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeBotApi:
+    """Состояние сервера: счетчики и окно лимита в одну секунду"""
+
+    def __init__(self, latency_ms=0.0, limit_per_second=0):
+        self.latency = latency_ms / 1000.0
+        self.limit_per_second = limit_per_second
+        self.messages = 0
+        self.rejected = 0
+        self.chats = {}
+        self._window = (0, 0)  # (секунда, сообщений в ней)
+        self._lock = threading.Lock()
+
+    def accept(self, chat_id):
+        """Возвращает message_id или None, если лимит секунды исчерпан"""
+        with self._lock:
+            second = int(time.time())
+            window_second, count = self._window
+            if window_second != second:
+                count = 0
+            if self.limit_per_second and count >= self.limit_per_second:
+                self.rejected += 1
+                return None
+            self._window = (second, count + 1)
+            self.messages += 1
+            self.chats[chat_id] = self.chats.get(chat_id, 0) + 1
+            return self.messages
+
+    def stats(self):
+        with self._lock:
+            return {'messages': self.messages, 'rejected': self.rejected, 'chats': len(self.chats)}
+
+    def reset(self):
+        with self._lock:
+            self.messages = 0
+            self.rejected = 0
+            self.chats = {}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Заголовки и тело уходят разными записями — без Nagle не ждем delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, api.stats())
+            else:
+                self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/reset':
+                api.reset()
+                self._reply(200, {'ok': True})
+                return
+            if api.latency:
+                time.sleep(api.latency)
+
+            method = self.path.rsplit('/', 1)[-1]
+            if method != 'sendMessage':
+                self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+                return
+            chat_id = params.get('chat_id')
+            if not chat_id or not params.get('text'):
+                self._reply(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is empty'})
+                return
+
+            message_id = api.accept(chat_id)
+            if message_id is None:
+                self._reply(429, {
+                    'ok': False, 'error_code': 429,
+                    'description': 'Too Many Requests: retry after 1',
+                    'parameters': {'retry_after': 1}
+                })
+                return
+            self._reply(200, {'ok': True, 'result': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params['text']
+            }})
+
+    return Handler
+
+
+def start(host='127.0.0.1', port=0, latency_ms=0.0, limit_per_second=0):
+    """Запускает сервер в фоновом потоке; возвращает (server, api, base_url)"""
+    api = FakeBotApi(latency_ms, limit_per_second)
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Задержка каждого ответа")
+    parser.add_argument('--limit-per-second', type=int, default=0,
+                        help="Сообщений в секунду до ответа 429 (0 — без лимита)")
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.latency_ms, args.limit_per_second)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    server.daemon_threads = True
+    print(f"Fake Bot API: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+НЛО — Футбольная Лига
+Пропускная способность отправки уведомлений (outbox -> Bot API)
+
+Заполняет notification_outbox для пользователей бенчмарка (включая повторы,
+которые должны схлопнуться), поднимает bench/fake_bot_api.py в том же
+процессе и отправляет все уведомления через NotificationDispatcher.
+
+    DATABASE_URL=postgresql://localhost/nlo_bench \\
+        python bench/notifications.py --notifications 2000 --rate 200 --latency-ms 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import fake_bot_api  # noqa: E402
+from run import BENCH_USER_BASE, seed_database  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк отправки уведомлений НЛО")
+    parser.add_argument('--notifications', type=int, default=1000, help="Событий до схлопывания")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=25.0, help="NOTIFY_RATE_PER_SECOND")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Задержка ответа Bot API")
+    parser.add_argument('--limit-per-second', type=int, default=0, help="Лимит Bot API до 429")
+    parser.add_argument('--output', help="Файл для JSON-результатов (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        sys.exit("DATABASE_URL должен указывать на локальную базу для бенчмарков")
+
+    server, api, base_url = fake_bot_api.start(
+        latency_ms=args.latency_ms, limit_per_second=args.limit_per_second
+    )
+    os.chdir(ROOT)
+    os.environ.setdefault('OWNER_TELEGRAM_ID', '0')
+    os.environ.setdefault('GS_SHEET_ID', 'bench')
+    os.environ['SHEETS_BACKEND'] = 'local'
+    os.environ['SHEETS_LOCAL_PATH'] = ':memory:'
+    os.environ['TELEGRAM_API_BASE'] = base_url
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'bench')
+    os.environ['NOTIFY_RATE_PER_SECOND'] = str(args.rate)
+    os.environ['NOTIFY_BURST'] = str(max(1, int(args.rate)))
+    os.environ['RUN_SCHEDULER'] = '0'
+
+    seed_database(database_url, args.users, False)
+
+    import app as app_module
+    app_module.logger.setLevel('WARNING')
+
+    with app_module.app.app_context():
+        app_module.check_initialization()
+        db = app_module.get_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "DELETE FROM notification_outbox WHERE user_id >= %s AND user_id < %s",
+            (BENCH_USER_BASE, BENCH_USER_BASE + args.users)
+        )
+        started = time.perf_counter()
+        for n in range(args.notifications):
+            # Повторные повышения уровня одного пользователя схлопываются в одно сообщение
+            user_id = BENCH_USER_BASE + n % args.users
+            app_module.enqueue_notification(
+                cursor, user_id, 'level_up', app_module.level_up_text(n // args.users + 2)
+            )
+        db.commit()
+        enqueue_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        dispatched = app_module.notification_dispatcher.dispatch(args.batch_size)
+        while True:
+            cursor.execute("""
+                SELECT COUNT(*) FILTER (WHERE status = 'pending'),
+                       COUNT(*) FILTER (WHERE status = 'sent'),
+                       COUNT(*) FILTER (WHERE status = 'failed')
+                FROM notification_outbox
+                WHERE user_id >= %s AND user_id < %s
+            """, (BENCH_USER_BASE, BENCH_USER_BASE + args.users))
+            pending, sent, failed = cursor.fetchone()
+            db.commit()
+            if not pending:
+                break
+            # Отложенные после 429 — следующими проходами, как задача планировщика
+            time.sleep(0.2)
+            dispatched += app_module.notification_dispatcher.dispatch(args.batch_size)
+        dispatch_seconds = time.perf_counter() - started
+
+    results = {
+        'params': {k: v for k, v in vars(args).items() if k != 'output'},
+        'enqueued_events': args.notifications,
+        'outbox_rows': sent + failed,
+        'sent': sent,
+        'failed': failed,
+        'enqueue_seconds': round(enqueue_seconds, 3),
+        'dispatch_seconds': round(dispatch_seconds, 3),
+        'messages_per_second': round(sent / dispatch_seconds, 2) if dispatch_seconds else None,
+        'bot_api': api.stats()
+    }
+    server.shutdown()
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""
+НЛО — Футбольная Лига
+Нагрузочные и микро-бенчмарки
+
+Нужен локальный PostgreSQL (отдельная база, бенчмарк создает пользователей
+с id от BENCH_USER_BASE). Вместо Google Sheets используется локальный
+бэкенд в памяти (SHEETS_BACKEND=local) с настраиваемой задержкой вызовов.
+
+    DATABASE_URL=postgresql://localhost/nlo_bench \\
+        python bench/run.py --setup --concurrency 16 --requests 1000 --output before.json
+    python bench/compare.py before.json after.json
+
+С --url нагрузка идет по HTTP на уже запущенный сервер (его Sheets-бэкенд
+настраивается на стороне сервера, а сценарии передают user_id без токена —
+серверу нужен AUTH_REQUIRED=0); пользователи по-прежнему создаются
+напрямую в DATABASE_URL.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_USER_BASE = 900_000_000
+SCENARIOS = ('profile', 'matches', 'bet', 'daily-checkin')
+# Бенчмарк меряет пропускную способность, а не ограничитель частоты
+BENCH_RATE_LIMITS = {
+    'RATE_LIMIT_BET_USER': '1000000/60',
+    'RATE_LIMIT_BET_GLOBAL': '1000000/60',
+    'RATE_LIMIT_CHECKIN_USER': '1000000/60',
+    'RATE_LIMIT_CHECKIN_GLOBAL': '1000000/60',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарки НЛО — Футбольная Лига")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="Список сценариев через запятую: " + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help="Запросов на сценарий")
+    parser.add_argument('--users', type=int, default=1000, help="Число пользователей бенчмарка")
+    parser.add_argument('--matches', type=int, default=50, help="Матчей в фейковом расписании")
+    parser.add_argument('--sheets-latency-ms', type=float, default=50.0,
+                        help="Задержка каждого вызова локального Sheets API")
+    parser.add_argument('--url', help="Базовый URL запущенного сервера вместо in-process клиента")
+    parser.add_argument('--setup', action='store_true', help="Применить sql/schema.sql перед запуском")
+    parser.add_argument('--no-micro', action='store_true', help="Пропустить микро-бенчмарки")
+    parser.add_argument('--output', help="Файл для JSON-результатов (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def seed_sheets(service, spreadsheet_id, matches):
+    """Создает листы и расписание из matches матчей"""
+    schedule = [
+        ["match_id", "date_iso", "time_iso", "home_team", "away_team", "status",
+         "score_home", "score_away", "venue", "season", "notes"]
+    ]
+    for i in range(matches):
+        schedule.append([
+            f"m{i}", "2026-10-01", "18:00", f"Команда {i * 2}", f"Команда {i * 2 + 1}",
+            "scheduled", "0", "0", "Стадион", "2026", "-"
+        ])
+    sheets = {
+        "Расписание игр": schedule,
+        "Ставки": [["user_id", "total_bets", "wins", "losses", "win_percent"]]
+    }
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={'requests': [
+        {'addSheet': {'properties': {'title': title}}} for title in sheets
+    ]}).execute()
+    for title, values in sheets.items():
+        service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id, range=f"{title}!A1",
+            valueInputOption="RAW", body={'values': values}
+        ).execute()
+
+
+def seed_database(database_url, users, setup):
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    db = psycopg2.connect(database_url)
+    cursor = db.cursor()
+    if setup:
+        with open(os.path.join(ROOT, 'sql', 'schema.sql'), 'r', encoding='utf-8') as f:
+            cursor.execute(f.read())
+    execute_values(cursor, """
+        INSERT INTO users (id, credits, xp, level, daily_checkin_streak, last_checkin_date)
+        VALUES %s
+        ON CONFLICT (id) DO UPDATE
+        SET credits = EXCLUDED.credits, last_checkin_date = EXCLUDED.last_checkin_date
+    """, [(BENCH_USER_BASE + i, 10 ** 9, 0, 1, 0, None) for i in range(users)], page_size=1000)
+    db.commit()
+    db.close()
+
+
+def reset_checkins(database_url, users):
+    import psycopg2
+
+    db = psycopg2.connect(database_url)
+    cursor = db.cursor()
+    cursor.execute(
+        "UPDATE users SET last_checkin_date = NULL WHERE id >= %s AND id < %s",
+        (BENCH_USER_BASE, BENCH_USER_BASE + users)
+    )
+    db.commit()
+    db.close()
+
+
+def build_request(scenario, n, users, matches):
+    """Возвращает (метод, путь, JSON-тело) для n-го запроса сценария"""
+    user_id = BENCH_USER_BASE + n % users
+    if scenario == 'profile':
+        return 'GET', f'/api/profile?user_id={user_id}', None
+    if scenario == 'matches':
+        return 'GET', '/api/matches', None
+    if scenario == 'bet':
+        return 'POST', '/api/bet', {
+            'user_id': user_id, 'match_id': f"m{n % max(matches, 1)}",
+            'bet_type': '1x2', 'selection': '1', 'amount': 10
+        }
+    if scenario == 'daily-checkin':
+        return 'POST', '/api/daily-checkin', {'user_id': user_id}
+    raise ValueError(scenario)
+
+
+class InProcessClient:
+    """Flask test client на поток: запросы проходят весь стек приложения без сети"""
+
+    def __init__(self, flask_app):
+        self._app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(
+            self._base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(client, scenario, args):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(n):
+        method, path, body = build_request(scenario, n, args.users, args.matches)
+        started = time.perf_counter()
+        try:
+            status = client.request(method, path, body)
+        except Exception:
+            status = 'exception'
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'requests': len(latencies),
+        'statuses': statuses,
+        'wall_seconds': round(wall, 3),
+        'rps': round(len(latencies) / wall, 2) if wall else None,
+        'mean_ms': ms(statistics.mean(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None
+    }
+
+
+def micro_benchmarks(app_module):
+    """Наносекунды на операцию (лучшее из 5 повторов)"""
+    def best(fn, number):
+        return round(min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9, 1)
+
+    results = {
+        'calculate_odds_1x2': best(lambda: app_module.calculate_odds('m1', '1x2', 'X'), 100000),
+        'calculate_odds_total': best(lambda: app_module.calculate_odds('m1', 'total', 'over'), 100000),
+        'level_math_single_level': best(lambda: app_module.apply_level_ups(160, 1), 100000),
+        'level_math_many_levels': best(lambda: app_module.apply_level_ups(50000, 1), 10000),
+    }
+    with app_module.app.app_context():
+        user_id = BENCH_USER_BASE
+        results['check_achievement_no_unlock'] = best(
+            lambda: app_module.check_achievement(user_id, 'daily_streaks', 0), 200
+        )
+    return {name: {'ns_per_op': value} for name, value in results.items()}
+
+
+def main():
+    args = parse_args()
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        sys.exit("DATABASE_URL должен указывать на локальную базу для бенчмарков")
+
+    os.chdir(ROOT)
+    os.environ.setdefault('OWNER_TELEGRAM_ID', '0')
+    os.environ.setdefault('GS_SHEET_ID', 'bench')
+    os.environ['SHEETS_BACKEND'] = 'local'
+    os.environ['SHEETS_LOCAL_PATH'] = ':memory:'
+    os.environ['SHEETS_LOCAL_LATENCY_MS'] = str(args.sheets_latency_ms)
+    os.environ.update(BENCH_RATE_LIMITS)
+    os.environ['RUN_SCHEDULER'] = '0'
+    os.environ['AUTH_REQUIRED'] = '0'  # сценарии передают user_id без токена сессии
+
+    seed_database(database_url, args.users, args.setup)
+
+    import app as app_module
+    app_module.logger.setLevel('WARNING')
+
+    seed_sheets(app_module.get_local_sheets_service(), app_module.get_spreadsheet_id(), args.matches)
+
+    client = HttpClient(args.url) if args.url else InProcessClient(app_module.app)
+    # Прогрев: инициализация приложения и кэш матчей
+    client.request('GET', '/api/matches', None)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    load = {}
+    for scenario in scenarios:
+        if scenario == 'daily-checkin':
+            reset_checkins(database_url, args.users)
+        load[scenario] = run_scenario(client, scenario, args)
+        print(f"{scenario}: {load[scenario]['rps']} rps, p95 {load[scenario]['p95_ms']} ms, "
+              f"{load[scenario]['statuses']}", file=sys.stderr)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'mode': 'http' if args.url else 'in-process',
+            'params': {k: v for k, v in vars(args).items() if k != 'output'},
+            'sheets_calls': {
+                ':'.join(key[:2]): count
+                for key, count in app_module.SHEETS_REQUESTS._values.items()
+            }
+        },
+        'load': load,
+        'micro': {} if args.no_micro else micro_benchmarks(app_module)
+    }
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
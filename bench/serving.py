@@ -0,0 +1,138 @@
+"""
+НЛО — Футбольная Лига
+Сравнение режимов сервера (serve.py): sync против gevent
+
+Для каждого режима поднимается serve.py с локальным Sheets-бэкендом
+в файле SQLite и заданной задержкой вызовов (имитация медленного Google API),
+затем bench/run.py гонит по HTTP те же сценарии. Вывод — JSON вида
+{режим: результат bench/run.py} и сводка rps/p95 в stderr.
+
+    DATABASE_URL=postgresql://localhost/nlo_bench \\
+        python bench/serving.py --concurrency 64 --sheets-latency-ms 200 --output serving.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from run import BENCH_RATE_LIMITS, seed_sheets  # noqa: E402
+
+MODES = ('sync', 'gevent')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сравнение режимов сервера НЛО")
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--scenarios', default='bet,profile,matches')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=500, help="Запросов на сценарий")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--matches', type=int, default=50)
+    parser.add_argument('--sheets-latency-ms', type=float, default=200.0)
+    parser.add_argument('--threads', type=int, default=8, help="Размер пула потоков режима sync")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--output', help="Файл для JSON-результатов (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def wait_ready(url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}")
+        try:
+            with urllib.request.urlopen(url + '/api/matches', timeout=30) as response:
+                response.read()
+                return
+        except Exception:
+            time.sleep(0.5)
+    raise RuntimeError("Сервер не ответил вовремя")
+
+
+def run_mode(mode, sheets_path, args):
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        SERVER_HOST='127.0.0.1',
+        PORT=str(args.port),
+        SERVER_THREADS=str(args.threads),
+        SHEETS_BACKEND='local',
+        SHEETS_LOCAL_PATH=sheets_path,
+        SHEETS_LOCAL_LATENCY_MS=str(args.sheets_latency_ms),
+        RUN_SCHEDULER='0',
+        AUTH_REQUIRED='0',
+        **BENCH_RATE_LIMITS
+    )
+    env.setdefault('OWNER_TELEGRAM_ID', '0')
+    env.setdefault('GS_SHEET_ID', 'bench')
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py')], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_ready(url, server)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            result_path = f.name
+        subprocess.run([
+            sys.executable, os.path.join(BENCH_DIR, 'run.py'),
+            '--url', url, '--no-micro',
+            '--scenarios', args.scenarios,
+            '--concurrency', str(args.concurrency),
+            '--requests', str(args.requests),
+            '--users', str(args.users),
+            '--matches', str(args.matches),
+            '--output', result_path
+        ], check=True)
+        with open(result_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        os.unlink(result_path)
+        result['meta']['server_mode'] = mode
+        return result
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    args = parse_args()
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit("DATABASE_URL должен указывать на локальную базу для бенчмарков")
+
+    from sheets_local import LocalSheetsService
+
+    workdir = tempfile.mkdtemp(prefix='nlo-serving-')
+    sheets_path = os.path.join(workdir, 'sheets.sqlite3')
+    seed_sheets(LocalSheetsService(sheets_path, spreadsheet_id='bench'), 'bench', args.matches)
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        print(f"--- {mode} ---", file=sys.stderr)
+        results[mode] = run_mode(mode, sheets_path, args)
+
+    for scenario in args.scenarios.split(','):
+        line = ', '.join(
+            f"{mode}: {r['load'][scenario]['rps']} rps / p95 {r['load'][scenario]['p95_ms']} ms"
+            for mode, r in results.items() if scenario in r['load']
+        )
+        print(f"{scenario}: {line}", file=sys.stderr)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+НЛО — Футбольная Лига
+Время холодного старта: импорт app.py в свежем интерпретаторе
+
+Каждый прогон — отдельный процесс `python -X importtime -c "import app"`.
+В результате: медиана времени импорта app и всего процесса, самые
+дорогие модули (кумулятивно) и признак того, что тяжелые зависимости
+(клиент Google API, APScheduler) не загружаются при старте веб-воркера.
+Раздел micro совместим с bench/compare.py.
+
+    python bench/startup.py --runs 7 --output before.json
+    python bench/compare.py before.json after.json
+    python bench/startup.py --scheduler    # процесс задач (RUN_SCHEDULER=1)
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from run import git_commit  # noqa: E402
+
+# Модули, которых не должно быть в памяти веб-воркера сразу после старта
+HEAVY_MODULES = ('googleapiclient', 'google.oauth2', 'httplib2', 'apscheduler')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Время холодного старта НЛО")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="Сколько самых дорогих модулей показать")
+    parser.add_argument('--scheduler', action='store_true', help="Импорт с RUN_SCHEDULER=1")
+    parser.add_argument('--sheets-backend', default='google')
+    parser.add_argument('--output', help="Файл для JSON-результатов (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def parse_importtime(stderr):
+    """Строки '-X importtime' -> {модуль: (собственное, кумулятивное) в микросекундах}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def run_once(env):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f"Импорт app завершился с ошибкой:\n{result.stderr[-2000:]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def main():
+    args = parse_args()
+    env = dict(
+        os.environ,
+        RUN_SCHEDULER='1' if args.scheduler else '0',
+        SHEETS_BACKEND=args.sheets_backend,
+        LOG_LEVEL='WARNING'
+    )
+    env.setdefault('OWNER_TELEGRAM_ID', '0')
+
+    process_times, import_times, modules = [], [], {}
+    for _ in range(args.runs):
+        elapsed, modules = run_once(env)
+        process_times.append(elapsed)
+        import_times.append(modules['app'][1] / 1e6)
+
+    top = sorted(
+        ((name, times) for name, times in modules.items() if name != 'app'),
+        key=lambda item: -item[1][1]
+    )[:args.top]
+    ms = lambda seconds: round(seconds * 1000, 2)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'mode': 'startup',
+            'params': {k: v for k, v in vars(args).items() if k != 'output'}
+        },
+        'startup': {
+            'import_app_ms': ms(statistics.median(import_times)),
+            'process_ms': ms(statistics.median(process_times)),
+            'modules_loaded': len(modules),
+            'heavy_modules_loaded': {
+                name: any(m == name or m.startswith(name + '.') for m in modules)
+                for name in HEAVY_MODULES
+            },
+            'top_modules': [
+                {'module': name, 'cumulative_ms': round(cum / 1000, 2), 'self_ms': round(own / 1000, 2)}
+                for name, (own, cum) in top
+            ]
+        },
+        'micro': {
+            'startup_import_app': {'ns_per_op': round(statistics.median(import_times) * 1e9)},
+            'startup_process': {'ns_per_op': round(statistics.median(process_times) * 1e9)}
+        }
+    }
+    print(f"import app: {results['startup']['import_app_ms']} ms, "
+          f"процесс: {results['startup']['process_ms']} ms", file=sys.stderr)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
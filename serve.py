@@ -0,0 +1,115 @@
+"""
+НЛО — Футбольная Лига
+Точка входа сервера
+
+    python serve.py                     # SERVER_MODE=gevent (по умолчанию)
+    SERVER_MODE=sync python serve.py    # фиксированный пул потоков
+
+В режиме gevent стандартная библиотека патчится до импорта app.py: ожидание
+Google Sheets (httplib2), PostgreSQL (psycopg2 в «зеленом» режиме), паузы
+регулятора квот и SSE-подписки отдают цикл событий другим запросам, а не
+держат поток. Режим sync повторяет модель синхронных воркеров и нужен для
+сравнения (bench/serving.py).
+
+Под gunicorn этот же файл служит конфигом — хук post_worker_init переводит
+psycopg2 в «зеленый» режим внутри gevent-воркера:
+
+    gunicorn -k gevent -c serve.py --worker-connections 1000 app:app
+
+С несколькими воркерами задачи по расписанию выполняет один отдельный
+процесс — `flask --app app jobs run` (веб-процессы по умолчанию задачи не
+запускают). Второй процесс с планировщиком их не запустит — задачи держат
+advisory-блокировку PostgreSQL.
+"""
+
+import os
+import sys
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'gevent')  # gevent | sync
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('PORT', 5000))
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))  # режим sync
+SERVER_MAX_GREENLETS = int(os.environ.get('SERVER_MAX_GREENLETS', 1000))  # режим gevent
+
+
+def make_psycopg_green():
+    """Ожидание ответа PostgreSQL уступает цикл событий gevent вместо блокировки"""
+    import psycopg2
+    import psycopg2.extensions
+    from gevent.socket import wait_read, wait_write
+
+    def gevent_wait_callback(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == psycopg2.extensions.POLL_OK:
+                break
+            elif state == psycopg2.extensions.POLL_READ:
+                wait_read(conn.fileno(), timeout=timeout)
+            elif state == psycopg2.extensions.POLL_WRITE:
+                wait_write(conn.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+    psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+
+
+def post_worker_init(worker):
+    """Хук gunicorn: для gevent-воркера включает «зеленый» psycopg2"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if monkey.is_module_patched('socket'):
+        make_psycopg_green()
+
+
+def serve_gevent():
+    try:
+        from gevent import monkey
+    except ImportError:
+        sys.exit("Для SERVER_MODE=gevent нужен пакет gevent (pip install gevent)")
+    monkey.patch_all()
+    make_psycopg_green()
+
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+    from app import app, logger
+
+    logger.info(f"🚀 Сервер gevent на {SERVER_HOST}:{SERVER_PORT} (до {SERVER_MAX_GREENLETS} запросов одновременно)")
+    WSGIServer((SERVER_HOST, SERVER_PORT), app, spawn=Pool(SERVER_MAX_GREENLETS), log=None).serve_forever()
+
+
+def serve_sync():
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.serving import BaseWSGIServer
+    from app import app, logger
+
+    class PooledWSGIServer(BaseWSGIServer):
+        """Каждый запрос занимает поток из пула до конца, как синхронный воркер"""
+
+        def __init__(self, host, port, wsgi_app, threads):
+            super().__init__(host, port, wsgi_app)
+            self._pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self._pool.submit(self._process_request, request, client_address)
+
+        def _process_request(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    logger.info(f"🚀 Синхронный сервер на {SERVER_HOST}:{SERVER_PORT} ({SERVER_THREADS} потоков)")
+    PooledWSGIServer(SERVER_HOST, SERVER_PORT, app, SERVER_THREADS).serve_forever()
+
+
+if __name__ == '__main__':
+    if SERVER_MODE == 'gevent':
+        serve_gevent()
+    elif SERVER_MODE == 'sync':
+        serve_sync()
+    else:
+        sys.exit(f"Неизвестный SERVER_MODE: {SERVER_MODE} (gevent или sync)")
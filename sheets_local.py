@@ -0,0 +1,271 @@
+"""
+НЛО — Футбольная Лига
+Локальная реализация Google Sheets API на SQLite
+
+Повторяет ту часть googleapiclient, которой пользуется app.py:
+spreadsheets().get/batchUpdate и spreadsheets().values().get/update/append/clear,
+каждый вызов возвращает объект-запрос с методом .execute().
+Значения хранятся строками (как FORMATTED_VALUE у Google), пустые ячейки
+и строки в конце диапазона обрезаются так же, как в ответах Google.
+"""
+
+import re
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import quote
+
+A1_RE = re.compile(r'^([A-Z]+)?(\d+)?$')
+
+
+class LocalSheetsError(Exception):
+    """Ошибка запроса (аналог HttpError 400 у Google)"""
+
+
+def column_index(letters):
+    """'A' -> 0, 'K' -> 10, 'AA' -> 26"""
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - ord('A') + 1)
+    return index - 1
+
+
+def parse_range(range_name):
+    """Разбирает 'Лист!B2:E' в (лист, строка0, колонка0, строка1|None, колонка1|None).
+
+    Индексы считаются с нуля, конец включительно; None — без ограничения.
+    Диапазон без ячеек ('Лист') означает весь лист.
+    """
+    sheet, _, cells = range_name.partition('!')
+    sheet = sheet.strip("'")
+    if not cells:
+        return sheet, 0, 0, None, None
+    start, _, end = cells.partition(':')
+    match = A1_RE.match(start)
+    if not match:
+        raise LocalSheetsError(f"Unable to parse range: {range_name}")
+    start_col, start_row = match.groups()
+    row0 = int(start_row) - 1 if start_row else 0
+    col0 = column_index(start_col) if start_col else 0
+    if end:
+        match = A1_RE.match(end)
+        if not match:
+            raise LocalSheetsError(f"Unable to parse range: {range_name}")
+        end_col, end_row = match.groups()
+        row1 = int(end_row) - 1 if end_row else None
+        col1 = column_index(end_col) if end_col else None
+    elif start_row and start_col:
+        row1, col1 = row0, col0
+    else:
+        row1 = row0 if start_row else None
+        col1 = col0 if start_col else None
+    return sheet, row0, col0, row1, col1
+
+
+class LocalRequest:
+    """Аналог googleapiclient.http.HttpRequest (methodId и uri используются в метриках)"""
+
+    def __init__(self, service, method_id, handler, range_name=None):
+        self.service = service
+        self.methodId = f"sheets.spreadsheets.{method_id}"
+        self.uri = f"local://sheets/v4/spreadsheets/{service.spreadsheet_id}"
+        if range_name:
+            self.uri += f"/values/{quote(range_name)}"
+        self._handler = handler
+
+    def execute(self, num_retries=0):
+        if self.service.latency:
+            time.sleep(self.service.latency)
+        return self.service._run(self._handler)
+
+
+class LocalSheetsService:
+    """Таблица в файле SQLite (или в памяти при path=':memory:')"""
+
+    def __init__(self, path, spreadsheet_id='local', title='НЛО (локальная копия)', latency_ms=0.0):
+        self.spreadsheet_id = spreadsheet_id
+        self.title = title
+        self.latency = latency_ms / 1000.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sheets (
+                title TEXT PRIMARY KEY,
+                position INTEGER NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                sheet TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                cells TEXT NOT NULL,
+                PRIMARY KEY (sheet, row_index)
+            )
+        """)
+
+    # --- API, повторяющее googleapiclient ---
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    # --- Выполнение ---
+    def _run(self, handler):
+        # Каждый запрос атомарен, как и у Google
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = handler()
+                self._db.execute("COMMIT")
+                return result
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _sheet_titles(self):
+        return [r[0] for r in self._db.execute("SELECT title FROM sheets ORDER BY position")]
+
+    def _require_sheet(self, sheet):
+        if not self._db.execute("SELECT 1 FROM sheets WHERE title = ?", (sheet,)).fetchone():
+            raise LocalSheetsError(f"Unable to parse range: {sheet}")
+
+    def _read_rows(self, sheet, row0, row1):
+        query = "SELECT row_index, cells FROM rows WHERE sheet = ? AND row_index >= ?"
+        params = [sheet, row0]
+        if row1 is not None:
+            query += " AND row_index <= ?"
+            params.append(row1)
+        return {idx: json.loads(cells) for idx, cells in self._db.execute(query + " ORDER BY row_index", params)}
+
+    def _write_row(self, sheet, row_index, cells):
+        while cells and cells[-1] == '':
+            cells = cells[:-1]
+        if cells:
+            self._db.execute(
+                "INSERT OR REPLACE INTO rows (sheet, row_index, cells) VALUES (?, ?, ?)",
+                (sheet, row_index, json.dumps(cells, ensure_ascii=False))
+            )
+        else:
+            self._db.execute("DELETE FROM rows WHERE sheet = ? AND row_index = ?", (sheet, row_index))
+
+    # --- Операции ---
+    def _get_metadata(self):
+        return {
+            'spreadsheetId': self.spreadsheet_id,
+            'properties': {'title': self.title},
+            'sheets': [
+                {'properties': {'title': title, 'index': i}}
+                for i, title in enumerate(self._sheet_titles())
+            ]
+        }
+
+    def _batch_update(self, body):
+        replies = []
+        for req in body.get('requests', []):
+            if 'addSheet' in req:
+                title = req['addSheet']['properties']['title']
+                if title in self._sheet_titles():
+                    raise LocalSheetsError(f"A sheet with the name \"{title}\" already exists")
+                self._db.execute(
+                    "INSERT INTO sheets (title, position) VALUES (?, (SELECT COUNT(*) FROM sheets))",
+                    (title,)
+                )
+                replies.append({'addSheet': {'properties': {'title': title}}})
+            else:
+                raise LocalSheetsError(f"Unsupported request: {', '.join(req)}")
+        return {'spreadsheetId': self.spreadsheet_id, 'replies': replies}
+
+    def _get(self, range_name):
+        sheet, row0, col0, row1, col1 = parse_range(range_name)
+        self._require_sheet(sheet)
+        stored = self._read_rows(sheet, row0, row1)
+        values = []
+        if stored:
+            for idx in range(row0, max(stored) + 1):
+                cells = stored.get(idx, [])
+                cells = cells[col0:] if col1 is None else cells[col0:col1 + 1]
+                while cells and cells[-1] == '':
+                    cells = cells[:-1]
+                values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        result = {'range': range_name, 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def _write(self, sheet, row0, col0, values):
+        stored = self._read_rows(sheet, row0, row0 + len(values) - 1) if values else {}
+        for i, row_values in enumerate(values):
+            cells = list(stored.get(row0 + i, []))
+            while len(cells) < col0 + len(row_values):
+                cells.append('')
+            for j, value in enumerate(row_values):
+                cells[col0 + j] = '' if value is None else str(value)
+            self._write_row(sheet, row0 + i, cells)
+
+    def _update(self, range_name, body):
+        sheet, row0, col0, _, _ = parse_range(range_name)
+        self._require_sheet(sheet)
+        values = body.get('values', [])
+        self._write(sheet, row0, col0, values)
+        return {
+            'spreadsheetId': self.spreadsheet_id,
+            'updatedRange': range_name,
+            'updatedRows': len(values),
+            'updatedCells': sum(len(r) for r in values)
+        }
+
+    def _append(self, range_name, body):
+        # Как у Google: новая строка пишется сразу после последней непустой строки таблицы
+        sheet, _, col0, _, _ = parse_range(range_name)
+        self._require_sheet(sheet)
+        last = self._db.execute("SELECT MAX(row_index) FROM rows WHERE sheet = ?", (sheet,)).fetchone()[0]
+        row0 = 0 if last is None else last + 1
+        values = body.get('values', [])
+        self._write(sheet, row0, col0, values)
+        return {
+            'spreadsheetId': self.spreadsheet_id,
+            'updates': {'updatedRows': len(values), 'updatedCells': sum(len(r) for r in values)}
+        }
+
+    def _clear(self, range_name):
+        sheet, row0, col0, row1, col1 = parse_range(range_name)
+        self._require_sheet(sheet)
+        for idx, cells in self._read_rows(sheet, row0, row1).items():
+            end = len(cells) - 1 if col1 is None else min(col1, len(cells) - 1)
+            for j in range(col0, end + 1):
+                cells[j] = ''
+            self._write_row(sheet, idx, cells)
+        return {'spreadsheetId': self.spreadsheet_id, 'clearedRange': range_name}
+
+
+class _Spreadsheets:
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, spreadsheetId, **kwargs):
+        return LocalRequest(self._service, 'get', self._service._get_metadata)
+
+    def batchUpdate(self, spreadsheetId, body):
+        return LocalRequest(self._service, 'batchUpdate', lambda: self._service._batch_update(body))
+
+    def values(self):
+        return _Values(self._service)
+
+
+class _Values:
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return LocalRequest(self._service, 'values.get', lambda: self._service._get(range), range)
+
+    def update(self, spreadsheetId, range, body, valueInputOption='RAW', **kwargs):
+        return LocalRequest(self._service, 'values.update', lambda: self._service._update(range, body), range)
+
+    def append(self, spreadsheetId, range, body, valueInputOption='RAW', **kwargs):
+        return LocalRequest(self._service, 'values.append', lambda: self._service._append(range, body), range)
+
+    def clear(self, spreadsheetId, range, body=None, **kwargs):
+        return LocalRequest(self._service, 'values.clear', lambda: self._service._clear(range), range)
@@ -43,15 +43,20 @@ CREATE TABLE IF NOT EXISTS leaderboard_cache (
     UNIQUE (week_start_iso)
 );
 
--- Транзакции (изменения кредитов и XP)
+-- Транзакции (изменения кредитов и XP), партиционированы по месяцам.
+-- Месячные партиции создает приложение (ensure_transaction_partitions),
+-- старые выгружаются в ARCHIVE_DIR (archive_transaction_partitions).
 CREATE TABLE IF NOT EXISTS transactions (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     amount INTEGER NOT NULL,
     type TEXT NOT NULL CHECK (type IN ('credit', 'xp', 'bet', 'reward')),
     reason TEXT,
-    created_at TIMESTAMP NOT NULL DEFAULT NOW()
-);
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS transactions_default PARTITION OF transactions DEFAULT;
 
 -- История лидерборда
 CREATE TABLE IF NOT EXISTS leaderboard_history (
@@ -63,7 +68,94 @@ CREATE TABLE IF NOT EXISTS leaderboard_history (
     total_bets INTEGER NOT NULL,
     win_percent NUMERIC(5,2) NOT NULL,
     rank INTEGER NOT NULL,
-    reward_given BOOLEAN NOT NULL DEFAULT false
+    reward_given BOOLEAN NOT NULL DEFAULT false,
+    season TEXT
+);
+
+-- Счетчики ограничителя частоты запросов (RATE_LIMIT_BACKEND=postgres)
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+    key TEXT NOT NULL,
+    window_index BIGINT NOT NULL,
+    hits INTEGER NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (key, window_index)
+);
+
+-- Суммы ставок и возможных выплат по исходам матчей
+CREATE TABLE IF NOT EXISTS match_exposure (
+    match_id TEXT NOT NULL,
+    market TEXT NOT NULL,  -- bet_type: '1x2', 'total', 'exact_score'
+    selection TEXT NOT NULL,
+    stake_total BIGINT NOT NULL DEFAULT 0,
+    bets_count INTEGER NOT NULL DEFAULT 0,
+    potential_payout NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (match_id, market, selection)
+);
+
+-- Ответы на POST с Idempotency-Key (повторы клиента возвращают сохраненный ответ)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id BIGINT NOT NULL,
+    endpoint TEXT NOT NULL,
+    key TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    status_code SMALLINT,  -- NULL, пока первый запрос выполняется
+    response JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, endpoint, key)
+);
+
+-- Outbox уведомлений Telegram (пишется в транзакции события)
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,  -- level_up, achievement, weekly_reward, checkin_reminder
+    dedupe_key TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, sending, sent, failed, superseded
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    send_after TIMESTAMP NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMP,
+    lease_until TIMESTAMP  -- аренда пакета, пока status = 'sending'
+);
+
+-- Лайки матчей (один на пользователя)
+CREATE TABLE IF NOT EXISTS match_likes (
+    match_id TEXT NOT NULL,
+    user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (match_id, user_id)
+);
+
+-- Комментарии к матчам
+CREATE TABLE IF NOT EXISTS match_comments (
+    id BIGSERIAL PRIMARY KEY,
+    match_id TEXT NOT NULL,
+    user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    text TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Счетчики лайков и комментариев (пишутся пакетами из памяти воркеров)
+CREATE TABLE IF NOT EXISTS match_social_counters (
+    match_id TEXT PRIMARY KEY,
+    likes INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Архив завершенных сезонов (только чтение): матчи и посчитанные итоги
+CREATE TABLE IF NOT EXISTS season_archive (
+    season TEXT PRIMARY KEY,
+    archived_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    summary JSONB NOT NULL,
+    standings JSONB NOT NULL,
+    top_scorers JSONB NOT NULL,
+    top_assists JSONB NOT NULL,
+    bettors JSONB NOT NULL,
+    matches JSONB NOT NULL
 );
 
 -- Лог админ-действий
@@ -78,11 +170,19 @@ CREATE TABLE IF NOT EXISTS admin_actions_log (
 -- Индексы для оптимизации
 CREATE INDEX IF NOT EXISTS idx_users_credits ON users(credits);
 CREATE INDEX IF NOT EXISTS idx_users_xp ON users(xp);
+CREATE INDEX IF NOT EXISTS idx_users_banned ON users(banned_until) WHERE banned_until IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_achievements_user ON achievements_unlocked(user_id);
 CREATE INDEX IF NOT EXISTS idx_leaderboard_week ON leaderboard_cache(week_start_iso);
 CREATE INDEX IF NOT EXISTS idx_leaderboard_history_week ON leaderboard_history(week_start_iso);
-CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_history_season ON leaderboard_history(season);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_time ON transactions(user_id, created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_transactions_time ON transactions(created_at);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notification_outbox_dedupe ON notification_outbox(user_id, dedupe_key) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_match_likes_user ON match_likes(user_id);
+CREATE INDEX IF NOT EXISTS idx_match_comments_match_time ON match_comments(match_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox(send_after, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_lease ON notification_outbox(lease_until) WHERE status = 'sending';
 
 -- Триггер для обновления updated_at
 CREATE OR REPLACE FUNCTION update_modified_column()
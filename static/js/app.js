@@ -15,23 +15,92 @@ document.addEventListener('DOMContentLoaded', () => {
     // Глобальные переменные
     const app = {
         userId: null,
+        authToken: null,  // Токен сессии после входа по initData
         currentPage: 'splash',
         userData: null,
         matches: [],
+        betSlip: [],  // Исходы купона: { matchId, title, betType, selection, amount }
+        social: { counters: {}, liked: new Set() },  // Лайки и комментарии матчей
+        commentCursors: {},  // match_id -> курсор следующей страницы комментариев
         achievements: {}  // Данные об ачивках
     };
 
+    // Данные, встроенные сервером в страницу: каталог ачивок и адреса статики с хэшем
+    const boot = window.NLO_BOOT || { achievements: null, assets: {} };
+    const assetUrl = (path) => boot.assets[path] || `/static/${path}`;
+
     // Получаем OWNER_TELEGRAM_ID из скрытого элемента (переданного из бэкенда)
     const ownerTelegramId = document.getElementById('owner-telegram-id')?.dataset.value || '';
 
+    // Вход по initData Telegram: бэкенд проверяет подпись и выдает токен сессии
+    const login = async () => {
+        const initData = window.Telegram?.WebApp?.initData;
+        if (!initData) return false;
+        
+        try {
+            const response = await fetch('/api/auth/telegram', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ init_data: initData })
+            });
+            if (!response.ok) {
+                throw new Error(`Ошибка авторизации: ${response.status}`);
+            }
+            
+            const data = await response.json();
+            app.authToken = data.token;
+            app.userId = data.user_id;
+            console.log(`Авторизован пользователь: ${app.userId}`);
+            return true;
+        } catch (error) {
+            console.error('Ошибка авторизации:', error);
+            return false;
+        }
+    };
+
+    // Ключ идемпотентности: повтор запроса с ним не выполнит действие второй раз
+    const newIdempotencyKey = () => {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    };
+
+    // Запрос к API с токеном сессии; истекший токен обновляется один раз.
+    // Запросы с Idempotency-Key безопасно повторяются при сетевой ошибке
+    const apiFetch = async (url, options = {}) => {
+        const send = () => fetch(url, {
+            ...options,
+            headers: {
+                ...(options.headers || {}),
+                ...(app.authToken ? { 'Authorization': `Bearer ${app.authToken}` } : {})
+            }
+        });
+        
+        let response;
+        try {
+            response = await send();
+        } catch (error) {
+            if (!(options.headers || {})['Idempotency-Key']) throw error;
+            console.warn('Сетевая ошибка, повторяем запрос:', error);
+            response = await send();
+        }
+        if (response.status === 401 && app.authToken && await login()) {
+            response = await send();
+        }
+        return response;
+    };
+
     // Загрузка данных пользователя
     const loadUserData = async () => {
         try {
-            const urlParams = new URLSearchParams(window.location.search);
-            app.userId = urlParams.get('user_id') || '123456';
+            if (!app.authToken) {
+                const urlParams = new URLSearchParams(window.location.search);
+                app.userId = urlParams.get('user_id') || '123456';
+            }
             console.log(`Загрузка данных для пользователя: ${app.userId}`);
             
-            const response = await fetch(`/api/profile?user_id=${app.userId}`);
+            const response = await apiFetch(`/api/profile?user_id=${app.userId}`);
             if (!response.ok) {
                 throw new Error(`Ошибка загрузки профиля: ${response.status}`);
             }
@@ -66,56 +135,102 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
-    // Загрузка данных об ачивках (ИСПРАВЛЕНО!)
-    const loadAchievements = async () => {
+    // Счетчики лайков и комментариев
+    const loadSocial = async () => {
         try {
-            console.log('Загрузка данных об ачивках...');
-            
-            // ИСПОЛЬЗУЕМ ОТНОСИТЕЛЬНЫЙ ПУТЬ И УБЕЖДАЕМСЯ, ЧТО ФАЙЛ В ПАПКЕ static
-            const response = await fetch('/achievements.json');
-            
+            const response = await apiFetch(`/api/matches/social?user_id=${app.userId}`);
             if (!response.ok) {
-                throw new Error(`Ошибка загрузки ачивок: ${response.status}`);
+                throw new Error(`Ошибка загрузки лайков: ${response.status}`);
             }
             
-            app.achievements = await response.json();
-            console.log('Данные об ачивках загружены');
+            const data = await response.json();
+            app.social.counters = data.counters || {};
+            app.social.liked = new Set(data.liked || []);
             return true;
         } catch (error) {
-            console.error('Ошибка загрузки ачивок:', error);
-            
-            // Создаем минимальные данные об ачивках
-            app.achievements = {
-                "bets_made": {
-                    "title": "Новичок прогноза",
-                    "description": "Сделайте 10 ставок",
-                    "bronze_threshold": 10,
-                    "silver_threshold": 100,
-                    "gold_threshold": 1000,
-                    "image_paths": {
-                        "bronze": "bets_bronze.png",
-                        "silver": "bets_silver.png",
-                        "gold": "bets_gold.png"
-                    }
-                },
-                "exact_scores": {
-                    "title": "Точный счёт",
-                    "description": "Угадайте точный счёт матча",
-                    "bronze_threshold": 1,
-                    "silver_threshold": 10,
-                    "gold_threshold": 50,
-                    "image_paths": {
-                        "bronze": "exact_bronze.png",
-                        "silver": "exact_silver.png",
-                        "gold": "exact_gold.png"
-                    }
-                }
-                // Другие базовые ачивки...
-            };
-            
-            console.warn('Используются минимальные данные об ачивках');
+            console.error('Ошибка загрузки лайков и комментариев:', error);
+            return false;
+        }
+    };
+
+    // Live-обновления матчей через Server-Sent Events
+    const subscribeMatchUpdates = () => {
+        if (!window.EventSource) {
+            console.warn('EventSource не поддерживается, live-обновления отключены');
+            return;
+        }
+        
+        const source = new EventSource('/api/matches/stream');
+        let reconnecting = false;
+        
+        // Применяем дельту: измененные матчи заменяем, новые добавляем, удаленные убираем
+        source.addEventListener('delta', (e) => {
+            try {
+                const delta = JSON.parse(e.data);
+                const removed = new Set(delta.removed || []);
+                const byId = new Map(app.matches.map(m => [m.match_id, m]));
+                (delta.changed || []).forEach(m => byId.set(m.match_id, m));
+                app.matches = [...byId.values()].filter(m => !removed.has(m.match_id));
+                renderMatches();
+            } catch (error) {
+                console.error('Ошибка применения обновления матчей:', error);
+            }
+        });
+        
+        // Сервер просит перечитать расписание целиком
+        source.addEventListener('refresh', async () => {
+            if (await loadMatches()) renderMatches();
+        });
+        
+        // После переподключения дельты могли потеряться — перечитываем расписание
+        source.addEventListener('open', async () => {
+            if (reconnecting && await loadMatches()) renderMatches();
+            reconnecting = false;
+        });
+        source.addEventListener('error', () => {
+            reconnecting = true;
+        });
+    };
+
+    // Загрузка данных об ачивках (ИСПРАВЛЕНО!)
+    const loadAchievements = async () => {
+        // Каталог встраивает в страницу сервер (NLO_BOOT), отдельного запроса нет
+        if (boot.achievements) {
+            app.achievements = boot.achievements;
             return true;
         }
+        
+        // Сервер не смог прочитать каталог — создаем минимальные данные об ачивках
+        app.achievements = {
+            "bets_made": {
+                "title": "Новичок прогноза",
+                "description": "Сделайте 10 ставок",
+                "bronze_threshold": 10,
+                "silver_threshold": 100,
+                "gold_threshold": 1000,
+                "image_paths": {
+                    "bronze": "bets_bronze.png",
+                    "silver": "bets_silver.png",
+                    "gold": "bets_gold.png"
+                }
+            },
+            "exact_scores": {
+                "title": "Точный счёт",
+                "description": "Угадайте точный счёт матча",
+                "bronze_threshold": 1,
+                "silver_threshold": 10,
+                "gold_threshold": 50,
+                "image_paths": {
+                    "bronze": "exact_bronze.png",
+                    "silver": "exact_silver.png",
+                    "gold": "exact_gold.png"
+                }
+            }
+            // Другие базовые ачивки...
+        };
+        
+        console.warn('Используются минимальные данные об ачивках');
+        return true;
     };
 
     // Инициализация приложения
@@ -125,13 +240,16 @@ document.addEventListener('DOMContentLoaded', () => {
         
         try {
             // Загружаем данные
+            await login();
             await loadUserData();
             await loadMatches();
+            await loadSocial();
             await loadAchievements();
             
             // Рендерим данные
             renderProfile();
             renderMatches();
+            subscribeMatchUpdates();
             
             // Проверяем, является ли пользователь владельцем
             initAdminPanel();
@@ -284,8 +402,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     const achievementEl = document.createElement('div');
                     achievementEl.className = `achievement-card ${tierClass}`;
                     achievementEl.innerHTML = `
-                        <img src="/static/img/achievements/${achievement.key}_${tierClass}.png" 
-                             alt="${achievementData.title}" onerror="this.onerror=null;this.src='/static/img/achievements/placeholder.png'">
+                        <img src="${assetUrl(`img/achievements/${achievement.key}_${tierClass}.png`)}" 
+                             alt="${achievementData.title}" onerror="this.onerror=null;this.src='${assetUrl('img/achievements/placeholder.png')}'">
                         <div class="achievement-info">
                             <h4>${achievementData.title}</h4>
                             <p>${achievementData.description}</p>
@@ -330,6 +448,9 @@ document.addEventListener('DOMContentLoaded', () => {
                         return;
                     }
                     
+                    const counters = app.social.counters[match.match_id] || { likes: 0, comments: 0 };
+                    const liked = app.social.liked.has(match.match_id);
+                    
                     const matchEl = document.createElement('div');
                     matchEl.className = 'match-card';
                     matchEl.innerHTML = `
@@ -350,6 +471,22 @@ document.addEventListener('DOMContentLoaded', () => {
                         </div>
                         <div class="match-venue">${match.venue || 'Место не указано'}</div>
                         <button class="bet-button" data-match-id="${match.match_id}">Сделать ставку</button>
+                        <div class="match-social">
+                            <button class="like-button ${liked ? 'liked' : ''}" data-match-id="${match.match_id}">
+                                ♥ <span class="like-count">${counters.likes}</span>
+                            </button>
+                            <button class="comments-button" data-match-id="${match.match_id}">
+                                💬 <span class="comments-count">${counters.comments}</span>
+                            </button>
+                        </div>
+                        <div class="match-comments" style="display: none;">
+                            <div class="comments-list"></div>
+                            <button class="comments-more" style="display: none;">Показать еще</button>
+                            <div class="comment-form">
+                                <input type="text" class="comment-input" maxlength="500" placeholder="Ваш комментарий">
+                                <button class="comment-send">Отправить</button>
+                            </div>
+                        </div>
                     `;
                     
                     container.appendChild(matchEl);
@@ -366,6 +503,14 @@ document.addEventListener('DOMContentLoaded', () => {
                 });
             });
             
+            document.querySelectorAll('.like-button').forEach(button => {
+                button.addEventListener('click', () => toggleLike(button));
+            });
+            
+            document.querySelectorAll('.comments-button').forEach(button => {
+                button.addEventListener('click', () => toggleComments(button));
+            });
+            
             console.log('Матчи успешно отрендерены');
         } catch (error) {
             console.error('Критическая ошибка при рендере матчей:', error);
@@ -373,6 +518,133 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // Лайк матча: повторное нажатие снимает лайк
+    const toggleLike = async (button) => {
+        const matchId = button.dataset.matchId;
+        const liked = app.social.liked.has(matchId);
+        
+        try {
+            const response = await apiFetch(`/api/matches/${encodeURIComponent(matchId)}/like`, {
+                method: liked ? 'DELETE' : 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ user_id: app.userId })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Ошибка лайка');
+            }
+            
+            if (data.liked) {
+                app.social.liked.add(matchId);
+            } else {
+                app.social.liked.delete(matchId);
+            }
+            const counters = app.social.counters[matchId] || { likes: 0, comments: 0 };
+            counters.likes = data.likes;
+            app.social.counters[matchId] = counters;
+            
+            button.classList.toggle('liked', data.liked);
+            button.querySelector('.like-count').textContent = data.likes;
+        } catch (error) {
+            console.error('Ошибка лайка:', error);
+            showNotification(error.message || 'Ошибка лайка', 'error');
+        }
+    };
+
+    // Комментарии: раскрытие под карточкой матча и подгрузка страницами
+    const renderComment = (comment) => {
+        const item = document.createElement('div');
+        item.className = 'comment';
+        
+        const author = document.createElement('span');
+        author.className = 'comment-author';
+        author.textContent = comment.name;
+        
+        const text = document.createElement('span');
+        text.className = 'comment-text';
+        text.textContent = comment.text;
+        
+        item.appendChild(author);
+        item.appendChild(text);
+        return item;
+    };
+    
+    const loadComments = async (matchId, panel) => {
+        const cursor = app.commentCursors[matchId];
+        const params = new URLSearchParams({ limit: 20 });
+        if (cursor) params.set('cursor', cursor);
+        
+        try {
+            const response = await apiFetch(`/api/matches/${encodeURIComponent(matchId)}/comments?${params}`);
+            if (!response.ok) {
+                throw new Error(`Ошибка загрузки комментариев: ${response.status}`);
+            }
+            
+            const data = await response.json();
+            const list = panel.querySelector('.comments-list');
+            data.items.forEach(comment => list.appendChild(renderComment(comment)));
+            app.commentCursors[matchId] = data.next_cursor;
+            panel.querySelector('.comments-more').style.display = data.next_cursor ? 'block' : 'none';
+        } catch (error) {
+            console.error('Ошибка загрузки комментариев:', error);
+            showNotification('Не удалось загрузить комментарии', 'error');
+        }
+    };
+    
+    const sendComment = async (matchId, panel, card) => {
+        const input = panel.querySelector('.comment-input');
+        const text = input.value.trim();
+        if (!text) return;
+        
+        try {
+            const response = await apiFetch(`/api/matches/${encodeURIComponent(matchId)}/comments`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': newIdempotencyKey()
+                },
+                body: JSON.stringify({ user_id: app.userId, text: text })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Ошибка отправки комментария');
+            }
+            
+            input.value = '';
+            panel.querySelector('.comments-list').prepend(renderComment(data.comment));
+            
+            const counters = app.social.counters[matchId] || { likes: 0, comments: 0 };
+            counters.comments += 1;
+            app.social.counters[matchId] = counters;
+            card.querySelector('.comments-count').textContent = counters.comments;
+        } catch (error) {
+            console.error('Ошибка отправки комментария:', error);
+            showNotification(error.message || 'Ошибка отправки комментария', 'error');
+        }
+    };
+    
+    const toggleComments = (button) => {
+        const matchId = button.dataset.matchId;
+        const card = button.closest('.match-card');
+        const panel = card.querySelector('.match-comments');
+        
+        if (panel.style.display !== 'none') {
+            panel.style.display = 'none';
+            return;
+        }
+        panel.style.display = 'block';
+        
+        if (!panel.dataset.loaded) {
+            panel.dataset.loaded = 'true';
+            app.commentCursors[matchId] = null;
+            panel.querySelector('.comments-more').addEventListener('click', () => loadComments(matchId, panel));
+            panel.querySelector('.comment-send').addEventListener('click', () => sendComment(matchId, panel, card));
+            loadComments(matchId, panel);
+        }
+    };
+
     // Текст для статуса матча
     const getStatusText = (status) => {
         const statuses = {
@@ -419,6 +691,12 @@ document.addEventListener('DOMContentLoaded', () => {
             document.getElementById('bet-type-exact').style.display = 'block';
         }
         
+        // Выбор исхода начинается заново, купон сохраняется между матчами
+        document.querySelectorAll('#bet-modal .bet-option.selected').forEach(el => {
+            el.classList.remove('selected');
+        });
+        renderBetSlip();
+        
         modal.style.display = 'block';
     };
 
@@ -442,8 +720,7 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
         
-        const betType = document.querySelector('input[name="bet-type"]:checked')?.value;
-        const selection = document.querySelector('input[name="selection"]:checked')?.value;
+        const { betType, selection } = getSelectedBet();
         const amount = parseInt(document.getElementById('bet-amount').value);
         
         if (!betType || !selection || !amount || amount <= 0) {
@@ -453,10 +730,11 @@ document.addEventListener('DOMContentLoaded', () => {
         
         try {
             console.log(`Размещение ставки: ${betType} ${selection} ${amount}`);
-            const response = await fetch('/api/bet', {
+            const response = await apiFetch('/api/bet', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': newIdempotencyKey()
                 },
                 body: JSON.stringify({
                     user_id: app.userId,
@@ -486,14 +764,145 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // Выбранный в модальном окне исход: радиокнопки или выделенный вариант
+    const BET_TYPE_BY_BLOCK = {
+        'bet-type-1x2': '1x2',
+        'bet-type-total': 'total',
+        'bet-type-exact': 'exact_score'
+    };
+    
+    const getSelectedBet = () => {
+        const checkedType = document.querySelector('input[name="bet-type"]:checked')?.value;
+        const checkedSelection = document.querySelector('input[name="selection"]:checked')?.value;
+        if (checkedType && checkedSelection) {
+            return { betType: checkedType, selection: checkedSelection };
+        }
+        
+        const option = document.querySelector('#bet-modal .bet-option.selected');
+        if (!option) return {};
+        return {
+            betType: BET_TYPE_BY_BLOCK[option.closest('.bet-type')?.id],
+            selection: option.dataset.value
+        };
+    };
+
+    // Купон: несколько исходов размещаются одним запросом
+    const renderBetSlip = () => {
+        const slipEl = document.getElementById('bet-slip');
+        const itemsEl = document.getElementById('bet-slip-items');
+        const totalEl = document.getElementById('bet-slip-total');
+        if (!slipEl || !itemsEl) return;
+        
+        slipEl.style.display = app.betSlip.length ? 'block' : 'none';
+        itemsEl.innerHTML = '';
+        app.betSlip.forEach((item, index) => {
+            const row = document.createElement('div');
+            row.className = 'bet-slip-item';
+            
+            const label = document.createElement('span');
+            label.textContent = `${item.title}: ${item.selection} — ${item.amount}`;
+            
+            const remove = document.createElement('button');
+            remove.className = 'bet-slip-remove';
+            remove.innerHTML = '&times;';
+            remove.addEventListener('click', () => {
+                app.betSlip.splice(index, 1);
+                renderBetSlip();
+            });
+            
+            row.appendChild(label);
+            row.appendChild(remove);
+            itemsEl.appendChild(row);
+        });
+        
+        const mode = document.getElementById('bet-slip-mode')?.value;
+        const amount = parseInt(document.getElementById('bet-amount').value) || 0;
+        const total = mode === 'accumulator'
+            ? amount
+            : app.betSlip.reduce((sum, item) => sum + item.amount, 0);
+        if (totalEl) totalEl.textContent = total;
+    };
+    
+    const addToBetSlip = () => {
+        const modal = document.getElementById('bet-modal');
+        const matchId = modal?.dataset.matchId;
+        const { betType, selection } = getSelectedBet();
+        const amount = parseInt(document.getElementById('bet-amount').value);
+        
+        if (!matchId || !betType || !selection || !amount || amount <= 0) {
+            showNotification('Пожалуйста, заполните все поля корректно', 'error');
+            return;
+        }
+        
+        const match = app.matches.find(m => m.match_id === matchId);
+        app.betSlip.push({
+            matchId,
+            title: match ? `${match.home_team} vs ${match.away_team}` : matchId,
+            betType,
+            selection,
+            amount
+        });
+        renderBetSlip();
+        showNotification('Исход добавлен в купон', 'success');
+    };
+    
+    const placeBetSlip = async () => {
+        if (!app.betSlip.length) return;
+        
+        const mode = document.getElementById('bet-slip-mode')?.value || 'singles';
+        const stake = parseInt(document.getElementById('bet-amount').value);
+        
+        try {
+            console.log(`Размещение купона: ${mode}, исходов: ${app.betSlip.length}`);
+            const response = await apiFetch('/api/bet-slip', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': newIdempotencyKey()
+                },
+                body: JSON.stringify({
+                    user_id: app.userId,
+                    mode: mode,
+                    stake: stake,
+                    selections: app.betSlip.map(item => ({
+                        match_id: item.matchId,
+                        bet_type: item.betType,
+                        selection: item.selection,
+                        amount: item.amount
+                    }))
+                })
+            });
+            
+            const data = await response.json();
+            
+            if (response.ok && data.success) {
+                const odds = data.bets.map(bet => bet.odds).join(', ');
+                showNotification(`Купон размещен! Коэффициенты: ${odds}`, 'success');
+                app.betSlip = [];
+                renderBetSlip();
+                closeBetModal();
+                
+                // Обновляем данные пользователя
+                await loadUserData();
+                renderProfile();
+            } else {
+                throw new Error(data.error || 'Ошибка при размещении купона');
+            }
+        } catch (error) {
+            console.error('Ошибка купона:', error);
+            showNotification(error.message || 'Ошибка при размещении купона', 'error');
+        }
+    };
+
     // Ежедневный чек-ин
     const dailyCheckin = async () => {
         try {
             console.log('Ежедневный чек-ин...');
-            const response = await fetch('/api/daily-checkin', {
+            const response = await apiFetch('/api/daily-checkin', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': newIdempotencyKey()
                 },
                 body: JSON.stringify({ user_id: app.userId })
             });
@@ -562,6 +971,32 @@ document.addEventListener('DOMContentLoaded', () => {
             placeBetButton.addEventListener('click', placeBet);
         }
         
+        // Выбор исхода в модальном окне
+        document.querySelectorAll('#bet-modal .bet-option').forEach(option => {
+            option.addEventListener('click', () => {
+                document.querySelectorAll('#bet-modal .bet-option.selected').forEach(el => {
+                    el.classList.remove('selected');
+                });
+                option.classList.add('selected');
+            });
+        });
+        
+        // Купон
+        const addToSlipButton = document.getElementById('add-to-slip-button');
+        if (addToSlipButton) {
+            addToSlipButton.addEventListener('click', addToBetSlip);
+        }
+        
+        const placeSlipButton = document.getElementById('place-slip-button');
+        if (placeSlipButton) {
+            placeSlipButton.addEventListener('click', placeBetSlip);
+        }
+        
+        const slipModeSelect = document.getElementById('bet-slip-mode');
+        if (slipModeSelect) {
+            slipModeSelect.addEventListener('change', renderBetSlip);
+        }
+        
         // Выбор суммы ставки
         document.querySelectorAll('.bet-amount-option').forEach(option => {
             option.addEventListener('click', () => {
@@ -619,8 +1054,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const initAdminPanel = () => {
         try {
             console.log('Инициализация админ-панели...');
-            const urlParams = new URLSearchParams(window.location.search);
-            const userId = urlParams.get('user_id');
+            const userId = app.userId;
             
             // Сравниваем с ownerTelegramId из скрытого элемента
             if (userId && ownerTelegramId && userId === ownerTelegramId) {